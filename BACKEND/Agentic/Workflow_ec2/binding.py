@@ -0,0 +1,258 @@
+"""
+Binding of node data (config_inputs + data_flow_inputs) to tool parameters.
+
+Every tool node used to ask the LLM to turn the node's data into the keyword
+arguments of the tool method. Most of the time the keys already are the
+parameter names, or the parameter name with the `_<agent id>` suffix the
+workflow generator puts on data flow keys. bind() matches those directly:
+
+1. exact parameter name
+2. normalized name (case, separators and the `_<id>` suffix ignored)
+3. the value is coerced to the parameter's annotation, or to the type of its
+   default when it has no annotation
+
+Only the parameters still missing afterwards go to the LLM, together with
+the parameters left at a non-string default when some data keys matched no
+parameter (`num_videos` for `max_results=10`). When every value
+the LLM returned is exactly one of the node's input values (or the
+parameter's own default), the answer is remembered
+as a {parameter: input key} mapping, per (workflow, node, input key shape), in
+process memory and in redis, so later runs and iterator elements skip the LLM.
+"""
+
+import hashlib
+import inspect
+import json
+import logging
+import os
+import re
+import threading
+
+BINDING_CACHE_TTL = int(os.getenv("BINDING_CACHE_TTL", str(7 * 24 * 3600)))
+# shorter values ("", "N", 0, true) say nothing about which input they came from
+BINDING_MIN_VALUE_CHARS = int(os.getenv("BINDING_MIN_VALUE_CHARS", "3"))
+
+_SUFFIX = re.compile(r"_\d+$")
+_SEPARATORS = re.compile(r"[^a-z0-9]")
+_TRUE = {"true", "yes", "y", "1"}
+_FALSE = {"false", "no", "n", "0"}
+
+
+def normalize(name):
+    return _SEPARATORS.sub("", _SUFFIX.sub("", name.lower()))
+
+
+def _has_default(param):
+    return param.default is not inspect.Parameter.empty
+
+
+def _needs_value(param):
+    # most tool methods use string defaults to describe the parameter
+    # ("url of the sheet"), those are not values to call the tool with
+    return not _has_default(param) or isinstance(param.default, str)
+
+
+def _target_type(param):
+    if param.annotation is not inspect.Parameter.empty and isinstance(param.annotation, type):
+        return param.annotation
+    if _has_default(param) and param.default is not None and not isinstance(param.default, str):
+        return type(param.default)
+    return None
+
+
+def coerce(value, target):
+    """value converted to target, raises ValueError when it cannot be."""
+    if target is None or isinstance(value, target) and not (target is int and isinstance(value, bool)):
+        return value
+    if target is bool:
+        if isinstance(value, (int, float)):
+            return bool(value)
+        if isinstance(value, str) and value.strip().lower() in _TRUE | _FALSE:
+            return value.strip().lower() in _TRUE
+        raise ValueError(f"cannot read {value!r} as bool")
+    if target is int:
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        if isinstance(value, str):
+            return int(value.strip())
+        raise ValueError(f"cannot read {value!r} as int")
+    if target is float:
+        if isinstance(value, (int, str)) and not isinstance(value, bool):
+            return float(value)
+        raise ValueError(f"cannot read {value!r} as float")
+    if target is str:
+        if isinstance(value, (dict, list)):
+            return json.dumps(value)
+        return str(value)
+    if target in (list, dict):
+        if isinstance(value, str):
+            try:
+                parsed = json.loads(value)
+            except json.JSONDecodeError:
+                parsed = None
+            if isinstance(parsed, target):
+                return parsed
+        if target is list and isinstance(value, (tuple, set)):
+            return list(value)
+        if target is list:
+            return [value]
+        raise ValueError(f"cannot read {value!r} as {target.__name__}")
+    return value
+
+
+def bind(params, data):
+    """
+    Deterministic part of the binding.
+    Returns (bound kwargs, names of parameters still needing a value, unused data keys).
+    """
+    named = [p for p in params if p.kind not in (inspect.Parameter.VAR_POSITIONAL, inspect.Parameter.VAR_KEYWORD)]
+    bound = {}
+    unused = dict(data)
+
+    def take(param, key):
+        try:
+            bound[param.name] = coerce(unused[key], _target_type(param))
+        except (ValueError, TypeError, json.JSONDecodeError):
+            return False
+        del unused[key]
+        return True
+
+    for param in named:
+        if param.name in unused:
+            take(param, param.name)
+
+    by_normalized = {}
+    for key in unused:
+        by_normalized.setdefault(normalize(key), []).append(key)
+    for param in named:
+        if param.name in bound:
+            continue
+        keys = [key for key in by_normalized.get(normalize(param.name), []) if key in unused]
+        if len(keys) == 1:
+            take(param, keys[0])
+
+    missing = [p.name for p in named if p.name not in bound and _needs_value(p)]
+    return bound, missing, list(unused)
+
+
+def key_shape(data):
+    shape = sorted((key, type(value).__name__) for key, value in data.items())
+    return hashlib.sha256(json.dumps(shape).encode("utf-8")).hexdigest()[:16]
+
+
+def is_trivial(value):
+    return value is None or isinstance(value, bool) or len(str(value).strip()) < BINDING_MIN_VALUE_CHARS
+
+
+def infer_mapping(values, data, params):
+    """
+    {parameter: data key} explaining every LLM value, or None if some value is
+    neither the parameter's own default (mapped to None) nor exactly one input
+    value that is not trivial (an empty input may hold a real value next time).
+    """
+    defaults = {p.name: p.default for p in params if _has_default(p)}
+    mapping = {}
+    for name, value in values.items():
+        matches = [key for key, item in data.items() if item == value or str(item) == str(value)]
+        if not matches and name in defaults and defaults[name] == value:
+            mapping[name] = None
+        elif len(matches) == 1 and not is_trivial(value):
+            mapping[name] = matches[0]
+        else:
+            return None
+    return mapping
+
+
+class BindingCache:
+    """LLM binding mappings in process memory, backed by redis when a client is given."""
+
+    def __init__(self, redis_client=None, ttl=BINDING_CACHE_TTL):
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self._local = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(wid, node, shape):
+        return f"binding:{wid}:{node}:{shape}"
+
+    def get(self, key):
+        with self._lock:
+            if key in self._local:
+                return self._local[key]
+        if self.redis_client is None:
+            return None
+        try:
+            raw = self.redis_client.get(key)
+        except Exception as e:
+            logging.error("Binding cache read failed: %s", e)
+            return None
+        if raw is None:
+            return None
+        mapping = json.loads(raw)
+        with self._lock:
+            self._local[key] = mapping
+        return mapping
+
+    def put(self, key, mapping):
+        with self._lock:
+            self._local[key] = mapping
+        if self.redis_client is None:
+            return
+        try:
+            self.redis_client.set(key, json.dumps(mapping), ex=self.ttl)
+        except Exception as e:
+            logging.error("Binding cache write failed: %s", e)
+
+
+def apply_mapping(mapping, params, data):
+    """kwargs from a cached mapping, None if the data no longer fits it."""
+    by_name = {p.name: p for p in params}
+    kwargs = {}
+    for name, key in mapping.items():
+        if key is None:
+            continue
+        if key not in data:
+            return None
+        param = by_name.get(name)
+        try:
+            kwargs[name] = coerce(data[key], _target_type(param)) if param is not None else data[key]
+        except (ValueError, TypeError, json.JSONDecodeError):
+            return None
+    return kwargs
+
+
+async def bind_arguments(params, data, cache, cache_key, llm_fallback):
+    """
+    kwargs for calling a tool with `params` from the node's `data`.
+    llm_fallback(missing parameter names, data) is awaited for whatever bind()
+    and the cached mapping cannot fill, and returns a dict of values.
+    """
+    bound, missing, unused = bind(params, data)
+    accepts_extra = any(p.kind == inspect.Parameter.VAR_KEYWORD for p in params)
+    if unused:
+        # an unmatched key may be meant for a parameter that kept its default
+        missing += [p.name for p in params if p.name not in bound and p.name not in missing
+                    and _has_default(p) and p.kind != inspect.Parameter.VAR_KEYWORD]
+    if not missing and not (accepts_extra and unused):
+        return bound
+
+    mapping = cache.get(cache_key)
+    if mapping is not None:
+        cached = apply_mapping(mapping, params, data)
+        if cached is not None:
+            return {**bound, **cached}
+
+    values = await llm_fallback(missing, data)
+    if not accepts_extra:
+        values = {name: value for name, value in values.items() if name in missing}
+    by_name = {p.name: p for p in params}
+    for name, value in values.items():
+        try:
+            values[name] = coerce(value, _target_type(by_name[name])) if name in by_name else value
+        except (ValueError, TypeError, json.JSONDecodeError):
+            pass
+    mapping = infer_mapping(values, data, params)
+    if mapping is not None:
+        cache.put(cache_key, mapping)
+    return {**bound, **values}
@@ -0,0 +1,104 @@
+"""
+Compiled workflow plans.
+
+Tool nodes used to be resolved on every run, and again for every iterator
+element: the tool classes were collected by scanning globals(), the action was
+looked up with getattr and its parameters read with inspect.signature.
+WorkflowCompiler does that once per workflow version. It builds the execution
+plan (see plan.py) and attaches to every tool step the class or function to
+call together with its parameter list. Tool classes and their action
+signatures come from the shared tool catalog (tools/catalog.py).
+
+Compiled plans are kept in a process-wide LRU keyed by (workflow id, sha256 of
+the workflow json), so a celery worker reuses them across task invocations and
+an edited workflow simply gets a new entry.
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+from Workflow_ec2.plan import build_plan
+from tools.catalog import TOOL_CATALOG
+
+WORKFLOW_PLAN_CACHE_SIZE = int(os.getenv("WORKFLOW_PLAN_CACHE_SIZE", "256"))
+
+# kind: "composio" (target is a tool class, action is its method), "function"
+# (target is a standalone function) or "unavailable". inputs is the
+# [{parameter: default}] list given to the input validator prompt, params the
+# inspect.Parameter list arguments are bound to (without self). error is set
+# when the action could not be resolved.
+CompiledTool = namedtuple("CompiledTool", ["kind", "target", "action", "inputs", "params", "error"])
+
+
+def parameter_list(func):
+    return [{name: param.default if param.default is not inspect.Parameter.empty else None}
+            for name, param in inspect.signature(func).parameters.items()]
+
+
+def parameters(func):
+    return list(inspect.signature(func).parameters.values())
+
+
+def workflow_digest(workflow_json):
+    if not isinstance(workflow_json, str):
+        workflow_json = json.dumps(workflow_json, sort_keys=True)
+    return hashlib.sha256(workflow_json.encode("utf-8")).hexdigest()
+
+
+class WorkflowCompiler:
+    def __init__(self, namespace, max_size=WORKFLOW_PLAN_CACHE_SIZE):
+        # standalone functions are looked up in namespace, tool classes in the
+        # tool catalog. namespace is read lazily, its module may still be importing
+        self.namespace = namespace
+        self.max_size = max_size
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+
+    def compile_tool(self, agent):
+        name = agent["name"].lower()
+        action = agent.get("tool_action", "")
+        catalog = TOOL_CATALOG.get()
+        cls = catalog.tool_class(name)
+        if cls is not None:
+            signature = catalog.signature(cls.__name__, action)
+            if signature is None:
+                return CompiledTool("composio", cls, action, None, None, f"{cls.__name__} has no action {action!r}")
+            return CompiledTool("composio", cls, action, signature.inputs, signature.params, None)
+        func = self.namespace.get(name.upper())
+        if callable(func):
+            return CompiledTool("function", func, None, parameter_list(func), parameters(func), None)
+        return CompiledTool("unavailable", None, None, None, None, None)
+
+    def _compile_steps(self, steps):
+        compiled = []
+        for step in steps:
+            if step.body is not None:
+                step = step._replace(body=self._compile_steps(step.body))
+            elif step.agent.get("type") == "tool":
+                step = step._replace(tool=self.compile_tool(step.agent))
+            compiled.append(step)
+        return compiled
+
+    def compile(self, workflow_json):
+        if isinstance(workflow_json, str):
+            workflow_json = json.loads(workflow_json)
+        return self._compile_steps(build_plan(workflow_json))
+
+    def get(self, wid, workflow_json):
+        """Compiled plan of a workflow, from the cache when this version was seen before."""
+        key = (wid, workflow_digest(workflow_json))
+        with self._lock:
+            steps = self._plans.get(key)
+            if steps is not None:
+                self._plans.move_to_end(key)
+                return steps
+        steps = self.compile(workflow_json)
+        with self._lock:
+            self._plans[key] = steps
+            while len(self._plans) > self.max_size:
+                self._plans.popitem(last=False)
+        return steps
@@ -1,14 +1,11 @@
 import pandas as pd
-import google.generativeai as genai
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
 from dotenv import load_dotenv
 import os
 import inspect
 from PyPDF2 import PdfReader
+from llm_gateway import GATEWAY
 load_dotenv()
-API_KEY = os.getenv("GOOGLE_API_KEY")
-genai.configure(api_key=API_KEY)
-model = genai.GenerativeModel(model_name="gemini-1.5-flash")
 
 def CSV_AI(query: str, csv_path: str="path of one csv file"):
     # Load the CSV to inspect columns
@@ -72,8 +69,8 @@ def CSV_AI(query: str, csv_path: str="path of one csv file"):
     print(f"Prompt sent to LLM:\n{prompt}")
     
     # Send to LLM
-    response = model.generate_content(
-        [prompt], 
+    code = GATEWAY.complete(
+        [{"role": "user", "content": prompt}], "gemini",
         safety_settings={
             HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
             HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
@@ -83,7 +80,6 @@ def CSV_AI(query: str, csv_path: str="path of one csv file"):
     )
     
     # Extract the generated code
-    code = response.text
     # Remove code blocks if they exist
     if "```python" in code:
         code = code.split("```python")[1].split("```")[0].strip()
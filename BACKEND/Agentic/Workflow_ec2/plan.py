@@ -0,0 +1,53 @@
+"""
+Execution plan of a workflow.
+
+The agent list is flat, but an ITERATOR runs the agents after it once per
+element. build_plan nests those agents under the iterator as its body, so the
+executor runs them only inside the iterator and never a second time at the
+outer level. A body ends at an ITERATOR_END connector or at the end of the
+list. Iterators inside a body nest the same way.
+
+Positions in the list are what matter here, agent ids are never used as
+list indexes.
+"""
+
+import logging
+from collections import namedtuple
+
+ITERATOR_END_NAMES = ("iterator_end", "end_iterator", "iterator end", "end iterator")
+
+# body is None for everything except iterators, where it is the list of
+# Steps run for every element. tool is filled in by the compiler for tool nodes
+Step = namedtuple("Step", ["agent", "body", "tool"], defaults=(None,))
+
+
+def is_iterator_end(agent):
+    return agent.get("type") == "connector" and agent.get("name", "").lower() in ITERATOR_END_NAMES
+
+
+def is_iterator(agent):
+    return agent.get("type") == "connector" and "iterator" in agent.get("name", "").lower() \
+        and not is_iterator_end(agent)
+
+
+def _scope(agents, start, depth):
+    steps = []
+    position = start
+    while position < len(agents):
+        agent = agents[position]
+        position += 1
+        if is_iterator_end(agent):
+            if depth:
+                return steps, position
+            logging.warning("Ignoring %s at position %s, no iterator is open", agent.get("name"), position - 1)
+        elif is_iterator(agent):
+            body, position = _scope(agents, position, depth + 1)
+            steps.append(Step(agent, body))
+        else:
+            steps.append(Step(agent, None))
+    return steps, position
+
+
+def build_plan(agents):
+    """Top-level Steps of an ordered agent list."""
+    return _scope(agents, 0, 0)[0]
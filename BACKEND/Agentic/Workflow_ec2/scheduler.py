@@ -0,0 +1,88 @@
+"""
+Dependency scheduling of workflow agents.
+
+The agent list produced by /create_agents is ordered, but most agents only
+depend on the notebook keys they read. build_dag turns the list into a DAG
+over list positions from the declared data_flow_inputs / data_flow_outputs
+(plus the validator key named in to_execute), and run_dag starts every agent
+as soon as the agents it depends on are finished.
+"""
+
+import asyncio
+import logging
+
+# connectors whose effect is not described by their notebook keys: everything
+# before them finishes first and everything after them waits for them
+BARRIER_CONNECTORS = ("iterator", "delegator", "deligator")
+
+
+def is_barrier(agent):
+    name = agent.get("name", "").lower()
+    return agent.get("type") == "connector" and any(c in name for c in BARRIER_CONNECTORS)
+
+
+def reads_of(agent):
+    keys = list(agent.get("data_flow_inputs", []))
+    if agent.get("to_execute"):
+        keys.append(agent["to_execute"][0])
+    return keys
+
+
+def build_dag(agents):
+    """{position: set of positions it must wait for}. Edges only point backwards in the list."""
+    writers = {}     # key -> positions writing it so far
+    readers = {}     # key -> positions reading it so far
+    deps = {}
+    last_barrier = None
+    for i, agent in enumerate(agents):
+        depends = set()
+        for key in reads_of(agent):
+            depends.update(writers.get(key, ()))
+        for key in agent.get("data_flow_outputs", []):
+            # keep earlier readers and writers of the same key ahead of this write
+            depends.update(writers.get(key, ()))
+            depends.update(readers.get(key, ()))
+        if is_barrier(agent):
+            depends.update(range(i))
+        elif last_barrier is not None:
+            depends.add(last_barrier)
+        depends.discard(i)
+        deps[i] = depends
+
+        for key in reads_of(agent):
+            readers.setdefault(key, []).append(i)
+        for key in agent.get("data_flow_outputs", []):
+            writers.setdefault(key, []).append(i)
+        if is_barrier(agent):
+            last_barrier = i
+    return deps
+
+
+async def run_dag(deps, run_node):
+    """
+    Await run_node(position) for every node, each one as soon as its
+    dependencies are done. A failing node is logged and counts as done, its
+    dependents then see missing notebook keys and skip themselves.
+    """
+    remaining = {node: set(parents) for node, parents in deps.items()}
+    dependents = {node: [] for node in deps}
+    for node, parents in deps.items():
+        for parent in parents:
+            dependents[parent].append(node)
+
+    ready = sorted(node for node, parents in remaining.items() if not parents)
+    running = {}
+    while ready or running:
+        for node in ready:
+            running[asyncio.create_task(run_node(node))] = node
+        ready = []
+        finished, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        for task in finished:
+            node = running.pop(task)
+            if task.exception() is not None:
+                logging.error("Agent at position %s failed: %s", node, task.exception())
+            for child in dependents[node]:
+                remaining[child].discard(node)
+                if not remaining[child]:
+                    ready.append(child)
+        ready.sort()
@@ -2,19 +2,31 @@
 missing --  custom tools, deligator, logging, error handling. make sure each .execute() method returns a dict with status and message
 """
 
-from tools.dynamo import db_client
+from tools.user_store import UserScope, get_api_keys, get_plan_and_api_keys
+from usage import QuotaExceeded, check_quota, usage_context
+from Workflow_ec2.scheduler import build_dag, run_dag
+from Workflow_ec2.compiler import WorkflowCompiler
+from Workflow_ec2.binding import BindingCache, bind_arguments, key_shape
 import json
 from tools.tool_classes import *  # Import all tool classes dynamically
 from Workflow_ec2.oth_tools import *
 from prompts import llm_sys_chain,iterator_chain,gemini_chain
+from llm_json import extract_json
+from run_events import RunEventLog
+from run_state import SIDE_EFFECT_ACTIONS, RunState
 import inspect
 import logging
 from celery import Celery
 import redis
 import asyncio
+import itertools
+import os
+import uuid
+from collections import ChainMap
 from datetime import datetime
 celery_app = Celery("tasks", broker="redis://localhost:6379/0", backend="redis://localhost:6379/0")
 redis_client = redis.StrictRedis(host='localhost', port=6379, db=0)
+RUN_LOG = RunEventLog(redis_client)
 
 # Configure logging
 logging.basicConfig(
@@ -28,154 +40,347 @@ logging.basicConfig(
 def syn(wid,workflow_json, clerk_id, trigger_output):
     asyncio.run(execute_workflow(wid,workflow_json, clerk_id, trigger_output))
 
-async def execute_workflow(wid,workflow_json, user_id, tr_o=None,dfn=None):
+
+@celery_app.task
+def resume_run(run_id):
+    asyncio.run(resume_workflow(run_id))
+
+WORKFLOW_MAX_CONCURRENCY = int(os.getenv("WORKFLOW_MAX_CONCURRENCY", "4"))
+# elements of one iterator run at the same time, 1 runs them one after the
+# other. An iterator can override it with config_inputs.max_in_flight
+ITERATOR_MAX_IN_FLIGHT = int(os.getenv("ITERATOR_MAX_IN_FLIGHT", "8"))
+
+
+class RunContext:
+    """State shared by one workflow run, including its iterator re-entries."""
+
+    def __init__(self, wid, user_id, tr_o, max_concurrency=WORKFLOW_MAX_CONCURRENCY, run_id=None, state=None, first_seq=1):
+        self.wid = wid
+        self.user_id = user_id
+        self.tr_o = tr_o
+        # one users read per run, shared by every tool node and iterator element
+        self.scope = UserScope()
+        self.limit = asyncio.Semaphore(max_concurrency)
+        # node events carry (run_id, seq): /ws drops repeats with one integer
+        # compare and clients see a gap when an event was lost
+        self.run_id = run_id or uuid.uuid4().hex
+        self._seq = itertools.count(first_seq)
+        # checkpoints of the run, loaded from redis when it is resumed
+        self.checkpoint = state or RunState(redis_client, self.run_id)
+
+    def next_seq(self):
+        return next(self._seq)
+
+    async def call(self, func, *args, **kwargs):
+        """Run a blocking LLM / tool / db call off the event loop, at most max_concurrency at once per run."""
+        async with self.limit:
+            return await asyncio.to_thread(func, *args, **kwargs)
+
+    async def llm(self, chain, agent, inputs):
+        """
+        chain answer for a node, with the user's own provider keys and the
+        node's "cache": false opt-out of the LLM response cache.
+        """
+        api_keys = await self.call(get_api_keys, self.user_id, self.scope)
+        return await self.call(chain.invoke, inputs, use_cache=agent.get("cache", True) is not False, api_keys=api_keys)
+
+
+async def execute_workflow(wid,workflow_json, user_id, tr_o=None,dfn=None,ctx=None):
     
     print("EXECUUUUUUUUUUUUUUUUUUUUUUUUUUUUUUUUUTTTTTTTTTTTINGGGGGGGGGGGG")
+    if ctx is None:
+        ctx = RunContext(wid, user_id, tr_o)
     if dfn==None:
         
         data_flow_notebook = {"trigger_output": tr_o}
     else:
         data_flow_notebook = dfn
-    composio_tools = {cls.__name__.lower(): cls for cls in globals().values() if isinstance(cls, type)}
-    # logging.info("Initialized composio_tools: %s", composio_tools)
-    if isinstance(workflow_json, str):
+    try:
+        steps = COMPILER.get(wid, workflow_json)
+    except json.JSONDecodeError as e:
+        logging.error("Invalid JSON format: %s", e)
+        return {"status": "error", "message": "Invalid JSON format"}
+
+    # triggered runs don't pass through /run_workflow, so the quota is checked here too
+    plan, _ = await ctx.call(get_plan_and_api_keys, user_id, ctx.scope)
+    try:
+        await ctx.call(check_quota, user_id, plan)
+    except QuotaExceeded as e:
+        logging.warning("Workflow %s not run: %s", wid, e)
+        return {"status": "error", "message": str(e)}
+
+    state = ctx.checkpoint
+    if not state.acquire():
+        return {"status": "error", "message": f"Run {ctx.run_id} is already running"}
+    if state.resumed:
+        RUN_LOG.resume(ctx.run_id)
+    else:
+        state.begin(wid, user_id, workflow_json, tr_o)
+        RUN_LOG.start(ctx.run_id, wid, user_id)
+    lease = asyncio.create_task(state.hold_lease())
+    result = {"status": "failed"}
+    try:
+        with usage_context(user_id=user_id, workflow_id=wid):
+            result = await run_steps(steps, data_flow_notebook, ctx)
+        return result
+    finally:
+        lease.cancel()
         try:
-            workflow_json = json.loads(workflow_json)
-        except json.JSONDecodeError as e:
-            logging.error("Invalid JSON format: %s", e)
-            return {"status": "error", "message": "Invalid JSON format"}
-    for agent in workflow_json:
-        response=""
-        status="executed successfully"
-        agent_id = agent["id"]
-        agent_type = agent["type"]
-        agent_name = agent["name"].lower()
-        to_execute = agent["to_execute"]
-        data_flow_inputs = agent.get("data_flow_inputs", [])
-        data_flow_outputs = agent.get("data_flow_outputs", [])
-        config_inputs = agent.get("config_inputs", {})
-        
-        logging.info("Processing agent: %s, Type: %s", agent_name, agent_type)
-        
-        # Check execution conditions
-        if to_execute:
-            condition_key, expected_value = to_execute
-            print("condition_key",condition_key)
-            print("expected_value",expected_value)
-            if (data_flow_notebook.get(condition_key) == "Y" and expected_value == 'Y') or \
-               ( data_flow_notebook.get(condition_key) == "N" and expected_value == 'N'):
-                pass
-            else:
-                logging.info("Skipping agent %s due to execution condition mismatch", agent_name)
-                continue
+            # flushes this run's batched events while its loop is still running
+            RUN_LOG.finish(ctx.run_id, result["status"])
+        finally:
+            # a partial run keeps its checkpoints, resuming it retries the failed work
+            state.release(finished=result["status"] == "success")
+
+
+async def resume_workflow(run_id):
+    """Continue a run from its last checkpoint, skipping the nodes and iterator elements that finished."""
+    state = RunState.load(redis_client, run_id)
+    if state is None:
+        logging.error("No checkpoint for run %s", run_id)
+        return {"status": "error", "message": "No checkpoint for this run"}
+    wid, user_id, tr_o = state.meta["workflow_id"], state.meta["user_id"], state.meta["trigger_output"]
+    # continue the run's seq so open sockets don't drop the new events as repeats
+    ctx = RunContext(wid, user_id, tr_o, run_id=run_id, state=state, first_seq=RUN_LOG.last_seq(run_id) + 1)
+    notebook = {"trigger_output": tr_o, **state.notebook}
+    return await execute_workflow(wid, state.meta["workflow"], user_id, tr_o, dfn=notebook, ctx=ctx)
+
+
+async def run_steps(steps, data_flow_notebook, ctx, cursor=""):
+    """
+    Run one level of the plan: the top of the workflow or one iterator element.
+    cursor is the element's "<iterator cursor>#<index>/" prefix, see run_state.py.
+    """
+    failed = []
+
+    # agents without a data dependency on each other run concurrently
+    async def run_node(position):
+        agent = steps[position].agent
+        node_cursor = f"{cursor}{agent.get('id')}"
+        if node_cursor in ctx.checkpoint.done:
+            return
         try:
-            input_data = {key: data_flow_notebook[key] for key in data_flow_inputs}
-            logging.info("Input data for agent %s: %s", agent_name, input_data)
-        except KeyError as e:
-            input_data = {}
-            logging.error("Missing data flow inputs key: %s", e)
-            continue
-        
-        # LLM Agent Execution
-        if agent_type == "llm":
-            system_prompt = agent["llm_prompt"]
-            logging.info("Executing LLM agent: %s with prompt: %s", agent_name, system_prompt)
-            # logging.info("Config inputs: %s, Input data: %s", config_inputs, input_data)
-            # logging.info("yayyyyy %s", input_data.update(config_inputs))  
-            response = llm_sys_chain.invoke({"data": {k: v for k, v in list(config_inputs.items()) + list(input_data.items())}, "question": system_prompt, "keys": data_flow_outputs})
-            logging.info("LLM response: %s", response)
+            with usage_context(node=agent.get("id")):
+                status = await run_agent(steps[position], data_flow_notebook, ctx, node_cursor)
+        except Exception as e:
+            failed.append({"node": agent.get("id"), "agent_name": agent.get("name"), "status": f"failed: {e}"})
+            raise
+        if status is not None and status != "executed successfully":
+            failed.append({"node": agent.get("id"), "agent_name": agent.get("name"), "status": status})
+        elif status is not None and not cursor:
+            # nodes inside an element are checkpointed with their element
+            ctx.checkpoint.node_done(node_cursor, data_flow_notebook)
+
+    await run_dag(build_dag([step.agent for step in steps]), run_node)
+    return {"status": "partial" if failed else "success", "data": data_flow_notebook, "failed": failed}
+
+
+async def iterate(step, elements, data_flow_notebook, ctx, cursor):
+    """
+    Run the iterator's body once per element and return an ordered summary.
+
+    Up to max_in_flight elements run concurrently, each in a copy-on-write
+    scope over the notebook: reads fall through to the shared notebook, writes
+    stay in the element's own layer. The layers are collected, in element order,
+    under "<output key>_results". Blocking calls stay limited by the run's
+    WORKFLOW_MAX_CONCURRENCY semaphore. Elements that finished in an earlier
+    attempt of the run are not run again, their checkpointed writes are used.
+    """
+    agent = step.agent
+    output_key = agent["data_flow_outputs"][0]
+    max_in_flight = int(agent.get("config_inputs", {}).get("max_in_flight", ITERATOR_MAX_IN_FLIGHT))
+
+    limit = asyncio.Semaphore(max(1, max_in_flight))
+
+    async def run_element(index, element):
+        element_cursor = f"{cursor}#{index}"
+        if element_cursor in ctx.checkpoint.done:
+            return ctx.checkpoint.elements[element_cursor], {"status": "success"}
+        scope = ChainMap({output_key: element}, data_flow_notebook)
+        async with limit:
             try:
-                if response[0]=="`":
-                    response = response[7:-4]
-                    print("response",response)
-                    response = json.loads(response)
-                else:
-                    response = json.loads(response)
-                
-                data_flow_notebook.update(response)
+                result = await run_steps(step.body, scope, ctx, f"{element_cursor}/")
             except Exception as e:
-                status="failed"
-                logging.error("Error processing LLM response: %s", e)
-        
-        # Connector Execution
-        elif agent_type == "connector":
-            logging.info("Executing connector agent: %s", agent_name)
-            if "iterator" in agent_name:
+                result = e
+        writes = {k: v for k, v in scope.maps[0].items() if k != output_key}
+        if not isinstance(result, Exception) and result.get("status") == "success":
+            ctx.checkpoint.element_done(element_cursor, writes)
+        return writes, result
+
+    outcomes = await asyncio.gather(*(run_element(index, element) for index, element in enumerate(elements)))
+    data_flow_notebook[f"{output_key}_results"] = [writes for writes, _ in outcomes]
+
+    failures = []
+    for index, (_, result) in enumerate(outcomes):
+        if isinstance(result, Exception):
+            failures.append({"index": index, "error": str(result)})
+        elif result.get("status") != "success":
+            failures.append({"index": index, "failed": result.get("failed", []), "message": result.get("message")})
+    if failures:
+        logging.error("Iterator %s: %s of %s elements failed", agent.get("name"), len(failures), len(elements))
+    return {"elements": len(elements), "succeeded": len(elements) - len(failures), "failed": failures}
+
+
+BINDINGS = BindingCache(redis_client)
+
+
+def unbound_inputs(tool, missing):
+    """[{parameter: default}] entries of the parameters the LLM still has to fill."""
+    extra = {p.name for p in tool.params if p.kind == inspect.Parameter.VAR_KEYWORD}
+    return [entry for entry in tool.inputs if next(iter(entry)) in missing or next(iter(entry)) in extra]
+
+
+async def run_agent(step, data_flow_notebook, ctx, cursor=None):
+    agent = step.agent
+    cursor = cursor or str(agent["id"])
+    wid, user_id, tr_o = ctx.wid, ctx.user_id, ctx.tr_o
+    response=""
+    status="executed successfully"
+    agent_id = agent["id"]
+    agent_type = agent["type"]
+    agent_name = agent["name"].lower()
+    to_execute = agent["to_execute"]
+    data_flow_inputs = agent.get("data_flow_inputs", [])
+    data_flow_outputs = agent.get("data_flow_outputs", [])
+    config_inputs = agent.get("config_inputs", {})
+    
+    logging.info("Processing agent: %s, Type: %s", agent_name, agent_type)
+    
+    # Check execution conditions
+    if to_execute:
+        condition_key, expected_value = to_execute
+        logging.debug("Condition of %s: %s == %s", agent_name, condition_key, expected_value)
+        if (data_flow_notebook.get(condition_key) == "Y" and expected_value == 'Y') or \
+           ( data_flow_notebook.get(condition_key) == "N" and expected_value == 'N'):
+            pass
+        else:
+            logging.info("Skipping agent %s due to execution condition mismatch", agent_name)
+            return
+    try:
+        input_data = {key: data_flow_notebook[key] for key in data_flow_inputs}
+        logging.info("Input data for agent %s: %s", agent_name, input_data)
+    except KeyError as e:
+        input_data = {}
+        logging.error("Missing data flow inputs key: %s", e)
+        return
+    
+    # LLM Agent Execution
+    if agent_type == "llm":
+        system_prompt = agent["llm_prompt"]
+        logging.info("Executing LLM agent: %s with prompt: %s", agent_name, system_prompt)
+        # logging.info("Config inputs: %s, Input data: %s", config_inputs, input_data)
+        # logging.info("yayyyyy %s", input_data.update(config_inputs))  
+        response = await ctx.llm(llm_sys_chain, agent, {"data": {k: v for k, v in list(config_inputs.items()) + list(input_data.items())}, "question": system_prompt, "keys": data_flow_outputs})
+        logging.info("LLM response: %s", response)
+        try:
+            response = extract_json(response)
+            data_flow_notebook.update(response)
+        except Exception as e:
+            status="failed"
+            logging.error("Error processing LLM response: %s", e)
+    
+    # Connector Execution
+    elif agent_type == "connector":
+        logging.info("Executing connector agent: %s", agent_name)
+        if step.body is not None:
+            # a resumed run iterates over the elements of the first attempt
+            elements = ctx.checkpoint.elements.get(cursor)
+            if elements is None:
                 elements = data_flow_notebook[data_flow_inputs[0]]
+            try:
                 if not isinstance(elements, list):
                     try:
                         
-                        elements = iterator_chain.invoke({"data": elements})
+                        elements = await ctx.llm(iterator_chain, agent, {"data": elements})
                     except KeyError:
-                        elements = iterator_chain.invoke({"data": {k: v for k, v in list(config_inputs.items()) + list(input_data.items())}})
+                        elements = await ctx.llm(iterator_chain, agent, {"data": {k: v for k, v in list(config_inputs.items()) + list(input_data.items())}})
 
-                    try:
-                        if elements[0] == "`":
-                            elements = json.loads(elements[7:-4])
-                        else:
-                            elements = json.loads(elements)
-                        for element in elements:
-                            data_flow_notebook[data_flow_outputs[0]] = element
-                            await execute_workflow(wid, workflow_json[agent_id:], user_id, tr_o, data_flow_notebook)
-                    except Exception as e:
-                        status="failed"
-                        logging.error("Error in iterator processing: %s", e)
+                    elements = extract_json(elements)
+                if cursor not in ctx.checkpoint.elements:
+                    ctx.checkpoint.save_elements(cursor, elements)
+                logging.debug("Iterator %s over %s elements", agent_name, len(elements))
+                response = await iterate(step, elements, data_flow_notebook, ctx, cursor)
+                if response["failed"]:
+                    status="partially failed"
+            except Exception as e:
+                status="failed"
+                logging.error("Error in iterator processing: %s", e)
+
+        elif "validator" in agent_name:
+            system_prompt = agent["validation_prompt"]
+            logging.info("Executing validator agent: %s", agent_name)
+            response = await ctx.llm(llm_sys_chain, agent, {"data": {k: v for k, v in list(config_inputs.items()) + list(input_data.items())}, "question": system_prompt + "\nwrite Y as value for given key if validation criteria meets, else write N", "keys": data_flow_outputs})
+            try:
+                response = extract_json(response)
+                data_flow_notebook.update(response)
+            except Exception as e:
+                status="failed"
+                logging.error("Error processing validator response: %s", e)
+        elif "delegator" in agent_name:
+            status="failed"
+            logging.info("Delegator agent: %s has no action specified", agent_name)
+    
+    # Tool Execution
+    elif agent_type == "tool":
+        logging.info("Executing tool agent: %s", agent_name)
+        api_keys = await ctx.call(get_api_keys, user_id, ctx.scope)
+        comp = api_keys["composio"]
+        # gem=api_keys["gemini"]
+        tool = step.tool
+        if tool.kind == "composio":
+            try:
+                if tool.error:
+                    raise AttributeError(tool.error)
+                data = {k: v for k, v in list(config_inputs.items()) + list(input_data.items())}
+                logging.debug("Inputs of %s: %s, data: %s", agent_name, tool.inputs, data)
+
+                async def fallback(missing, data):
+                    inputs = unbound_inputs(tool, missing)
+                    return extract_json(await ctx.llm(gemini_chain, agent, {"prompt": f"You are an input validator for a function. Convert the given inputs to a dictionary format, with keys as parameter names of the function and values as the corresponding input values in proper required format. strictly convert the input parameters to required format. The given data might be in natural language, but you need to make sure you are extracting exact information in proper format from given data. STRICTLY DON'T GIVE ANY OTHER KEY, OTHER THAN INPUT PARAMETERS OF FUNCTION. If a parameter is not provided, set it to most relevant value . Return the dictionary in JSON format. No preambles or postambles. keep all strings in double quotes.\nInput parameter names and their explaination:{inputs}\ndata to insert (don't skip anything. each of the following data should go into some parameter values):"+str(data)}))
+
+                to_go = await bind_arguments(tool.params, data, BINDINGS, BindingCache.key(wid, agent_id, key_shape(data)), fallback)
+                action = agent.get("tool_action", "")
+                kwargs = {"action": action, **to_go}
+                logging.debug("Arguments of %s: %s", agent_name, kwargs)
+                tool_obj = await ctx.call(tool.target, comp, kwargs)
+                if action in SIDE_EFFECT_ACTIONS:
+                    # idempotent per run and cursor: a resumed run doesn't send again
+                    response = await ctx.checkpoint.once(cursor, lambda: ctx.call(tool_obj.execute))
                 else:
-                    for element in elements:
-                        print("element",element)
-                        data_flow_notebook[data_flow_outputs[0]] = element
-                        await execute_workflow(wid, workflow_json[agent_id:], user_id, tr_o, data_flow_notebook)
-
-            elif "validator" in agent_name:
-                system_prompt = agent["validation_prompt"]
-                logging.info("Executing validator agent: %s", agent_name)
-                response = llm_sys_chain.invoke({"data": {k: v for k, v in list(config_inputs.items()) + list(input_data.items())}, "question": system_prompt + "\nwrite Y as value for given key if validation criteria meets, else write N", "keys": data_flow_outputs})
-                try:
-                    if response[0] == "`":
-                        response = json.loads(response[7:-4])
-                    else:
-                        response = json.loads(response)
-                    data_flow_notebook.update(response)
-                except Exception as e:
-                    status="failed"
-                    logging.error("Error processing validator response: %s", e)
-            elif "delegator" in agent_name:
+                    response = await ctx.call(tool_obj.execute)
+                
+                # response = llm_sys_chain.invoke({"data": response, "question": agent["description"], "keys": data_flow_outputs})
+                # if response[0] == "`":
+                #     response = json.loads(response[7:-4])
+                # else:
+                #     response = json.loads(response)
+                # data_flow_notebook.update(response)
+                for keys in data_flow_outputs:
+                    data_flow_notebook[keys] = response
+            except Exception as e:
                 status="failed"
-                logging.info("Delegator agent: %s has no action specified", agent_name)
-        
-        # Tool Execution
-        elif agent_type == "tool":
-            logging.info("Executing tool agent: %s", agent_name)
-            user_data = db_client.get_item(
-                        TableName="users",
-                        Key={"clerk_id": {"S": user_id}}
-            )
-            api_key = user_data.get("Item", {}).get("api_key", {}).get("M", {})
-            api_keys = {k: v['S'] for k, v in api_key.items()}
-            comp = api_keys["composio"]
-            # gem=api_keys["gemini"]
-            if agent_name in composio_tools:
+                logging.error("Error executing tool agent %s: %s", agent_name, e)
+        else:
+            # standalone function named agent_name.upper(), resolved by the compiler
+            if tool.kind == "function":
                 try:
+                    standalone_function = tool.target
+                    data = {k: v for k, v in list(config_inputs.items()) + list(input_data.items())}
+                    logging.debug("Inputs of %s: %s, data: %s", agent_name, tool.inputs, data)
+
+                    # Perform input validation, the LLM only sees what bind_arguments could not match
+                    async def fallback(missing, data):
+                        inputs = unbound_inputs(tool, missing)
+                        return extract_json(await ctx.llm(gemini_chain, agent, {"prompt": f"You are an input validator for a function. Convert the given inputs to a dictionary format, with keys as parameter names of the function and values as the corresponding inputs in proper required format. strictly convert the input parameters to required format. The given data might be in natural language, but you need to make sure you are extracting exact information in proper format from given data. STRICTLY DON'T GIVE ANY OTHER KEY, OTHER THAN INPUT PARAMETERS OF FUNCTION. If a parameter is not provided, set it to most relevant value . Return the dictionary in JSON format. No preambles or postambles. keep all strings in double quotes.\nInput parameter names (REQUIRED KEYS) and their explaination:{inputs}\ndata including values for given keys above:"+str(data)}))
+
+                    to_go = await bind_arguments(tool.params, data, BINDINGS, BindingCache.key(wid, agent_id, key_shape(data)), fallback)
                     
-                    method = getattr(composio_tools[agent_name], agent.get("tool_action", ""))
-
-                    # Get function signature
-                    signature = inspect.signature(method)
-
-                    inputs = [{name: param.default if param.default is not inspect.Parameter.empty else None}
-                              for name, param in signature.parameters.items()]
-                    print("inputs",inputs,"input_data",input_data,"config_inputs",config_inputs)
-                    print(f"You are an input validator for a function. Convert the given inputs to a dictionary format, with keys as parameter names of the function and values as the corresponding input values in proper required format. strictly convert the input parameters to required format. The given data might be in natural language, but you need to make sure you are extracting exact information in proper format from given data. If a parameter is not provided, set it to most relevant value . Return the dictionary in JSON format. No preambles or postambles. keep all strings in double quotes.\nInput parameter names and their explaination:{inputs[1:]}\ndata:"+str({k: v for k, v in list(config_inputs.items()) + list(input_data.items())}))
-                    to_go = gemini_chain.invoke({"prompt": f"You are an input validator for a function. Convert the given inputs to a dictionary format, with keys as parameter names of the function and values as the corresponding input values in proper required format. strictly convert the input parameters to required format. The given data might be in natural language, but you need to make sure you are extracting exact information in proper format from given data. STRICTLY DON'T GIVE ANY OTHER KEY, OTHER THAN INPUT PARAMETERS OF FUNCTION. If a parameter is not provided, set it to most relevant value . Return the dictionary in JSON format. No preambles or postambles. keep all strings in double quotes.\nInput parameter names and their explaination:{inputs[1:]}\ndata to insert (don't skip anything. each of the following data should go into some parameter values):"+str({k: v for k, v in list(config_inputs.items()) + list(input_data.items())})})
-                    if to_go[0] == "`":
-                        to_go = json.loads(to_go[7:-4])
-                    else:
-                        to_go = json.loads(to_go)
-                    kwargs = {"action": agent.get("tool_action", ""), **to_go}
-                    print("kwargs",kwargs)
-                    tool_obj = composio_tools[agent_name](comp, kwargs)
-                    response = tool_obj.execute()
+                    # Call the standalone function
+                    logging.info("%s",to_go)
+                    response = await ctx.call(standalone_function, **to_go)
                     
+                    # Perform output validation
+                    logging.info("Response from standalone function: %s", response)
                     # response = llm_sys_chain.invoke({"data": response, "question": agent["description"], "keys": data_flow_outputs})
                     # if response[0] == "`":
                     #     response = json.loads(response[7:-4])
@@ -186,72 +391,27 @@ async def execute_workflow(wid,workflow_json, user_id, tr_o=None,dfn=None):
                         data_flow_notebook[keys] = response
                 except Exception as e:
                     status="failed"
-                    logging.error("Error executing tool agent %s: %s", agent_name, e)
+                    logging.error("Error executing standalone function %s: %s", agent_name.upper(), e)
             else:
-                # Check if a standalone function matches the agent_name.upper()                                                                                                             
-                if agent_name.upper() in globals() and callable(globals()[agent_name.upper()]):
-                    try:
-                        standalone_function = globals()[agent_name.upper()]
-                        
-                        # Get function signature
-                        signature = inspect.signature(standalone_function)
-                        inputs = [{name: param.default if param.default is not inspect.Parameter.empty else None}
-                                  for name, param in signature.parameters.items()]
-                        print("inputs",inputs,"input_data",input_data,"config_inputs",config_inputs)
-                        # Perform input validation
-                        to_go = gemini_chain.invoke({"prompt": f"You are an input validator for a function. Convert the given inputs to a dictionary format, with keys as parameter names of the function and values as the corresponding inputs in proper required format. strictly convert the input parameters to required format. The given data might be in natural language, but you need to make sure you are extracting exact information in proper format from given data. STRICTLY DON'T GIVE ANY OTHER KEY, OTHER THAN INPUT PARAMETERS OF FUNCTION. If a parameter is not provided, set it to most relevant value . Return the dictionary in JSON format. No preambles or postambles. keep all strings in double quotes.\nInput parameter names (REQUIRED KEYS) and their explaination:{inputs}\ndata including values for given keys above:"+str({k: v for k, v in list(config_inputs.items()) + list(input_data.items())})})
-                        try:
-                            if to_go[0] == "`":
-                                to_go = json.loads(to_go[7:-4])
-                            else:
-                                to_go = json.loads(to_go)
-                        except:
-                            to_go=eval(to_go)
-                        
-                        # Call the standalone function
-                        logging.info("%s",to_go)
-                        response = standalone_function(**to_go)
-                        
-                        # Perform output validation
-                        logging.info("Response from standalone function: %s", response)
-                        # response = llm_sys_chain.invoke({"data": response, "question": agent["description"], "keys": data_flow_outputs})
-                        # if response[0] == "`":
-                        #     response = json.loads(response[7:-4])
-                        # else:
-                        #     response = json.loads(response)
-                        # data_flow_notebook.update(response)
-                        for keys in data_flow_outputs:
-                            data_flow_notebook[keys] = response
-                    except Exception as e:
-                        status="failed"
-                        logging.error("Error executing standalone function %s: %s", agent_name.upper(), e)
-                else:
-                    status="tool unavailable"
-        logging.info("Data flow notebook:%s", data_flow_notebook)
-                
-
-        # redis_client.publish(f"workflow_{user_id}", json.dumps(data_flow_notebook))
-        if type(response) == str:
-            response={"response": response}
-        redis_client.publish(f"workflow_{user_id}", json.dumps({
-                    "workflow_id": wid,
-                    "node": agent_id,
-                    "agent_name": agent_name,
-                    "status": status,
-                    "timestamp": datetime.now().isoformat(),
-                    "data": response
-                }))  
-       
-    return {"status": "success", "data": data_flow_notebook}
-
-
-
-
-
-
-
-
-
+                status="tool unavailable"
+    logging.info("Data flow notebook:%s", data_flow_notebook)
+            
 
+    # redis_client.publish(f"workflow_{user_id}", json.dumps(data_flow_notebook))
+    if type(response) == str:
+        response={"response": response}
+    RUN_LOG.append(ctx.run_id, user_id, {
+                "workflow_id": wid,
+                "run_id": ctx.run_id,
+                "seq": ctx.next_seq(),
+                "node": agent_id,
+                "agent_name": agent_name,
+                "status": status,
+                "timestamp": datetime.now().isoformat(),
+                "data": response
+            })
+    return status
 
 
+# after every import so the tool classes and functions are all visible
+COMPILER = WorkflowCompiler(globals())
@@ -0,0 +1,82 @@
+"""
+Load test: concurrent handler throughput with blocking vs pooled DynamoDB calls.
+
+A fake client sleeps like a DynamoDB round trip (time.sleep, so it blocks the
+thread exactly like boto3 does). Each simulated request does the same number
+of DynamoDB calls as /run_workflow. "before" calls the client directly from
+the coroutine, as the handlers used to; "after" goes through
+tools.async_dynamo.
+
+    cd Agentic
+    python -m bench.dynamo_load --requests 200 --concurrency 50 --latency 0.02
+"""
+
+import argparse
+import asyncio
+import time
+
+from tools.async_dynamo import AsyncProxy
+
+
+class SlowDynamo:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def get_item(self, **kwargs):
+        time.sleep(self.latency)
+        return {"Item": {"plan": {"S": "free"}, "api_key": {"M": {"composio": {"S": "x"}}}}}
+
+    def update_item(self, **kwargs):
+        time.sleep(self.latency)
+        return {}
+
+
+async def blocking_handler(client):
+    client.get_item(TableName="users", Key={})
+    client.update_item(TableName="workflows", Key={})
+
+
+async def pooled_handler(aclient):
+    await aclient.get_item(TableName="users", Key={})
+    await aclient.update_item(TableName="workflows", Key={})
+
+
+async def drive(handler, total, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            await handler()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests/s": round(total / elapsed, 1),
+        "p50 ms": round(latencies[len(latencies) // 2] * 1000, 1),
+        "p99 ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 1),
+        "total s": round(elapsed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per DynamoDB call")
+    args = parser.parse_args()
+
+    client = SlowDynamo(args.latency)
+    aclient = AsyncProxy(client)
+    before = asyncio.run(drive(lambda: blocking_handler(client), args.requests, args.concurrency))
+    after = asyncio.run(drive(lambda: pooled_handler(aclient), args.requests, args.concurrency))
+    print("before (blocking boto3 in handler):", before)
+    print("after  (tools.async_dynamo pool):  ", after)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Redis and websocket bytes of one workflow run's node events, before and after
+the event payload policy.
+
+The simulated run has a CSV_READER node (--csv-kb of text), a PDF_TO_TEXT
+node, an LLM summary and an iterator over --elements rows whose body node
+publishes once per element, --in-flight elements at a time each taking
+--element-ms. Every event goes through RunEventLog against a counting
+client, so batching, truncation and compression are the real code paths.
+
+    "publish"     the old fire-and-forget PUBLISH of the full event
+    "stream"      XADD + PUBLISH of the full event, one write per event
+    "policy"      truncated data and batches of RUN_EVENTS_BATCH_MS
+    "policy+zlib" the same with EVENT_COMPRESS
+
+redis bytes count what is sent to redis (stream entries, stored payloads,
+published messages), ws bytes what one open socket receives.
+
+    cd Agentic
+    python -m bench.event_payload --elements 300
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import time
+
+from event_payload import EventPayloadPolicy, decode
+from run_events import RunEventLog
+
+
+class CountingRedis:
+    """Just enough of a redis client for RunEventLog, counting the bytes it is sent."""
+
+    def __init__(self):
+        self.redis_bytes = 0
+        self.ws_bytes = 0
+        self.publishes = 0
+        self.round_trips = 0
+        self._ids = itertools.count(1)
+
+    def _size(self, value):
+        return len(value) if isinstance(value, (bytes, str)) else len(str(value))
+
+    def pipeline(self, transaction=True):
+        return CountingPipeline(self)
+
+    def publish(self, channel, message):
+        self.round_trips += 1
+        return self._publish(channel, message)
+
+    def _publish(self, channel, message):
+        self.publishes += 1
+        self.redis_bytes += self._size(message)
+        decoded = decode(message)
+        events = decoded["events"] if isinstance(decoded, dict) and "events" in decoded else [decoded]
+        self.ws_bytes += sum(len(json.dumps(event)) for event in events)
+        return 1
+
+    def hset(self, key, mapping):
+        self.round_trips += 1
+
+
+class CountingPipeline:
+    def __init__(self, client):
+        self.client = client
+        self.results = []
+
+    def xadd(self, key, fields, maxlen=None, approximate=True):
+        self.client.redis_bytes += sum(self.client._size(v) for v in fields.values())
+        self.results.append(f"0-{next(self.client._ids)}".encode())
+
+    def set(self, key, value, ex=None):
+        self.client.redis_bytes += self.client._size(value)
+        self.results.append(True)
+
+    def publish(self, channel, message):
+        self.results.append(self.client._publish(channel, message))
+
+    def __getattr__(self, name):
+        # expire, hset, lpush, ltrim
+        def command(*args, **kwargs):
+            self.results.append(True)
+        return command
+
+    def execute(self):
+        self.client.round_trips += 1
+        return self.results
+
+
+class PublishOnly(RunEventLog):
+    """The executor before the run streams: one PUBLISH of the full event."""
+
+    def append(self, run_id, user_id, event):
+        self.redis_client.publish(f"workflow_{user_id}", json.dumps(event))
+
+
+def csv_text(kb):
+    row = "2024-01-01,ACME Corp,purchase order,1234.56,approved,north-east region\n"
+    return row * (kb * 1024 // len(row))
+
+
+async def simulate_run(log, args):
+    seq = itertools.count(1)
+
+    def event(node, name, data):
+        return {"workflow_id": "wf", "run_id": "run", "seq": next(seq), "node": node, "agent_name": name,
+                "status": "executed successfully", "timestamp": "2026-10-18T12:00:00", "data": data}
+
+    log.start("run", "wf", "user")
+    log.append("run", "user", event(1, "csv_reader", {"response": csv_text(args.csv_kb)}))
+    log.append("run", "user", event(2, "pdf_to_text", {"response": csv_text(args.csv_kb // 4).replace(",", " ")}))
+    log.append("run", "user", event(3, "ai", {"summary": "Orders by region. " * 80, "rows": args.elements}))
+    log.append("run", "user", event(4, "iterator", {"response": [f"row {i}" for i in range(args.elements)]}))
+
+    limit = asyncio.Semaphore(args.in_flight)
+
+    async def element(i):
+        async with limit:
+            await asyncio.sleep(args.element_ms / 1000)
+            log.append("run", "user", event(5, "ai", {"row": i, "analysis": f"Row {i} looks fine. " * 30}))
+
+    await asyncio.gather(*(element(i) for i in range(args.elements)))
+    log.finish("run", "success")
+
+
+def measure(name, make_log, args):
+    client = CountingRedis()
+    log = make_log(client)
+    start = time.perf_counter()
+    asyncio.run(simulate_run(log, args))
+    seconds = time.perf_counter() - start
+    print(f"{name:12} redis {client.redis_bytes / 1e6:8.2f} MB   ws {client.ws_bytes / 1e6:8.2f} MB   "
+          f"publishes {client.publishes:5}   round trips {client.round_trips:5}   {seconds:5.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--elements", type=int, default=300)
+    parser.add_argument("--in-flight", type=int, default=8)
+    parser.add_argument("--element-ms", type=float, default=20)
+    parser.add_argument("--csv-kb", type=int, default=2048)
+    parser.add_argument("--batch-ms", type=float, default=50)
+    parser.add_argument("--max-bytes", type=int, default=4096)
+    args = parser.parse_args()
+
+    full = EventPayloadPolicy(max_bytes=0)
+    measure("publish", lambda c: PublishOnly(c), args)
+    measure("stream", lambda c: RunEventLog(c, batch_seconds=0, policy=full), args)
+    measure("policy", lambda c: RunEventLog(c, batch_seconds=args.batch_ms / 1000,
+                                            policy=EventPayloadPolicy(max_bytes=args.max_bytes)), args)
+    measure("policy+zlib", lambda c: RunEventLog(c, batch_seconds=args.batch_ms / 1000,
+                                                 policy=EventPayloadPolicy(max_bytes=args.max_bytes, compress=True)), args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Fuzz check and benchmark of llm_json.extract_json on the logged answers.
+
+Every workflow response in the generation log (prism.json first) is wrapped
+the ways the chains answer: plain, ```json fences with and without the
+newline before the closing fence, ```python fences, prose before / after,
+python literals with single quotes, a trailing comma and a cut off answer.
+Each variant must come back equal to the original (the cut off one only has
+to parse). "slices" is the old `[7:-4]` / `[7:-3]` parsing for comparison.
+
+    cd Agentic
+    python -m bench.llm_json --rounds 20
+"""
+
+import argparse
+import json
+import random
+import time
+
+from generation_log import read_entries
+from llm_json import LLMJSONError, extract_json, orjson
+
+
+def pythonish(value):
+    return repr(value)
+
+
+def trailing_comma(text):
+    last = text.rfind("}", 0, len(text) - 1)
+    return text[:last + 1] + "," + text[last + 1:] if last != -1 else text
+
+
+VARIANTS = {
+    "plain": lambda s, v: s,
+    "indented": lambda s, v: json.dumps(v, indent=2),
+    "fence": lambda s, v: f"```json\n{s}\n```",
+    "fence_no_newline": lambda s, v: f"```json\n{s}```",
+    "python_fence": lambda s, v: f"```python\n{s}\n```\n",
+    "prose": lambda s, v: f"Here is the workflow:\n{s}\nLet me know if you need changes.",
+    "fence_prose": lambda s, v: f"```json\n{s}\n```\nThe workflow above uses an iterator [1].",
+    "pythonish": lambda s, v: pythonish(v),
+    "trailing_comma": lambda s, v: trailing_comma(s),
+}
+
+
+def old_slices(text):
+    if text[0] == "`":
+        try:
+            return json.loads(text[7:-4])
+        except ValueError:
+            return json.loads(text[7:-3])
+    return json.loads(text)
+
+
+def cases():
+    for entry in read_entries():
+        response = entry.get("response")
+        if isinstance(response, (dict, list)):
+            yield response
+
+
+def fuzz(responses, rng):
+    failures = 0
+    for value in responses:
+        text = json.dumps(value)
+        for name, wrap in VARIANTS.items():
+            wrapped = wrap(text, value)
+            try:
+                ok = extract_json(wrapped) == value
+            except LLMJSONError:
+                ok = False
+            if not ok:
+                failures += 1
+                print(f"FAIL {name}: {wrapped[:120]!r}")
+        cut = f"```json\n{text[:rng.randint(len(text) // 2, len(text) - 1)]}"
+        try:
+            extract_json(cut)
+        except LLMJSONError:
+            # a cut inside a key or a literal cannot always be repaired
+            pass
+    return failures
+
+
+def bench(parse, texts, rounds):
+    ok = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for text in texts:
+            try:
+                parse(text)
+                ok += 1
+            except ValueError:
+                pass
+    return time.perf_counter() - start, ok / (rounds * len(texts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    responses = list(cases())
+    failures = fuzz(responses, random.Random(args.seed))
+    print(f"{len(responses)} responses x {len(VARIANTS)} variants, {failures} failures")
+    print(f"backend: {'orjson' if orjson is not None else 'json'}")
+
+    for name in ("fence", "fence_no_newline", "prose", "pythonish"):
+        texts = [VARIANTS[name](json.dumps(v), v) for v in responses]
+        for label, parse in (("slices", old_slices), ("extract_json", extract_json)):
+            seconds, parsed = bench(parse, texts, args.rounds)
+            per_call = seconds / (args.rounds * len(texts)) * 1e6
+            print(f"{name:18} {label:13} {per_call:8.1f} us/answer  parsed {parsed:6.1%}")
+
+
+if __name__ == "__main__":
+    main()
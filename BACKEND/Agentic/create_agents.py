@@ -1,6 +1,4 @@
-from fastapi import FastAPI, HTTPException, Depends, Request, WebSocket, WebSocketDisconnect
-from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from jose import jwt, jwk
+from fastapi import FastAPI, HTTPException, Depends, Request, Response, WebSocket, WebSocketDisconnect
 import requests
 import logging
 from clerk_backend_api import Clerk
@@ -8,27 +6,40 @@ import os
 from dotenv import load_dotenv
 from pydantic import BaseModel
 import json
-from Workflow_ec2.start_flow import syn
-from groq import Groq
+from Workflow_ec2.start_flow import syn, resume_run
 from fastapi.middleware.cors import CORSMiddleware
 from tools.tool_classes import *
 import inspect
 from tools.googlE import flow, setup_watch, save_google_credentials, get_fresh_google_credentials, extract_email
 from auth import check_connection, create_connection_oauth2
 from urllib.parse import unquote
+from token_auth import JWKS_STORE, adecode_token, current_user_id
 from prompts import  ques_flow_chain,gemini_chain, major_tool_chain,trigger_chain
+from llm_cache import cache_stats
+from llm_gateway import GATEWAY
+from usage import GENERATION, QuotaExceeded, check_quota, usage_context, usage_report
+from semantic_cache import SEMANTIC_CACHE, SEMANTIC_CACHE_ENABLED
 from tools.dynamo import db_client, s3_client
+from tools.user_store import get_api_keys, invalidate_user
+from tools.async_dynamo import adb, ausers, aworkflows, run_db
+from tools.catalog import TOOL_CATALOG
+from tools.usage_store import ensure_usage_table
+from generation_log import GENERATION_LOG
+from workflow_stream import NodeStreamParser, sse
+from ws_hub import WS_HUB
+from run_events import RunEventReader
+from run_state import resume_blocker, retry_attempted
+from llm_json import extract_json
 import json
 import urllib.parse
 import uuid
 from contextlib import asynccontextmanager
-from fastapi.responses import JSONResponse
-from openai import OpenAI
+from fastapi.responses import JSONResponse, StreamingResponse
 import asyncio
+import time
 from redis.asyncio import Redis
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv("deepseek"), base_url="https://api.deepseek.com")
 
 
 recent_mails={}
@@ -39,6 +50,7 @@ class Query(BaseModel):
     query: str
     flag:int
     wid:str
+    fresh: bool = False     # skip the semantic cache and always generate
 
 class Question(BaseModel):
     question: dict
@@ -62,15 +74,15 @@ class Tool(BaseModel):
     
 
 
-groq = Groq()
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 clerk_issuer = os.getenv("CLERK_ISSUER")
-clerk_jwks_url = os.getenv("CLERK_JWKS_URL")
 clerk_secret_key = os.getenv("CLERK_SECRET_KEY")
 clerk_sdk = Clerk(bearer_auth=clerk_secret_key)
+# node events of past and running workflow runs, see run_events.py
+RUN_EVENTS = RunEventReader(Redis(host="localhost", port=6379, db=0))
 # @asynccontextmanager
 # async def lifespan(app: FastAPI):
 #     # Start up
@@ -124,41 +136,35 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 
-security = HTTPBearer()
-def get_jwks():
-    response = requests.get(clerk_jwks_url)
-    return response.json()
-def get_public_key(kid):
-    jwks = get_jwks()
-    for key in jwks['keys']:
-        if key['kid'] == kid:
-            return jwk.construct(key)
-    raise HTTPException(status_code=401, detail="Invalid token")
-def decode_token(token: str):
-    headers = jwt.get_unverified_headers(token)
-    kid = headers['kid']
-    public_key = get_public_key(kid)
-    # print("public_key",public_key)
-    # First decode without verification to get the audience
-    unverified_claims = jwt.get_unverified_claims(token)
-    # print("unverified_claims",unverified_claims)
-    audience = unverified_claims.get('sub')
-    token_issuer = unverified_claims.get('iss')
-    # print("audience", audience)
-    # print("Token issuer:", token_issuer)
-    # print("Expected issuer:", clerk_issuer)
-    return jwt.decode(token, public_key.to_pem().decode('utf-8'), algorithms=['RS256'], audience=audience , issuer=token_issuer)
-
-
-
-
-prev=None
+
+@app.on_event("startup")
+async def warm_jwks():
+    # load the signing keys once so the first requests don't pay for the fetch
+    await asyncio.to_thread(JWKS_STORE.refresh)
+
+
+@app.on_event("startup")
+async def create_workflows_table():
+    await aworkflows.ensure_workflows_table()
+
+
+@app.on_event("startup")
+async def create_usage_table():
+    await run_db(ensure_usage_table)
+
+
+@app.on_event("startup")
+async def load_tool_catalog():
+    # parse the tool files and reflect on the tool classes before the first request
+    await asyncio.to_thread(TOOL_CATALOG.get)
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    global prev
     await websocket.accept()
 
     # Extract token from query param
@@ -167,55 +173,129 @@ async def websocket_endpoint(websocket: WebSocket):
     if not token:
         await websocket.close()
         return
-    # while True:
     try:
-        payload = decode_token(token)  # Your Clerk JWT decoder
+        payload = await adecode_token(token)  # Your Clerk JWT decoder
         user_id = payload.get("sub")
-        # print("user_id",user_id)
-        if not user_id:
-            await websocket.close()
-            return
+    except Exception as e:
+        print("Auth Error:", e)
+        await websocket.close()
+        return
+    # print("user_id",user_id)
+    if not user_id:
+        await websocket.close()
+        return
+
+    # last seq sent per run on this socket, events arrive in seq order
+    last_seq = {}
 
-        # Create Redis connection and subscribe
-        redis = Redis(host="localhost", port=6379, db=0, decode_responses=True)
-        pubsub = redis.pubsub()
-        channel = f"workflow_{user_id}"
-        await pubsub.subscribe(channel)
+    async def deliver(data):
+        run_id, seq = data.get("run_id"), data.get("seq")
+        if run_id is not None and seq is not None:
+            if seq <= last_seq.get(run_id, 0):
+                return
+            last_seq[run_id] = seq
+        await websocket.send_json(data)
 
+    async def send(subscription):
+        while True:
+            await deliver(await subscription.get())
+
+    async def receive():
+        # the client never sends anything, this only notices the disconnect
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    # events come from the process wide subscriber, no redis connection per socket
+    async with WS_HUB.subscribe(user_id) as subscription:
+        # ?run_id=...&last_id=...: first replay what the socket missed, live
+        # events buffer meanwhile and the ones already replayed are skipped by seq
+        run_id = websocket.query_params.get("run_id")
+        if run_id and (await RUN_EVENTS.meta(run_id)).get("user_id") == user_id:
+            try:
+                for data in await RUN_EVENTS.events(run_id, after=websocket.query_params.get("last_id")):
+                    await deliver(data)
+            except WebSocketDisconnect:
+                return
+        tasks = [asyncio.create_task(send(subscription)), asyncio.create_task(receive())]
         try:
-            
-            async for message in pubsub.listen():
-                print(message)
-                if message["type"] == "message":
-                    data = json.loads(message["data"])
-                    if prev and prev==data:
-                        
-                        continue
-                    await websocket.send_json(data)
-                    prev = data
-
-        except WebSocketDisconnect:
-            print(f"User {user_id} disconnected")
-        # finally:
-        #     await pubsub.unsubscribe(f"workflow_updates:{user_id}")
-        #     await pubsub.close()
-        #     await redis.close()
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                if error is not None and not isinstance(error, WebSocketDisconnect):
+                    print("Websocket Error:", error)
+        finally:
+            for task in tasks:
+                task.cancel()
+    print(f"User {user_id} disconnected")
+
+
+@app.get("/workflow/{workflow_id}/runs")
+async def workflow_runs(workflow_id: str, user_id: str = Depends(current_user_id)):
+    """The workflow's last runs, newest first: run_id, status, started_at, finished_at."""
+    runs = await RUN_EVENTS.recent_runs(workflow_id)
+    return {"runs": [run for run in runs if run.get("user_id") == user_id]}
+
+
+@app.get("/runs/{run_id}/timeline")
+async def run_timeline(run_id: str, user_id: str = Depends(current_user_id)):
+    """Every node event of a run, in order, for runs younger than RUN_EVENTS_TTL."""
+    run = await RUN_EVENTS.meta(run_id)
+    if run.get("user_id") != user_id:
+        raise HTTPException(status_code=404, detail="Run not found")
+    return {"run": run, "events": await RUN_EVENTS.events(run_id)}
+
+
+@app.post("/runs/{run_id}/resume")
+async def resume_workflow_run(run_id: str, retry_attempted_calls: bool = False, user_id: str = Depends(current_user_id)):
+    """
+    Restart a run whose worker died (or that partially failed) from its last checkpoint.
+    retry_attempted_calls=true runs the side effecting calls that were started
+    but never recorded again (they may have gone through, e.g. a sent email).
+    """
+    run = await RUN_EVENTS.meta(run_id)
+    if run.get("user_id") != user_id:
+        raise HTTPException(status_code=404, detail="Run not found")
+    blocker = await resume_blocker(RUN_EVENTS.aredis, run_id)
+    if blocker is not None:
+        return JSONResponse(content={"status": "error", "message": blocker}, status_code=409)
+    plan, _ = await ausers.get_plan_and_api_keys(user_id)
+    try:
+        await run_db(check_quota, user_id, plan)
+    except QuotaExceeded as e:
+        return JSONResponse(content={"status": "error", "message": str(e)}, status_code=429)
+    if retry_attempted_calls:
+        await retry_attempted(RUN_EVENTS.aredis, run_id)
+    resume_run.delay(run_id)
+    return {"status": "resuming", "run_id": run_id}
+
+
+@app.get("/runs/{run_id}/payload/{seq}")
+async def run_payload(run_id: str, seq: int, user_id: str = Depends(current_user_id)):
+    """Full data of an event that was sent truncated (its data.ref points here)."""
+    run = await RUN_EVENTS.meta(run_id)
+    if run.get("user_id") != user_id:
+        raise HTTPException(status_code=404, detail="Run not found")
+    data = await RUN_EVENTS.payload(run_id, seq)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Payload expired")
+    return {"data": data}
 
-    except Exception as e:
-        print("Auth or Redis Error:", e)
-        await websocket.close()
+
+@app.get("/ws_stats")
+async def ws_stats(user_id: str = Depends(current_user_id)):
+    """Sockets, buffered / dropped / coalesced events of the /ws subscriber in this api process."""
+    return WS_HUB.stats()
+
+
+@app.on_event("shutdown")
+async def close_ws_hub():
+    await WS_HUB.close()
 
 
 
 
 @app.post("/file_upload")
-async def file_upload(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
-    payload = decode_token(token)
-    user_id = payload.get("sub")
-    
-    if not user_id:
-        raise HTTPException(status_code=401, detail="User ID not found in token")
+async def file_upload(request: Request, user_id: str = Depends(current_user_id)):
     
     form = await request.form()
     file = form.get("file")
@@ -259,13 +339,7 @@ async def file_upload(request: Request, credentials: HTTPAuthorizationCredential
 
 
 @app.post("/checkuser")
-async def check_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
-    payload = decode_token(token)
-    user_id = payload.get("sub")
-    
-    if not user_id:
-        raise HTTPException(status_code=401, detail="User ID not found in token")
+async def check_user(user_id: str = Depends(current_user_id)):
     
     try:
         print(f"Checking user_id: {user_id}")
@@ -276,15 +350,10 @@ async def check_user(credentials: HTTPAuthorizationCredentials = Depends(securit
         # response = db_client.describe_table(TableName="users")
         # print(response["Table"]["KeySchema"])
 
-        response = db_client.get_item(
-            TableName="users",
-            Key={"clerk_id": {"S": user_id}}
-        )
+        user = await ausers.get_user(user_id, ["clerk_id"])
 
-        # print("Response from DynamoDB:", response)  # ✅ Should print response
-        
-        if "Item" not in response:
-            db_client.put_item(
+        if user is None:
+            await adb.put_item(
                 TableName="users",
                 Item={
                     "clerk_id": {"S": user_id},
@@ -294,6 +363,7 @@ async def check_user(credentials: HTTPAuthorizationCredentials = Depends(securit
                     "gmailtrigger": {"M": {}}
                 },
             )
+            invalidate_user(user_id)
 
         # table_name = 'custom_credentials'
 
@@ -327,26 +397,9 @@ async def check_user(credentials: HTTPAuthorizationCredentials = Depends(securit
 
 
 @app.post("/save_workflow")
-async def save_flow(w:W,credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
-    payload = decode_token(token)
-    user_id = payload.get('sub')
-    if not user_id:
-        raise HTTPException(status_code=401, detail="User ID not found in token")
+async def save_flow(w:W,user_id: str = Depends(current_user_id)):
     try:
-        response = db_client.update_item(
-            TableName='users',
-            Key={'clerk_id': {'S': user_id}},
-            UpdateExpression="SET workflows.#wid.#json = :new_json",
-            ExpressionAttributeNames={
-            '#wid': w.workflowjson["workflow_id"],
-            '#json': 'json'
-            },
-            ExpressionAttributeValues={
-            ':new_json': {'S': json.dumps(w.workflowjson, indent=2)}
-            },
-            ReturnValues="UPDATED_NEW"
-        )
+        response = await aworkflows.save_workflow(user_id, w.workflowjson)
         print("Update succeeded:", response)
     except Exception as e:
         print("Error updating item:", e)
@@ -355,22 +408,17 @@ async def save_flow(w:W,credentials: HTTPAuthorizationCredentials = Depends(secu
     return {"json":w.workflowjson}
 
 @app.post("/public_workflow")
-async def public_workflow(w: WP, credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
-    payload = decode_token(token)
-    user_id = payload.get('sub')
-    if not user_id:
-        raise HTTPException(status_code=401, detail="User ID not found in token")
+async def public_workflow(w: WP, user_id: str = Depends(current_user_id)):
     
     # Check if public_workflows table exists
     try:
         # List all tables to check if public_workflows exists
-        existing_tables = db_client.list_tables()['TableNames']
+        existing_tables = (await adb.list_tables())['TableNames']
         table_name = 'public_workflows'
         
         if table_name not in existing_tables:
             # Create the public_workflows table with wid as primary key
-            response = db_client.create_table(
+            response = await adb.create_table(
                 TableName=table_name,
                 KeySchema=[
                     {'AttributeName': 'wid', 'KeyType': 'HASH'}  # Primary Key
@@ -387,14 +435,14 @@ async def public_workflow(w: WP, credentials: HTTPAuthorizationCredentials = Dep
             
             # Wait for table to be created before proceeding
             waiter = db_client.get_waiter('table_exists')
-            waiter.wait(TableName=table_name)
+            await run_db(waiter.wait, TableName=table_name)
             print(f"Table '{table_name}' is now available")
         
         # Save the workflow to the public_workflows table
         workflow_id = w.workflowjson["workflow_id"]
         refined_prompt = w.refined_prompt
         
-        db_client.put_item(
+        await adb.put_item(
             TableName='public_workflows',
             Item={
                 'wid': {'S': workflow_id},
@@ -408,19 +456,7 @@ async def public_workflow(w: WP, credentials: HTTPAuthorizationCredentials = Dep
         )
 
         try:
-            response = db_client.update_item(
-                TableName='users',
-                Key={'clerk_id': {'S': user_id}},
-                UpdateExpression="SET workflows.#wid.#pub = :is_public",
-                ExpressionAttributeNames={
-                '#wid': w.workflowjson["workflow_id"],
-                '#pub': 'public'
-                },
-                ExpressionAttributeValues={
-                ':is_public': {'BOOL': True}
-                },
-                ReturnValues="UPDATED_NEW"
-            )
+            response = await aworkflows.set_public(user_id, workflow_id)
             print("Update succeeded:", response)
         except Exception as e:
             print("Error updating item:", e)
@@ -434,52 +470,23 @@ async def public_workflow(w: WP, credentials: HTTPAuthorizationCredentials = Dep
 
 
 @app.delete("/delete_workflow/{workflow_id}")
-async def delete_workflow(workflow_id: str, credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
-    payload = decode_token(token)
-    user_id = payload.get('sub')
-    if not user_id:
-        raise HTTPException(status_code=401, detail="User ID not found in token")
+async def delete_workflow(workflow_id: str, user_id: str = Depends(current_user_id)):
     
     try:
-        # Fetch user data
-        user_data = db_client.get_item(
-            TableName="users",
-            Key={"clerk_id": {"S": user_id}}
-        )
-        
-        # Check if workflows exist
-        workflows = user_data.get("Item", {}).get("workflows", {}).get("M", {})
-        if workflow_id not in workflows:
-            raise HTTPException(status_code=404, detail="Workflow not found")
-        
-        # Delete the workflow
-        response = db_client.update_item(
-            TableName="users",
-            Key={"clerk_id": {"S": user_id}},
-            UpdateExpression="REMOVE workflows.#wid",
-            ExpressionAttributeNames={
-                "#wid": workflow_id
-            },
-            ReturnValues="UPDATED_NEW"
-        )
-        print("Workflow deleted successfully:", response)
-        return {"status": "success", "message": "Workflow deleted successfully"}
-    
+        deleted = await aworkflows.delete_workflow(user_id, workflow_id)
     except Exception as e:
         print("Error deleting workflow:", e)
         raise HTTPException(status_code=500, detail=f"Error deleting workflow: {str(e)}")
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Workflow not found")
+    print("Workflow deleted successfully:", workflow_id)
+    return {"status": "success", "message": "Workflow deleted successfully"}
 
 @app.post("/save_api_keys")
-async def save_api_keys(api_keys:ApiKeys,credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
-    payload = decode_token(token)
-    user_id = payload.get('sub')
-    if not user_id:
-        raise HTTPException(status_code=401, detail="User ID not found in token")
+async def save_api_keys(api_keys:ApiKeys,user_id: str = Depends(current_user_id)):
     try:
         print(api_keys.dict().items())
-        response = db_client.update_item(
+        response = await adb.update_item(
             TableName='users',
             Key={'clerk_id': {'S': user_id}},
             UpdateExpression="SET api_key = :new_api_keys",
@@ -488,6 +495,7 @@ async def save_api_keys(api_keys:ApiKeys,credentials: HTTPAuthorizationCredentia
             },
             ReturnValues="UPDATED_NEW"
         )
+        invalidate_user(user_id)
         print("Update succeeded:", response)
     except Exception as e:
         print("Error updating item:", e)
@@ -496,94 +504,67 @@ async def save_api_keys(api_keys:ApiKeys,credentials: HTTPAuthorizationCredentia
 
 
 @app.get("/sidebar_workflows")
-async def get_sidebar_workflows(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
-    payload = decode_token(token)
-    user_id = payload.get('sub')
-    if not user_id:
-        raise HTTPException(status_code=401, detail="User ID not found in token")
-    user_data = db_client.get_item(
-        TableName="users",
-        Key={"clerk_id": {"S": user_id}}
-    )
-    
-    workflows = user_data.get("Item", {}).get("workflows", {}).get("M", {})
-    
-    formatted_workflows = []
+async def get_sidebar_workflows(limit: int = 50, cursor: str = None, user_id: str = Depends(current_user_id)):
+    # names/flags only; the full json is fetched per workflow from /workflow/{workflow_id}
+    limit = max(1, min(limit, 200))
+    try:
+        items, next_cursor = await aworkflows.list_workflow_summaries(user_id, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     
-    for item in workflows.items():
-        wid = item[0]
-        workflow = item[1]
-        
-        # Check if we have a third element (public flag)
-        public = False
-        if len(item) == 3:
-            public = item[2]
-        elif "public" in workflow.get("M", {}):
-            public = workflow.get("M", {}).get("public", {}).get("BOOL", False)
-        
-        formatted_workflows.append({
-            "id": wid,
-            "name": json.loads(workflow.get("M", {}).get("json", {}).get("S", "{}")).get("workflow_name", ""),
-            "json": workflow.get("M", {}).get("json", {}).get("S", "{}"),
-            "prompt": workflow.get("M", {}).get("prompt", {}).get("S", ""),
-            "active": json.loads(workflow.get("M", {}).get("json", {}).get("S", "{}")).get("active", False),
-            "public": public
-        })
-    # print(formatted_workflows)
-
-    return JSONResponse(content=formatted_workflows)
+    formatted_workflows = [
+        {
+            "id": workflow["workflow_id"]["S"],
+            "name": workflow.get("workflow_name", {}).get("S", ""),
+            "prompt": workflow.get("prompt", {}).get("S", ""),
+            "active": workflow.get("active", {}).get("BOOL", False),
+            "public": workflow.get("public", {}).get("BOOL", False),
+            "trigger": workflow.get("trigger", {}).get("S", ""),
+        }
+        for workflow in items
+    ]
+
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return JSONResponse(content=formatted_workflows, headers=headers)
+
+
+@app.get("/workflow/{workflow_id}")
+async def get_workflow(workflow_id: str, user_id: str = Depends(current_user_id)):
+    workflow = await aworkflows.get_workflow(user_id, workflow_id)
+    if workflow is None:
+        raise HTTPException(status_code=404, detail="Workflow not found")
+    return {
+        "id": workflow_id,
+        "json": workflow.get("json", {}).get("S", "{}"),
+        "prompt": workflow.get("prompt", {}).get("S", ""),
+        "public": workflow.get("public", {}).get("BOOL", False),
+    }
 
 
 
 @app.post("/run_workflow")
-async def run_workflow(w:W,credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
-    payload = decode_token(token)
-    user_id = payload.get('sub')
+async def run_workflow(w:W,user_id: str = Depends(current_user_id)):
     w.workflowjson["active"]=True
-    if not user_id:
-        raise HTTPException(status_code=401, detail="User ID not found in token")
-    user_data = db_client.get_item(
-            TableName="users",
-            Key={"clerk_id": {"S": user_id}}
-        )
-        
-    plan = user_data.get("Item", {}).get("plan", {}).get("S", "")
-    api_key = user_data.get("Item", {}).get("api_key", {}).get("M", {})
+    plan, final_dict = await ausers.get_plan_and_api_keys(user_id)
     
-    if plan == "free" and not api_key:
+    if plan == "free" and not final_dict:
         return JSONResponse(content={"status": "error", "message": "Please fill in your API keys to proceed."}, status_code=400)
+    try:
+        await run_db(check_quota, user_id, plan)
+    except QuotaExceeded as e:
+        return JSONResponse(content={"status": "error", "message": str(e)}, status_code=429)
     
     # task = syn.delay(user_id, w.workflowjson)
     # trigger=w.workflowjson["trigger"]
     tools=[i["name"].lower() for i in w.workflowjson["workflow"] if i["type"]=="tool" and i["name"].upper() in composio_tools]
     # print(trigger)
-    response = db_client.get_item(
-                TableName='users',
-                Key={'clerk_id': {'S': user_id}}
-            )
-    api_keys = response.get('Item', {}).get('api_key', {}).get('M', {})
-    final_dict = {k: v['S'] for k, v in api_keys.items()}
     
-    for i in tools:
-        if not check_connection(i, final_dict["composio"]):
-            return JSONResponse(content={"status": "error", "message": "Please fill in your API keys to proceed."}, status_code=400)
+    connected = await asyncio.gather(*(asyncio.to_thread(check_connection, i, final_dict["composio"]) for i in tools))
+    if not all(connected):
+        return JSONResponse(content={"status": "error", "message": "Please fill in your API keys to proceed."}, status_code=400)
 
     try:
-        response = db_client.update_item(
-            TableName='users',
-            Key={'clerk_id': {'S': user_id}},
-            UpdateExpression="SET workflows.#wid.#json = :new_json",
-            ExpressionAttributeNames={
-            '#wid': w.workflowjson["workflow_id"],
-            '#json': 'json'
-            },
-            ExpressionAttributeValues={
-            ':new_json': {'S': json.dumps(w.workflowjson, indent=2)}
-            },
-            ReturnValues="UPDATED_NEW"
-        )
+        response = await aworkflows.save_workflow(user_id, w.workflowjson)
         print("Update succeeded:", response)
     except Exception as e:
         print("Error updating item:", e)
@@ -598,24 +579,17 @@ async def run_workflow(w:W,credentials: HTTPAuthorizationCredentials = Depends(s
 
 
 @app.post("/activate_workflow")
-async def activate_workflow(w:W,credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
-    payload = decode_token(token)
-    user_id = payload.get('sub')
-    if not user_id:
-        raise HTTPException(status_code=401, detail="User ID not found in token")
+async def activate_workflow(w:W,user_id: str = Depends(current_user_id)):
     if not w.workflowjson["active"]:
         
-        user_data = db_client.get_item(
-            TableName="users",
-            Key={"clerk_id": {"S": user_id}}
-        )
+        plan, final_dict = await ausers.get_plan_and_api_keys(user_id)
         
-        plan = user_data.get("Item", {}).get("plan", {}).get("S", "")
-        api_key = user_data.get("Item", {}).get("api_key", {}).get("M", {})
-        
-        if plan == "free" and not api_key:
+        if plan == "free" and not final_dict:
             return JSONResponse(content={"status": "error", "message": "Please fill in your API keys to proceed."}, status_code=400)
+        try:
+            await run_db(check_quota, user_id, plan)
+        except QuotaExceeded as e:
+            return JSONResponse(content={"status": "error", "message": str(e)}, status_code=429)
         
         # task = syn.delay(user_id, w.workflowjson)
         trigger=w.workflowjson["trigger"]
@@ -640,9 +614,10 @@ async def activate_workflow(w:W,credentials: HTTPAuthorizationCredentials = Depe
             # here try to handle all auths, 
 
             try:
-                user_details = clerk_sdk.users.list(user_id=[user_id])[0]
+                # clerk, dynamo and the gmail api are all blocking clients
+                user_details = (await asyncio.to_thread(clerk_sdk.users.list, user_id=[user_id]))[0]
                 mail=user_details.email_addresses[0].email_address
-                setup_watch(mail)
+                await asyncio.to_thread(setup_watch, mail)
                 # return {"status":"workflow activated"}
             except Exception as e:
                 print("Error setting up Gmail watch:", e)
@@ -652,33 +627,14 @@ async def activate_workflow(w:W,credentials: HTTPAuthorizationCredentials = Depe
 
 
         #tool auths
-
-        response = db_client.get_item(
-                TableName='users',
-                Key={'clerk_id': {'S': user_id}}
-            )
-        api_keys = response.get('Item', {}).get('api_key', {}).get('M', {})
-        final_dict = {k: v['S'] for k, v in api_keys.items()}
         
-        for i in tools:
-            if not check_connection(i, final_dict["composio"]):
-                return JSONResponse(content={"status": "error", "message": "Please fill in your API keys to proceed."}, status_code=400)
+        connected = await asyncio.gather(*(asyncio.to_thread(check_connection, i, final_dict["composio"]) for i in tools))
+        if not all(connected):
+            return JSONResponse(content={"status": "error", "message": "Please fill in your API keys to proceed."}, status_code=400)
         
         w.workflowjson["active"]=True
         try:
-            response = db_client.update_item(
-                TableName='users',
-                Key={'clerk_id': {'S': user_id}},
-                UpdateExpression="SET workflows.#wid.#json = :new_json",
-                ExpressionAttributeNames={
-                '#wid': w.workflowjson["workflow_id"],
-                '#json': 'json'
-                },
-                ExpressionAttributeValues={
-                ':new_json': {'S': json.dumps(w.workflowjson, indent=2)}
-                },
-                ReturnValues="UPDATED_NEW"
-            )
+            response = await aworkflows.save_workflow(user_id, w.workflowjson)
             print("Update succeeded:", response)
         except Exception as e:
             print("Error updating item:", e)
@@ -696,19 +652,7 @@ async def activate_workflow(w:W,credentials: HTTPAuthorizationCredentials = Depe
         w.workflowjson["active"]=False
         # store in database that it is false now
         try:
-            response = db_client.update_item(
-                TableName='users',
-                Key={'clerk_id': {'S': user_id}},
-                UpdateExpression="SET workflows.#wid.#json = :new_json",
-                ExpressionAttributeNames={
-                '#wid': w.workflowjson["workflow_id"],
-                '#json': 'json'
-                },
-                ExpressionAttributeValues={
-                ':new_json': {'S': json.dumps(w.workflowjson, indent=2)}
-                },
-                ReturnValues="UPDATED_NEW"
-            )
+            response = await aworkflows.save_workflow(user_id, w.workflowjson)
             print("Update succeeded:", response)
         except Exception as e:
             print("Error updating item:", e)
@@ -780,37 +724,21 @@ async def gmail_webhook(request: Request):
     #     print(f"New email notification received: {message_id}")
     
 
-    message_id ,user_id= get_latest_email_id(data["emailAddress"])
+    # both refresh the google credentials in dynamo before calling gmail
+    message_id ,user_id= await asyncio.to_thread(get_latest_email_id, data["emailAddress"])
     if recent_mails.get(data["emailAddress"]):
         if recent_mails[data["emailAddress"]]==message_id:
             return {"status": "success"}
     recent_mails[data["emailAddress"]] = message_id
     print("user_id",user_id)    
     if message_id:
-        email_data = get_email_content(data["emailAddress"], message_id)
+        email_data = await asyncio.to_thread(get_email_content, data["emailAddress"], message_id)
         # print(email_data)
         tg_o=extract_email(email_data)
-        # Fetch user data from DynamoDB
-        user_data = db_client.get_item(
-            TableName="users",
-            Key={"clerk_id": {"S": user_id}}
-        )
-
-        # Extract workflows
-        workflows = user_data.get("Item", {}).get("workflows", {}).get("M", {})
-
-        # Filter active workflows with Gmail trigger
-        # Debugging: Print the structure of workflows
-        # print("Workflows structure:", workflows)
-
+        # Only the active workflows with a Gmail trigger, straight from the GSI
         active_gmail_workflows = [
-            {
-                "id": wid,
-                "workflow": json.loads(workflow.get("M", {}).get("json", {}).get("S", "{}"))
-            }
-            for wid, workflow in workflows.items()
-            if json.loads(workflow.get("M", {}).get("json", {}).get("S", "{}")).get("active",False) and
-               json.loads(workflow.get("M", {}).get("json", {}).get("S", "{}")).get("trigger", {}).get("name") == "TRIGGER_NEW_GMAIL_MESSAGE"
+            {"id": wid, "workflow": workflow}
+            for wid, workflow in await aworkflows.active_workflows(user_id, "TRIGGER_NEW_GMAIL_MESSAGE")
         ]
 
         # Debugging: Print the filtered workflows
@@ -829,18 +757,8 @@ async def gmail_webhook(request: Request):
 
 
 @app.get("/user_auths")
-def user_auths(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
-    payload = decode_token(token)
-    user_id = payload.get('sub')
-    if not user_id:
-        raise HTTPException(status_code=401, detail="User ID not found in token")
-    api_keys_response = db_client.get_item(
-            TableName='users',
-            Key={'clerk_id': {'S': user_id}}
-        )
-    api_keys = api_keys_response.get('Item', {}).get('api_key', {}).get('M', {})
-    api_keys = {k: v['S'] for k, v in api_keys.items()}
+def user_auths(user_id: str = Depends(current_user_id)):
+    api_keys = get_api_keys(user_id)
     print(api_keys)
     comp={app.capitalize():check_connection(app,api_keys["composio"]) for app in composio_tools}
     
@@ -851,16 +769,9 @@ def user_auths(credentials: HTTPAuthorizationCredentials = Depends(security)):
 
 
 @app.post("/auth")
-def auth(tool:Tool,credentials: HTTPAuthorizationCredentials = Depends(security)):  # Ensure user is logged in via Clerk
+def auth(tool:Tool,user_id: str = Depends(current_user_id)):  # Ensure user is logged in via Clerk
     # take a post req with parameter - tool : gmail/sheets etc
 
-    token = credentials.credentials
-    payload = decode_token(token)
-    user_id = payload.get('sub')
-    if not user_id:
-        raise HTTPException(status_code=401, detail="User ID not found in token")
-    
-
     # Generate OAuth URL with Clerk user info
     print(user_id)
     if tool.service=="gmailtrigger":
@@ -877,12 +788,7 @@ def auth(tool:Tool,credentials: HTTPAuthorizationCredentials = Depends(security)
 
 
     else:
-        response = db_client.get_item(
-            TableName='users',
-            Key={'clerk_id': {'S': user_id}}
-        )
-        api_keys = response.get('Item', {}).get('api_key', {}).get('M', {})
-        final_dict = {k: v['S'] for k, v in api_keys.items()}
+        final_dict = get_api_keys(user_id)
         auth_url=create_connection_oauth2(tool.service,final_dict["composio"])
         print(auth_url)
         # if check_connection(tool.name,final_dict["composio"]):
@@ -893,12 +799,7 @@ def auth(tool:Tool,credentials: HTTPAuthorizationCredentials = Depends(security)
     return {"auth_url": auth_url}
 
 @app.post("/delete_auth")  
-def dele(tool:Tool,credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
-    payload = decode_token(token)
-    user_id = payload.get('sub')
-    if not user_id:
-        raise HTTPException(status_code=401, detail="User ID not found in token")
+def dele(tool:Tool,user_id: str = Depends(current_user_id)):
     # return JSONResponse(content={"status": "error", "message": "cannot delete auth"}, status_code=400)
     
 
@@ -964,18 +865,37 @@ def delete_gmail_trigger():
 
 
 
+@app.get("/llm_cache_stats")
+async def llm_cache_stats(user_id: str = Depends(current_user_id)):
+    """Hit / miss counters of the LLM response cache in this api process."""
+    return cache_stats()
+
+
+@app.get("/llm_gateway_stats")
+async def llm_gateway_stats(user_id: str = Depends(current_user_id)):
+    """Calls, retries, throttles and failovers per LLM provider in this api process."""
+    return GATEWAY.stats()
+
+
+@app.get("/semantic_cache_stats")
+async def semantic_cache_stats(user_id: str = Depends(current_user_id)):
+    """Threshold, hit rate and size of the /create_agents semantic cache."""
+    return SEMANTIC_CACHE.stats()
+
+
+@app.get("/usage")
+async def usage(period: str = None, user_id: str = Depends(current_user_id)):
+    """LLM tokens, calls, latency and cost of a month (YYYY-MM, default current) per workflow and node, and the plan quota."""
+    plan, _ = await ausers.get_plan_and_api_keys(user_id)
+    return await run_db(usage_report, user_id, plan, period)
+
+
 @app.get("/protected")
-async def protected_route( credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
-    payload = decode_token(token)
-    user_id = payload.get('sub')
-    if not user_id:
-        raise HTTPException(status_code=401, detail="User ID not found in token")
+async def protected_route( user_id: str = Depends(current_user_id)):
 # Now that we have verified the Bearer token and extracted the 
 # user ID, we can proceed to access protected resources. Note that # # using the Bearer token is more secure than passing a session ID in # the query parameter.
 # We retrieve user details from Clerk directly using the user ID.
-    clerk_sdk = Clerk(bearer_auth=clerk_secret_key)
-    user_details = clerk_sdk.users.list(user_id=[user_id])[0]
+    user_details = (await asyncio.to_thread(clerk_sdk.users.list, user_id=[user_id]))[0]
     ret= {
         "status": "success",
         "data": {
@@ -996,30 +916,13 @@ async def protected_route( credentials: HTTPAuthorizationCredentials = Depends(s
 
 
 
-@app.post("/refine_query")
-async def refine_query(q: Question,credentials: HTTPAuthorizationCredentials = Depends(security)):
-    # credentials: HTTPAuthorizationCredentials = Depends(security)
-    token = credentials.credentials
-    payload = decode_token(token)
-    user_id = payload.get('sub')
-    if not user_id:
-        raise HTTPException(status_code=401, detail="User ID not found in token")
-    if q.flag==0:
-        ques =ques_flow_chain.invoke({"question":"\nQUERY:-\n"+q.query})
-        print(ques)
-        if ques[0]=="`":
-            try:
-                ques=json.loads(ques[10:-4])
-            except:
-                ques=json.loads(ques[10:-3])
-        else:
-            ques=json.loads(ques)
-        print(ques)
-        return {"response":ques}
-    
-    else:
-        print(q.question)
-        refined_query=gemini_chain.invoke({"prompt":f"Act as a query enhancer specialist . Refine the old query and generate a detailed new query based on the following questions and answers (user needs). "+"\nOLD QUERY:-\n"+q.query+f"\n More specific user needs (questions answered by user):- \n{q.question}"+"\n.Add all necessary details from user's answers to the new query ,and return a new query which will be further used to create agentic workflow. \nGive only the refined query, don't skip anything. keep the details in refined query in a proper order so that user can get an optimized and relevant workflow, according to exactly what he wants. (No preambles and postambles)\
+def event_stream(events):
+    return StreamingResponse(events, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def refine_prompt(q):
+    return f"Act as a query enhancer specialist . Refine the old query and generate a detailed new query based on the following questions and answers (user needs). "+"\nOLD QUERY:-\n"+q.query+f"\n More specific user needs (questions answered by user):- \n{q.question}"+"\n.Add all necessary details from user's answers to the new query ,and return a new query which will be further used to create agentic workflow. \nGive only the refined query, don't skip anything. keep the details in refined query in a proper order so that user can get an optimized and relevant workflow, according to exactly what he wants. (No preambles and postambles)\
 SOME CONTEXT:- You are problem understanding agent, whose task is to transform the user's vague query to a well defined query, so that, it can be used to generate multi agent, multi tool workflows including agents like llm (LARGE LANGUAGE MODEL), validator (LLM for if-else, whose outputs affects the execution of next tools), iterator (used to one by one pass each element of list of inputs to next agents for execution), deligator (deligate tasks to different agents),TRIGGER (which starts the workflow), and many differnt tools (functions which takes some inputs and returns some outputs)\
 you need to understand what user actually wants and which agents to use, in what order, and using this understanding, generate a well defined and detailed query having proper explanation in ordered bullet points (not only agent names) (For each agent, keep Short explainations, and don't copy above questions and answers, instead give short explaination of what needs to be done).\
 Some points to follow: - if any tool's input has to be decided by some condition, so rather than using a validator, strictly use a TEXT INPUT TOOL (even if condition is already given) where user will again define all conditions, and then strictly use LLM ( which will decide next tool input based on the condition and previous tool output) Eg - sending mail to different people based on some condition (here tool is send mail, and inputs can vary).\
@@ -1056,7 +959,25 @@ FILE_UPLOAD (take file upload from user and returns the FILE PATH IN LOCAL DIREC
 PDF_TO_TEXT (extract text from pdf, STRICTLY MUST BE USED WITH FILE_UPLOAD tool , if user mentions pdf file upload (or files which might be pdf - like resume, report, etc),so that the text inside the file can be extracted and passed to next tool/llm if required),\
     TOOL USAGE TIPS:- (IMPORTANT)\
     - if user wants to perform some operation using the filtered csv file content, then STRICTLY use CSV_AI (returns filtered csv path) -> CSV_READER (returns content in list format) -> ITERATOR (iterate each row of csv) -> ...(further operations)\
-                                           "})
+                                           "
+
+
+@app.post("/refine_query")
+async def refine_query(q: Question,user_id: str = Depends(current_user_id)):
+    if q.flag==0:
+        api_keys = await ausers.get_api_keys(user_id)
+        with usage_context(user_id=user_id, workflow_id=GENERATION, node="questions"):
+            ques =await ques_flow_chain.ainvoke({"question":"\nQUERY:-\n"+q.query}, api_keys=api_keys)
+        print(ques)
+        ques=extract_json(ques)
+        print(ques)
+        return {"response":ques}
+    
+    else:
+        print(q.question)
+        api_keys = await ausers.get_api_keys(user_id)
+        with usage_context(user_id=user_id, workflow_id=GENERATION, node="refine"):
+            refined_query=await gemini_chain.ainvoke({"prompt":refine_prompt(q)}, api_keys=api_keys)
         query=refined_query
         print("refined  ::",query)
     
@@ -1065,73 +986,58 @@ PDF_TO_TEXT (extract text from pdf, STRICTLY MUST BE USED WITH FILE_UPLOAD tool
         return {"response":query} 
 
 
+@app.post("/refine_query/stream")
+async def refine_query_stream(q: Question,user_id: str = Depends(current_user_id)):
+    """refine_query as server-sent events: token events, then done with the same response."""
+    async def events():
+        try:
+            if q.flag==0:
+                chain, inputs = ques_flow_chain, {"question":"\nQUERY:-\n"+q.query}
+            else:
+                chain, inputs = gemini_chain, {"prompt":refine_prompt(q)}
+            api_keys = await ausers.get_api_keys(user_id)
+            chunks=[]
+            with usage_context(user_id=user_id, workflow_id=GENERATION, node="questions" if q.flag==0 else "refine"):
+                async for chunk in chain.astream(inputs, api_keys=api_keys):
+                    chunks.append(chunk)
+                    yield sse("token", {"text": chunk})
+            answer="".join(chunks)
+            yield sse("done", {"response": extract_json(answer) if q.flag==0 else answer})
+        except Exception as e:
+            logger.exception("refine_query stream failed")
+            yield sse("error", {"detail": str(e)})
+
+    return event_stream(events())
+
+
 
 # add functionality where user can exactly select what custom tool he wants to use??????       
-@app.post("/create_agents")
-async def create_agents(query : Query, credentials: HTTPAuthorizationCredentials = Depends(security)):    # custom will be the list of selected cutom tools by user
-    token = credentials.credentials
-    payload = decode_token(token)
-    user_id = payload.get('sub')
-    if not user_id:
-        raise HTTPException(status_code=401, detail="User ID not found in token")
-    with open("tools/user_made_custom.json") as f:
-        custom=json.load(f)
-    
-    to_embed=[f"{i['name']} : {i['description']}" for i in custom]
-    to_embed="\n".join(to_embed)
+async def timed(timings, stage, awaitable):
+    """Await and record how long the stage took in timings[stage] (seconds), LLM usage is booked on the stage."""
+    start = time.perf_counter()
+    try:
+        with usage_context(node=stage):
+            return await awaitable
+    finally:
+        timings[stage] = time.perf_counter() - start
+
 
-    # dynamically add all custom tools to major_tool_chain from custom_tools.json
-    major_tool_list= major_tool_chain.invoke({"question":query,"customs":to_embed})
+async def select_tools(query, api_keys=None):
+    """Stage 1: the tools and actions the workflow needs, and the unavailable ones."""
+    # dynamically add all custom tools to major_tool_chain from user_made_custom.json
+    major_tool_list= await major_tool_chain.ainvoke({"question":query.query,"customs":TOOL_CATALOG.get().customs_prompt}, api_keys=api_keys)
     print(query.query)
     
-    if major_tool_list[0]=="`":
-        major_tool_list=json.loads(major_tool_list[7:-4])
-    else:
-        major_tool_list=json.loads(major_tool_list)
+    major_tool_list=extract_json(major_tool_list)
     print(major_tool_list)
     ret_un=None
     if major_tool_list.get("UNAVAILABLE"):
         ret_un=major_tool_list["UNAVAILABLE"]
-    
-    with open("tools/composio.json") as f:
-        composio=json.load(f)
-    with open("tools/custom_tools.json") as f:
-        oth_tools=json.load(f)
-    with open("tools/user_made_custom.json") as f:
-        user=json.load(f)
-    oth_tools+=user
-    to_embed_composio=[]
-    to_embed_other=[]
-    for tool in major_tool_list["WITH_ACTION"]:
-        if tool.upper() in composio:
-            tool_actions=tool.upper()+"(Actions):-\n"
-            for use_case in major_tool_list["WITH_ACTION"][tool]:
-                cls = globals()[tool.upper()]
-                method = getattr(cls, use_case)
-
-                # Get function signature
-                signature = inspect.signature(method)
-
-                inputs=[{name: param.default if param.default is not inspect.Parameter.empty else None}
-                for name, param in signature.parameters.items()]
-                
-                for action in composio[tool.upper()]:
-                    if action["action"].upper()==use_case.upper():
-                        tool_actions+=f"{use_case} -> input parameters and their explainations: {inputs[1:]} , outputs: {action['output']}\n"
-                
-            to_embed_composio.append(tool_actions)
-        
-        # elif tool.upper()=="OTHERS":
-    for oth_maj in major_tool_list["OTHERS"]+list(major_tool_list["WITH_ACTION"].keys()):
-        tool_actions=""
-        for oth in oth_tools:
-            if oth["name"].upper()==oth_maj.upper():
-                tool_actions+=f"{oth['name']}:{oth['description']}, inputs: {oth['inputs']}, outputs: {oth['outputs']}\n"
-        to_embed_other.append(tool_actions)
+    return major_tool_list, ret_un
 
-            
-    to_embed_composio="\n".join(to_embed_composio)
-    to_embed_other="\n".join(to_embed_other)
+
+async def detect_trigger(query, api_keys=None):
+    """Stage 2: the trigger of the workflow, independent of stage 1."""
 
     # chat_completion = groq.chat.completions.create(                          
         
@@ -1152,13 +1058,10 @@ async def create_agents(query : Query, credentials: HTTPAuthorizationCredentials
     #         stream=False,
     #         # Enable JSON mode by setting the response format
     #     )
-    trigger=  trigger_chain.invoke({"question":query.query})
+    trigger=  await trigger_chain.ainvoke({"question":query.query}, api_keys=api_keys)
     print(query.query)
 
-    if trigger[0]=="`":
-        trigger=json.loads(trigger[7:-4])
-    else:
-        trigger=json.loads(trigger)
+    trigger=extract_json(trigger)
     print(trigger)
     # print("Triggers:-",trigger["name"], trigger["description"], "outputs:", trigger["output"], "\n")  # Updated to print trigger details
     # if chat_completion.choices[0].message.content[0]=="`":
@@ -1175,6 +1078,26 @@ async def create_agents(query : Query, credentials: HTTPAuthorizationCredentials
 
     trigger["id"]=0
     # Return the response as JSON
+    return trigger
+
+
+def build_tool_finder(major_tool_list, trigger):
+    """Stage 3: the workflow architect prompt for the selected tools and trigger."""
+    
+    catalog = TOOL_CATALOG.get()
+    to_embed_composio=[]
+    to_embed_other=[]
+    for tool in major_tool_list["WITH_ACTION"]:
+        if catalog.is_composio(tool):
+            to_embed_composio.append(catalog.composio_block(tool, major_tool_list["WITH_ACTION"][tool]))
+        
+        # elif tool.upper()=="OTHERS":
+    for oth_maj in major_tool_list["OTHERS"]+list(major_tool_list["WITH_ACTION"].keys()):
+        to_embed_other.append(catalog.other_block(oth_maj))
+
+            
+    to_embed_composio="\n".join(to_embed_composio)
+    to_embed_other="\n".join(to_embed_other)
 
     print("to_embed_composio",to_embed_composio)
     print("to_embed_other",to_embed_other)
@@ -1237,6 +1160,7 @@ available connectors:-
 2. ITERATOR . inputs: [list_of_something]. output : [list_element (one at a time)] (use this when need to pass something to next tools one by one from a list. use iterator just after the tool which returns a list of elements)
 3. DELIGATOR. inputs :[deligation_prompt , output of previous agents ]. outputs : {{to_deligate_from_p (bool) : True/False , deligation_p : {{agent_id : id of agent to which task is to be deligated, changes_required : "detailed explaination of what changes are required"}}}} 
 (use deligator to execute a set of agents repeatedly until a condition is met.)
+4. ITERATOR_END . inputs : none. outputs : none (optional. closes the last opened iterator: agents after it run only once, after all elements are processed. without it, every agent after the iterator runs for each element)
 
 *note -> never use if-else to check if any element available in iterator. iterator handles full process of sending each element to next agents.
 *note -> don't mix delegation and validation. both serve different purposes. use delegation only if required , and use validation for checking conditions.
@@ -1255,6 +1179,36 @@ SOME RULES TO BE FOLLOWED STRICTLY :-
 5. Must use iterator if you need to pass something to next tools one by one from previous output.
 6. return a output in json format which will be used to execute the workflow, given the user query. No preambles or postambles are required. Keep all strings in double quotes.
 """
+    return tool_finder
+
+
+def workflow_messages(tool_finder, query):
+    return [
+        {"role": "system", "content": tool_finder},
+        {"role": "user", "content": f"WORKFLOW TO CREATE :- {query.query}"},
+    ]
+
+
+def log_generation(query, user_id, tool_finder, tools):
+    GENERATION_LOG.append({"query": query.query, "user_id": user_id, "prompt": tool_finder+"\nWORKFLOW TO CREATE:"+query.query, "response": tools})
+
+
+async def generate_workflow(query, user_id, api_keys=None):
+    """
+    Run the generation pipeline for a query, with the user's own provider keys when they saved some.
+    Returns (workflow, trigger, unavailable tools, {stage: seconds}).
+    """
+    timings = {}
+    started = time.perf_counter()
+    # tool selection and trigger detection do not depend on each other
+    (major_tool_list, ret_un), trigger = await asyncio.gather(
+        timed(timings, "select_tools", select_tools(query, api_keys)),
+        timed(timings, "detect_trigger", detect_trigger(query, api_keys)),
+    )
+    stage_start = time.perf_counter()
+    tool_finder = build_tool_finder(major_tool_list, trigger)
+    timings["build_prompt"] = time.perf_counter() - stage_start
+
 # embed different things in tool_finder prompt
     print("prompt:-\n",tool_finder,"\n")
     # response = groq.chat.completions.create(
@@ -1277,22 +1231,10 @@ SOME RULES TO BE FOLLOWED STRICTLY :-
     # )
 
     # print(chat_completion)
-    loop = asyncio.get_event_loop()
-    def call_openai_sync():
-        return client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[
-                {"role": "system", "content": tool_finder},
-                {"role": "user", "content": f"WORKFLOW TO CREATE :- {query.query}"},
-            ],
-            stream=False,
-            temperature=0
-        )
-
-    response = await loop.run_in_executor(None, call_openai_sync)
+    response = await timed(timings, "generate", GATEWAY.acomplete(workflow_messages(tool_finder, query), "deepseek", api_keys=api_keys))
     
-    print("TOOLS NEEDED EXCEPT TRIGGERS:-",response.choices[0].message.content[7:-3],"\n")
-    tools=json.loads(response.choices[0].message.content[7:-3])
+    print("TOOLS NEEDED EXCEPT TRIGGERS:-",response,"\n")
+    tools=extract_json(response)
     # for tool in tools["workflow"]:
     #     if tool["type"] == "tool" and tool["name"].upper() in composio_tools:
     #         class_name = globals().get(tool["name"].upper())
@@ -1379,22 +1321,39 @@ SOME RULES TO BE FOLLOWED STRICTLY :-
         #             for param in missing_params:
         #                 tool.setdefault("config_inputs", {})[param] = ""
     
-    # Add the new entry to prism.json
-    prism_entry = {"query": query.query, "prompt": tool_finder+"\nWORKFLOW TO CREATE:"+query.query, "response": tools}
-    prism_file_path = "prism.json"
-    if os.path.exists(prism_file_path):
-        with open(prism_file_path, "r") as prism_file:
-            prism_data = json.load(prism_file)
-    else:
-        prism_data = []
-    prism_data.append(prism_entry)
-    with open(prism_file_path, "w") as prism_file:
-        json.dump(prism_data, prism_file, indent=2)
-
-
+    # Add the new entry to the generation log (written in the background)
+    stage_start = time.perf_counter()
+    log_generation(query, user_id, tool_finder, tools)
+    timings["log"] = time.perf_counter() - stage_start
+    timings["total"] = time.perf_counter() - started
+    logger.info("create_agents stage timings: %s", {k: round(v, 3) for k, v in timings.items()})
 
+    return tools, trigger, ret_un, timings
 
 
+async def cached_workflow(query, user_id, timings, api_keys=None):
+    """(workflow, trigger, unavailable tools) from the user's entries in the semantic cache, or None."""
+    if not SEMANTIC_CACHE_ENABLED or query.fresh:
+        return None
+    try:
+        with usage_context(node="semantic_cache"):
+            tools = await timed(timings, "semantic_cache",
+                                asyncio.to_thread(SEMANTIC_CACHE.lookup, query.query, user_id, api_keys))
+    except Exception as e:
+        print("Semantic cache lookup failed:", e)
+        return None
+    if tools is None:
+        return None
+    ret_un = tools.pop("unavailable", None)
+    trigger = tools.pop("trigger", None)
+    if trigger is None:
+        # entries seeded from prism.json were logged without their trigger
+        trigger = await timed(timings, "detect_trigger", detect_trigger(query, api_keys))
+    return tools, trigger, ret_un
+
+
+async def save_generated(query, user_id, tools, trigger, ret_un, from_cache, api_keys=None):
+    """Attach trigger and id to a generated workflow, save it and remember it in the semantic cache."""
     tools["trigger"]=trigger
     tools["active"]=False
 
@@ -1403,23 +1362,7 @@ SOME RULES TO BE FOLLOWED STRICTLY :-
         tools["workflow_id"]=query.wid
         tools["unavailable"]=ret_un
         try:
-            response =  db_client.update_item(
-                TableName='users',
-                Key={'clerk_id': {'S': user_id}},
-                UpdateExpression="SET workflows.#wid = :new_workflow",
-                ExpressionAttributeNames={
-                    '#wid': query.wid  # Using workflow_id as the key
-                },
-                ExpressionAttributeValues={
-                    ':new_workflow': {
-                        'M': {
-                            'json': {'S': json.dumps(tools,indent=2)},
-                            'prompt': {'S': query.query}
-                        }
-                    }
-                },
-                ReturnValues="UPDATED_NEW"
-            )
+            response = await aworkflows.save_workflow(user_id, tools, prompt=query.query)
             print("Update succeeded:", response)
         except Exception as e:
             print("Error updating item:", e)
@@ -1427,38 +1370,99 @@ SOME RULES TO BE FOLLOWED STRICTLY :-
         tools["workflow_id"] = str(uuid.uuid4())
         tools["unavailable"]=ret_un
         try:
-            # First, ensure workflows exists
-            db_client.update_item(
-                TableName='users',
-                Key={'clerk_id': {'S': user_id}},
-                UpdateExpression="SET workflows = if_not_exists(workflows, :empty_map)",
-                ExpressionAttributeValues={
-                    ':empty_map': {'M': {}}  # Initialize as an empty map if missing
-                }
-            )
-
-            # Now, update workflows by adding a new key-value pair
-            response =  db_client.update_item(
-                TableName='users',
-                Key={'clerk_id': {'S': user_id}},
-                UpdateExpression="SET workflows.#wid = :new_workflow",
-                ExpressionAttributeNames={
-                    '#wid': tools["workflow_id"]  # New key inside workflows
-                },
-                ExpressionAttributeValues={
-                    ':new_workflow': {
-                        'M': {
-                            'json': {'S': json.dumps(tools, indent=2)},
-                            'prompt': {'S': query.query}
-                        }
-                    }
-                },
-                ReturnValues="UPDATED_NEW"
-            )
-
+            response = await aworkflows.save_workflow(user_id, tools, prompt=query.query)
             print("Update succeeded:", response)
         except Exception as e:
             print("Error updating item:", e)
 
+    if not from_cache and SEMANTIC_CACHE_ENABLED:
+        try:
+            with usage_context(user_id=user_id, workflow_id=GENERATION, node="semantic_cache"):
+                await asyncio.to_thread(SEMANTIC_CACHE.add, query.query, user_id, tools, api_keys)
+        except Exception as e:
+            print("Semantic cache update failed:", e)
+
+    return tools
+
+
+@app.post("/create_agents")
+async def create_agents(query : Query, http_response: Response, user_id: str = Depends(current_user_id)):    # custom will be the list of selected cutom tools by user
+    timings = {}
+    api_keys = await ausers.get_api_keys(user_id)
+    with usage_context(user_id=user_id, workflow_id=GENERATION):
+        cached = await cached_workflow(query, user_id, timings, api_keys)
+        if cached is not None:
+            tools, trigger, ret_un = cached
+        else:
+            tools, trigger, ret_un, stage_timings = await generate_workflow(query, user_id, api_keys)
+            timings.update(stage_timings)
+    # per-stage durations, visible in the browser's network panel
+    http_response.headers["Server-Timing"] = ", ".join(f"{stage};dur={seconds * 1000:.0f}" for stage, seconds in timings.items())
+
+    tools = await save_generated(query, user_id, tools, trigger, ret_un, cached is not None, api_keys)
     return {"response":tools}
-    
\ No newline at end of file
+    
+
+
+@app.post("/create_agents/stream")
+async def create_agents_stream(query : Query, user_id: str = Depends(current_user_id)):
+    """
+    create_agents as server-sent events: a stage event when the tools and the
+    trigger are chosen, token events while the workflow is generated, a node
+    event for every agent as soon as it is complete, then done.
+    """
+    async def events():
+        timings = {}
+        started = time.perf_counter()
+        tasks = ()
+        try:
+            api_keys = await ausers.get_api_keys(user_id)
+            with usage_context(user_id=user_id, workflow_id=GENERATION):
+                cached = await cached_workflow(query, user_id, timings, api_keys)
+            if cached is not None:
+                tools, trigger, ret_un = cached
+                yield sse("stage", {"stage": "semantic_cache_hit", "trigger": trigger})
+                for node in tools.get("workflow", []):
+                    yield sse("node", node)
+            else:
+                with usage_context(user_id=user_id, workflow_id=GENERATION):
+                    # the tasks copy the context when they are created
+                    select = asyncio.create_task(timed(timings, "select_tools", select_tools(query, api_keys)))
+                    detect = asyncio.create_task(timed(timings, "detect_trigger", detect_trigger(query, api_keys)))
+                tasks = pending = {select, detect}
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    if select in done:
+                        major_tool_list, ret_un = select.result()
+                        yield sse("stage", {"stage": "tools_selected", "tools": major_tool_list, "unavailable": ret_un})
+                    if detect in done:
+                        trigger = detect.result()
+                        yield sse("stage", {"stage": "trigger_chosen", "trigger": trigger})
+                tool_finder = build_tool_finder(major_tool_list, trigger)
+
+                stage_start = time.perf_counter()
+                parser = NodeStreamParser()
+                with usage_context(user_id=user_id, workflow_id=GENERATION, node="generate"):
+                    async for text in GATEWAY.astream(workflow_messages(tool_finder, query), "deepseek", api_keys=api_keys):
+                        timings.setdefault("first_token", time.perf_counter() - started)
+                        yield sse("token", {"text": text})
+                        for node in parser.feed(text):
+                            timings.setdefault("first_node", time.perf_counter() - started)
+                            yield sse("node", node)
+                timings["generate"] = time.perf_counter() - stage_start
+                tools = extract_json(parser.text)
+                log_generation(query, user_id, tool_finder, tools)
+            timings["total"] = time.perf_counter() - started
+            logger.info("create_agents stream timings: %s", {k: round(v, 3) for k, v in timings.items()})
+
+            tools = await save_generated(query, user_id, tools, trigger, ret_un, cached is not None, api_keys)
+            yield sse("done", {"response": tools, "timings": timings})
+        except Exception as e:
+            logger.exception("create_agents stream failed")
+            yield sse("error", {"detail": str(e)})
+        finally:
+            # the client may have gone away while a stage was running
+            for task in tasks:
+                task.cancel()
+
+    return event_stream(events())
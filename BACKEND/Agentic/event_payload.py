@@ -0,0 +1,96 @@
+"""
+Size policy for the node events of workflow runs.
+
+A node event carries the node's whole response ("data"), which for a
+CSV_READER or PDF_TO_TEXT node can be megabytes, once per iterator element.
+Before an event goes to redis (stream and pub/sub, see run_events.py):
+
+- data whose json is larger than EVENT_DATA_MAX_BYTES is stored once under
+  `run_payload:<run id>:<seq>` and the event only gets a preview:
+      {"truncated": true, "bytes": 2483120, "preview": "...",
+       "ref": "/runs/<run id>/payload/<seq>"}
+- with EVENT_COMPRESS=1 every value of at least EVENT_COMPRESS_MIN_BYTES is
+  zlib compressed (marked by a leading "z", plain json starts with { or [).
+  Readers use decode() and must use a redis client without
+  decode_responses.
+
+Every event is serialized once, by dump(): the data's json is measured,
+offloaded and spliced into the event's json as the same bytes, and the
+stream entry and the published batch reuse the event's bytes (see
+with_event_id). Batching of the events of a short window is done by
+RunEventLog.
+"""
+
+import json
+import os
+import zlib
+
+EVENT_DATA_MAX_BYTES = int(os.getenv("EVENT_DATA_MAX_BYTES", "4096"))
+EVENT_PREVIEW_CHARS = int(os.getenv("EVENT_PREVIEW_CHARS", "512"))
+EVENT_COMPRESS = os.getenv("EVENT_COMPRESS", "0") == "1"
+EVENT_COMPRESS_MIN_BYTES = int(os.getenv("EVENT_COMPRESS_MIN_BYTES", "1024"))
+
+COMPRESSED = b"z"
+
+
+def payload_key(run_id, seq):
+    return f"run_payload:{run_id}:{seq}"
+
+
+def with_event_id(raw, event_id):
+    """json bytes of an event object with "event_id" added, without parsing it again."""
+    separator = b", " if raw != b"{}" else b""
+    return raw[:-1] + separator + b'"event_id": ' + json.dumps(event_id).encode() + b"}"
+
+
+def decode(raw):
+    """json value of a stored / published event, payload or batch."""
+    if isinstance(raw, str):
+        raw = raw.encode()
+    if raw[:1] == COMPRESSED:
+        try:
+            raw = zlib.decompress(raw[1:])
+        except zlib.error as e:
+            raise ValueError(f"corrupt compressed event: {e}") from e
+    return json.loads(raw)
+
+
+class EventPayloadPolicy:
+    def __init__(self, max_bytes=EVENT_DATA_MAX_BYTES, preview_chars=EVENT_PREVIEW_CHARS,
+                 compress=EVENT_COMPRESS, compress_min_bytes=EVENT_COMPRESS_MIN_BYTES):
+        self.max_bytes = max_bytes
+        self.preview_chars = preview_chars
+        self.compress = compress
+        self.compress_min_bytes = compress_min_bytes
+
+    def compressed(self, raw):
+        """json bytes as stored / published: zlib compressed when enabled and large enough."""
+        if self.compress and len(raw) >= self.compress_min_bytes:
+            return COMPRESSED + zlib.compress(raw, 1)
+        return raw
+
+    def encode(self, value):
+        return self.compressed(json.dumps(value, default=str).encode())
+
+    def dump(self, run_id, event):
+        """
+        (raw, offloaded): the event's json bytes, with large data replaced by a
+        preview, and {redis key: encoded full data} to store next to it.
+        """
+        if "data" not in event:
+            return json.dumps(event, default=str).encode(), {}
+        data_raw = json.dumps(event["data"], default=str).encode()
+        offloaded = {}
+        if 0 < self.max_bytes < len(data_raw):
+            seq = event.get("seq")
+            preview = {"truncated": True, "bytes": len(data_raw),
+                       "preview": data_raw[:self.preview_chars].decode(),
+                       "ref": f"/runs/{run_id}/payload/{seq}"}
+            offloaded[payload_key(run_id, seq)] = self.compressed(data_raw)
+            data_raw = json.dumps(preview).encode()
+        head = json.dumps({k: v for k, v in event.items() if k != "data"}, default=str).encode()
+        separator = b", " if head != b"{}" else b""
+        return head[:-1] + separator + b'"data": ' + data_raw + b"}", offloaded
+
+
+EVENT_POLICY = EventPayloadPolicy()
@@ -0,0 +1,147 @@
+"""
+Append-only log of workflow generations (query, prompt, response).
+
+create_agents used to load the whole prism.json, append one entry and rewrite
+the file, so every request paid for all earlier generations and concurrent
+requests could drop each other's entries. GENERATION_LOG.append() only puts
+the entry on a queue. A background thread writes it as one JSON line to
+GENERATION_LOG_PATH. Once the file would exceed GENERATION_LOG_MAX_BYTES it
+is gzipped to <path>.1.gz (older files shift to .2.gz, ...) and at most
+GENERATION_LOG_BACKUPS compressed files are kept.
+
+prism.json is left as it is, read_entries() still yields it first as the
+oldest part of the log.
+
+    python generation_log.py               # every entry, oldest first, as json lines
+    python generation_log.py --queries     # only the queries
+"""
+
+import argparse
+import atexit
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import sys
+import threading
+
+GENERATION_LOG_PATH = os.getenv("GENERATION_LOG_PATH", "generation_log.jsonl")
+GENERATION_LOG_MAX_BYTES = int(os.getenv("GENERATION_LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+GENERATION_LOG_BACKUPS = int(os.getenv("GENERATION_LOG_BACKUPS", "5"))
+GENERATION_LOG_QUEUE_SIZE = int(os.getenv("GENERATION_LOG_QUEUE_SIZE", "1000"))
+LEGACY_LOG_PATH = "prism.json"
+
+_STOP = object()
+
+
+class GenerationLog:
+    def __init__(self, path=GENERATION_LOG_PATH, max_bytes=GENERATION_LOG_MAX_BYTES,
+                 backups=GENERATION_LOG_BACKUPS, queue_size=GENERATION_LOG_QUEUE_SIZE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._writer = None
+        self._start_lock = threading.Lock()
+
+    def append(self, entry):
+        """Queue an entry for writing, never blocks the caller."""
+        # serialized here: the caller keeps mutating its dicts after logging them
+        line = json.dumps(entry, separators=(",", ":"), default=str) + "\n"
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait(line)
+        except queue.Full:
+            logging.error("Generation log queue full, dropping entry for %r", entry.get("query"))
+
+    def _ensure_writer(self):
+        if self._writer is not None:
+            return
+        with self._start_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, daemon=True)
+                self._writer.start()
+                atexit.register(self.close)
+
+    def close(self, timeout=5):
+        """Write what is queued and stop the writer."""
+        if self._writer is None:
+            return
+        self._queue.put(_STOP)
+        self._writer.join(timeout)
+
+    def _run(self):
+        while True:
+            line = self._queue.get()
+            if line is _STOP:
+                return
+            try:
+                self._write(line)
+            except Exception as e:
+                logging.error("Generation log write failed: %s", e)
+
+    def _write(self, line):
+        data = line.encode("utf-8")
+        if os.path.exists(self.path) and os.path.getsize(self.path) + len(data) > self.max_bytes:
+            self.rotate()
+        with open(self.path, "ab") as f:
+            f.write(data)
+
+    def _backup(self, n):
+        return f"{self.path}.{n}.gz"
+
+    def rotate(self):
+        if os.path.exists(self._backup(self.backups)):
+            os.remove(self._backup(self.backups))
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.exists(self._backup(n)):
+                os.replace(self._backup(n), self._backup(n + 1))
+        rotated = self.path + ".rotating"
+        os.replace(self.path, rotated)
+        with open(rotated, "rb") as src, gzip.open(self._backup(1), "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(rotated)
+
+
+GENERATION_LOG = GenerationLog()
+
+
+def _read_lines(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # a line cut short by a crash
+                continue
+
+
+def read_entries(path=GENERATION_LOG_PATH, backups=GENERATION_LOG_BACKUPS, legacy_path=LEGACY_LOG_PATH):
+    """Yield every logged entry, oldest first, one file at a time."""
+    if legacy_path and os.path.exists(legacy_path):
+        with open(legacy_path) as f:
+            yield from json.load(f)
+    for n in range(backups, 0, -1):
+        backup = f"{path}.{n}.gz"
+        if os.path.exists(backup):
+            yield from _read_lines(backup)
+    if os.path.exists(path):
+        yield from _read_lines(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream the workflow generation log")
+    parser.add_argument("--path", default=GENERATION_LOG_PATH)
+    parser.add_argument("--queries", action="store_true", help="print only the queries")
+    args = parser.parse_args()
+    for entry in read_entries(args.path):
+        if args.queries:
+            print(entry.get("query", ""))
+        else:
+            sys.stdout.write(json.dumps(entry) + "\n")
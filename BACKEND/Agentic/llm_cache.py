@@ -0,0 +1,240 @@
+"""
+Response cache for the chains in prompts.py.
+
+The chains run at temperature 0, so the same rendered prompt gives the same
+answer: a trigger email routed to several workflows, the refine questions of
+a query asked twice, the same llm node over repeated inputs. CachedChain
+renders the prompt, hashes it together with the route's model name and
+temperature and looks the answer up before calling the model through
+llm_gateway.GATEWAY:
+
+- an in-process LRU (LLM_CACHE_SIZE entries)
+- redis, shared by the api and the celery workers, with a TTL
+  (LLM_CACHE_TTL) and a cap on the number of entries
+  (LLM_CACHE_REDIS_MAX_ENTRIES). The oldest entries are evicted through the
+  `llmcache:index` sorted set, whose members of entries already expired by
+  TTL are trimmed on every write. Answers above LLM_CACHE_MAX_ENTRY_BYTES
+  are not stored.
+
+Only answers of the route's primary model are stored: the key names that
+model, an answer a fallback model gave during a failover is returned but not
+cached (counted as "failover").
+
+Callers that need a fresh answer pass use_cache=False, workflow nodes do so
+with "cache": false in their json. A chain built with cache=None never
+caches (coder_chain). Hit / miss counters are in cache_stats().
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import redis
+
+from llm_gateway import GATEWAY, messages_from_prompt
+
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1024"))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(24 * 3600)))
+LLM_CACHE_REDIS_MAX_ENTRIES = int(os.getenv("LLM_CACHE_REDIS_MAX_ENTRIES", "50000"))
+LLM_CACHE_MAX_ENTRY_BYTES = int(os.getenv("LLM_CACHE_MAX_ENTRY_BYTES", str(256 * 1024)))
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") != "0"
+
+REDIS_PREFIX = "llmcache:"
+REDIS_INDEX = "llmcache:index"
+
+cache_redis = redis.StrictRedis(host='localhost', port=6379, db=0)
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(chain_name, event):
+    with _stats_lock:
+        _stats[(chain_name, event)] += 1
+
+
+def cache_stats():
+    """{chain name: {memory_hit, redis_hit, miss, bypass, failover, error: count}} of this process."""
+    with _stats_lock:
+        stats = {}
+        for (chain_name, event), count in _stats.items():
+            stats.setdefault(chain_name, {})[event] = count
+        return stats
+
+
+class ResponseCache:
+    def __init__(self, redis_client=cache_redis, max_size=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL,
+                 redis_max_entries=LLM_CACHE_REDIS_MAX_ENTRIES, max_entry_bytes=LLM_CACHE_MAX_ENTRY_BYTES):
+        self.redis_client = redis_client
+        self.max_size = max_size
+        self.ttl = ttl
+        self.redis_max_entries = redis_max_entries
+        self.max_entry_bytes = max_entry_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        """(value, tier) or (None, None)."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                return value, "memory_hit"
+        if self.redis_client is None:
+            return None, None
+        raw = self.redis_client.get(REDIS_PREFIX + key)
+        if raw is None:
+            return None, None
+        value = raw.decode("utf-8")
+        self._remember(key, value)
+        return value, "redis_hit"
+
+    def put(self, key, value):
+        if len(value.encode("utf-8")) > self.max_entry_bytes:
+            return
+        self._remember(key, value)
+        if self.redis_client is None:
+            return
+        pipe = self.redis_client.pipeline()
+        now = time.time()
+        pipe.set(REDIS_PREFIX + key, value, ex=self.ttl)
+        # scores are write times, older members point at entries redis already expired
+        pipe.zremrangebyscore(REDIS_INDEX, "-inf", now - self.ttl)
+        pipe.zadd(REDIS_INDEX, {key: now})
+        pipe.zcard(REDIS_INDEX)
+        size = pipe.execute()[-1]
+        if size > self.redis_max_entries:
+            evicted = self.redis_client.zpopmin(REDIS_INDEX, size - self.redis_max_entries)
+            if evicted:
+                self.redis_client.delete(*(REDIS_PREFIX + member.decode("utf-8") for member, _ in evicted))
+
+
+RESPONSE_CACHE = ResponseCache()
+
+
+class CachedChain:
+    """`prompt | model | StrOutputParser()` through the LLM gateway, with the response cache in front of it."""
+
+    def __init__(self, name, prompt, route="gemini", temperature=0, cache=RESPONSE_CACHE, gateway=GATEWAY):
+        self.name = name
+        self.prompt = prompt
+        self.route = route
+        self.temperature = temperature
+        self.cache = cache
+        self.gateway = gateway
+
+    def key(self, prompt_value):
+        model_name = self.gateway.model_name(self.route)
+        rendered = prompt_value.to_string()
+        return hashlib.sha256(f"{model_name}\x00{self.temperature}\x00{rendered}".encode("utf-8")).hexdigest()
+
+    def _caching(self, use_cache):
+        if use_cache and LLM_CACHE_ENABLED and self.cache is not None:
+            return True
+        _count(self.name, "bypass")
+        return False
+
+    def _call(self, prompt_value, api_keys, answered=None):
+        call = dict(messages=messages_from_prompt(prompt_value), route=self.route,
+                    temperature=self.temperature, api_keys=api_keys)
+        if answered is not None:
+            call["on_answer"] = lambda provider, model: answered.append(model)
+        return call
+
+    def _cacheable(self, answered):
+        """False when a fallback model answered, the key is the primary model's."""
+        if answered == [self.gateway.model_name(self.route)]:
+            return True
+        _count(self.name, "failover")
+        return False
+
+    def invoke(self, inputs, use_cache=True, api_keys=None):
+        """api_keys: the user's stored {provider: key}, their own keys are used when present."""
+        prompt_value = self.prompt.invoke(inputs)
+        if not self._caching(use_cache):
+            return self.gateway.complete(**self._call(prompt_value, api_keys))
+        key = self.key(prompt_value)
+        try:
+            value, tier = self.cache.get(key)
+        except Exception as e:
+            logging.error("LLM cache read failed for %s: %s", self.name, e)
+            _count(self.name, "error")
+            value, tier = None, None
+        if value is not None:
+            _count(self.name, tier)
+            return value
+        _count(self.name, "miss")
+        answered = []
+        value = self.gateway.complete(**self._call(prompt_value, api_keys, answered))
+        if not self._cacheable(answered):
+            return value
+        try:
+            self.cache.put(key, value)
+        except Exception as e:
+            logging.error("LLM cache write failed for %s: %s", self.name, e)
+            _count(self.name, "error")
+        return value
+
+    async def _aget(self, key):
+        try:
+            return await asyncio.to_thread(self.cache.get, key)
+        except Exception as e:
+            logging.error("LLM cache read failed for %s: %s", self.name, e)
+            _count(self.name, "error")
+            return None, None
+
+    async def _aput(self, key, value):
+        try:
+            await asyncio.to_thread(self.cache.put, key, value)
+        except Exception as e:
+            logging.error("LLM cache write failed for %s: %s", self.name, e)
+            _count(self.name, "error")
+
+    async def ainvoke(self, inputs, use_cache=True, api_keys=None):
+        """invoke for async callers, the model call is awaited and redis is used from a thread."""
+        prompt_value = await self.prompt.ainvoke(inputs)
+        if not self._caching(use_cache):
+            return await self.gateway.acomplete(**self._call(prompt_value, api_keys))
+        key = self.key(prompt_value)
+        value, tier = await self._aget(key)
+        if value is not None:
+            _count(self.name, tier)
+            return value
+        _count(self.name, "miss")
+        answered = []
+        value = await self.gateway.acomplete(**self._call(prompt_value, api_keys, answered))
+        if self._cacheable(answered):
+            await self._aput(key, value)
+        return value
+
+    async def astream(self, inputs, use_cache=True, api_keys=None):
+        """Yield the answer in chunks as the model writes it, a cached answer is one chunk."""
+        prompt_value = await self.prompt.ainvoke(inputs)
+        if not self._caching(use_cache):
+            async for chunk in self.gateway.astream(**self._call(prompt_value, api_keys)):
+                yield chunk
+            return
+        key = self.key(prompt_value)
+        value, tier = await self._aget(key)
+        if value is not None:
+            _count(self.name, tier)
+            yield value
+            return
+        _count(self.name, "miss")
+        chunks, answered = [], []
+        async for chunk in self.gateway.astream(**self._call(prompt_value, api_keys, answered)):
+            chunks.append(chunk)
+            yield chunk
+        if self._cacheable(answered):
+            await self._aput(key, "".join(chunks))
@@ -0,0 +1,591 @@
+"""
+Single entry point for LLM completions.
+
+Gemini (prompts.py, CSV_AI, CODE_SUMMARY, VECTORQUERY) and DeepSeek
+(workflow generation) used to be called directly, each with its own client,
+so a provider rate limit failed the request or the workflow run. GATEWAY
+sends every completion through a route, an ordered list of
+(provider, model) candidates:
+
+- each provider has a concurrency cap (LLM_<PROVIDER>_MAX_CONCURRENCY) and a
+  token bucket per model and api key (LLM_<PROVIDER>_RPM requests per minute,
+  LLM_<PROVIDER>_BURST), so we slow down before the provider says 429
+- a retryable error (429, 5xx, timeouts) is retried with full jitter
+  exponential backoff, up to LLM_MAX_ATTEMPTS per candidate
+- after that, or on any other error, or when the local bucket would make us
+  wait more than LLM_FAILOVER_WAIT seconds, the next candidate is tried
+- the api key comes from the user's stored api_key map (`gemini`,
+  `deepseek`) when present, else from the server's environment
+- embeddings (GATEWAY.embed, the semantic cache's) go through the same
+  limits and retries, on a route with one candidate: vectors of different
+  models cannot be compared
+- every answered call is reported to GATEWAY.listeners with its token
+  counts (as reported by the api, else estimated) and latency, and to the
+  call's own on_answer(provider, model) when given (the response cache
+  only keeps answers of the route's primary model)
+
+With LLM_FAKE_PROVIDER=1 every route goes to FakeProvider, which answers
+locally, for running the api and the workers without provider keys.
+
+    GATEWAY.complete([{"role": "user", "content": "hi"}], "gemini", api_keys=keys)
+    await GATEWAY.acomplete(messages, "deepseek")
+    GATEWAY.embed(["a query"], "embedding")
+    async for text in GATEWAY.astream(messages, "deepseek"): ...
+"""
+
+import asyncio
+import hashlib
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+LLM_FAILOVER_WAIT = float(os.getenv("LLM_FAILOVER_WAIT", "2"))
+LLM_MAX_WAIT = float(os.getenv("LLM_MAX_WAIT", "30"))
+LLM_FAKE_PROVIDER = os.getenv("LLM_FAKE_PROVIDER", "0") == "1"
+# sdk clients kept per provider, one per (model, temperature, api key) or (api key, sync/async)
+LLM_CLIENT_CACHE_SIZE = int(os.getenv("LLM_CLIENT_CACHE_SIZE", "256"))
+
+# while a provider is at its concurrency cap
+_BUSY_POLL = 0.05
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+_RETRYABLE_ERRORS = {
+    "RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError",
+    "ResourceExhausted", "ServiceUnavailable", "DeadlineExceeded", "TooManyRequests",
+}
+
+ROUTES = {
+    "gemini": [("gemini", "gemini-1.5-flash"), ("deepseek", "deepseek-chat")],
+    "gemini-2.0-flash": [("gemini", "gemini-2.0-flash"), ("gemini", "gemini-1.5-flash"), ("deepseek", "deepseek-chat")],
+    "gemini-2.0-flash-lite": [("gemini", "gemini-2.0-flash-lite"), ("gemini", "gemini-1.5-flash"), ("deepseek", "deepseek-chat")],
+    "deepseek": [("deepseek", "deepseek-chat"), ("gemini", "gemini-1.5-flash")],
+    "embedding": [("gemini", "models/text-embedding-004")],
+}
+
+# langchain message types to chat roles
+_ROLES = {"system": "system", "human": "user", "ai": "assistant"}
+
+
+class LLMUnavailable(RuntimeError):
+    """Every candidate of a route failed."""
+
+
+class ProviderError(RuntimeError):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def messages_from_prompt(prompt_value):
+    """[{role, content}] of a rendered langchain prompt."""
+    return [{"role": _ROLES.get(m.type, "user"), "content": m.content} for m in prompt_value.to_messages()]
+
+
+def status_code(error):
+    for attr in ("status_code", "code"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    return getattr(getattr(error, "response", None), "status_code", None)
+
+
+def retryable(error):
+    status = status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    return isinstance(error, (TimeoutError, ConnectionError)) or type(error).__name__ in _RETRYABLE_ERRORS
+
+
+def backoff(attempt, base=LLM_BACKOFF_BASE, cap=LLM_BACKOFF_MAX):
+    """Full jitter: uniform in [0, min(cap, base * 2**attempt)]."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def _env(provider, setting, default):
+    return float(os.getenv(f"LLM_{provider.upper()}_{setting}", str(default)))
+
+
+class Meter:
+    """Token counts of one call, filled in by the provider when its api reports them."""
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def add(self, prompt_tokens, completion_tokens):
+        self.prompt_tokens += prompt_tokens or 0
+        self.completion_tokens += completion_tokens or 0
+
+
+def message_chars(messages):
+    return sum(len(m["content"] or "") for m in messages)
+
+
+def estimate_tokens(chars):
+    # ~4 characters per token, for apis that do not report usage
+    return (chars + 3) // 4
+
+
+class TokenBucket:
+    def __init__(self, rate_per_min, burst):
+        self.rate = rate_per_min / 60
+        self.capacity = max(1, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def take(self):
+        """0 if a token was taken, else the seconds until one is available. Caller holds the lock."""
+        if self.rate <= 0:
+            return 0
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class ClientCache:
+    """
+    LRU of sdk clients, shared by the api's event loop and the executor's
+    threads. Users bring their own keys, so without a bound it would grow
+    with every key ever seen.
+    """
+
+    def __init__(self, max_size=LLM_CLIENT_CACHE_SIZE):
+        self.max_size = max_size
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, create):
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                return client
+        # built outside the lock, a concurrent miss may build one more that is dropped
+        client = create()
+        with self._lock:
+            client = self._clients.setdefault(key, client)
+            self._clients.move_to_end(key)
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+        return client
+
+    def __len__(self):
+        return len(self._clients)
+
+
+class Provider:
+    """One LLM api: limits, key selection and the calls themselves."""
+
+    # entry of the user's api_key map holding their own key for this provider
+    key_name = None
+    needs_key = True
+
+    def __init__(self, name, default_key=None, rpm=0, burst=10, max_concurrency=8):
+        self.name = name
+        self.default_key = default_key
+        self.rpm = rpm
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self._active = 0
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def key_for(self, api_keys):
+        return (api_keys or {}).get(self.key_name) or self.default_key
+
+    def try_acquire(self, model, api_key):
+        """0 if a call may start now (release() afterwards), else seconds to wait."""
+        fingerprint = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:12]
+        with self._lock:
+            if self._active >= self.max_concurrency:
+                return _BUSY_POLL
+            bucket = self._buckets.get((model, fingerprint))
+            if bucket is None:
+                bucket = self._buckets[(model, fingerprint)] = TokenBucket(self.rpm, self.burst)
+            wait = bucket.take()
+            if wait == 0:
+                self._active += 1
+            return wait
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+
+    def complete(self, messages, model, temperature, api_key, options, meter):
+        raise NotImplementedError
+
+    async def acomplete(self, messages, model, temperature, api_key, options, meter):
+        return await asyncio.to_thread(self.complete, messages, model, temperature, api_key, options, meter)
+
+    async def astream(self, messages, model, temperature, api_key, options, meter):
+        yield await self.acomplete(messages, model, temperature, api_key, options, meter)
+
+    def embed(self, texts, model, api_key, meter):
+        """One vector (list of floats) per text."""
+        raise NotImplementedError(f"{self.name} has no embeddings")
+
+
+class GeminiProvider(Provider):
+    key_name = "gemini"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._models = ClientCache()
+
+    def _model(self, model, temperature, api_key):
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        return self._models.get((model, temperature, api_key), lambda: ChatGoogleGenerativeAI(
+            model=model, temperature=temperature, max_retries=0, google_api_key=api_key))
+
+    @staticmethod
+    def _messages(messages):
+        return [("human" if m["role"] == "user" else "ai" if m["role"] == "assistant" else m["role"], m["content"])
+                for m in messages]
+
+    @staticmethod
+    def _kwargs(options):
+        return {"safety_settings": options["safety_settings"]} if options.get("safety_settings") else {}
+
+    @staticmethod
+    def _measure(message, meter):
+        usage = getattr(message, "usage_metadata", None) or {}
+        meter.add(usage.get("input_tokens"), usage.get("output_tokens"))
+
+    def embed(self, texts, model, api_key, meter):
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+        embeddings = self._models.get(("embed", model, api_key), lambda: GoogleGenerativeAIEmbeddings(
+            model=model, google_api_key=api_key, task_type="semantic_similarity"))
+        return embeddings.embed_documents(texts)
+
+    def complete(self, messages, model, temperature, api_key, options, meter):
+        chat = self._model(model, temperature, api_key)
+        message = chat.invoke(self._messages(messages), **self._kwargs(options))
+        self._measure(message, meter)
+        return message.content
+
+    async def acomplete(self, messages, model, temperature, api_key, options, meter):
+        chat = self._model(model, temperature, api_key)
+        message = await chat.ainvoke(self._messages(messages), **self._kwargs(options))
+        self._measure(message, meter)
+        return message.content
+
+    async def astream(self, messages, model, temperature, api_key, options, meter):
+        chat = self._model(model, temperature, api_key)
+        async for chunk in chat.astream(self._messages(messages), **self._kwargs(options)):
+            self._measure(chunk, meter)
+            if chunk.content:
+                yield chunk.content
+
+
+class OpenAICompatibleProvider(Provider):
+    """DeepSeek, or any api speaking the OpenAI chat completions protocol."""
+
+    def __init__(self, name, base_url, key_name, *args, **kwargs):
+        super().__init__(name, *args, **kwargs)
+        self.base_url = base_url
+        self.key_name = key_name
+        self._clients = ClientCache()
+
+    def _client(self, api_key, asynchronous):
+        from openai import AsyncOpenAI, OpenAI
+
+        cls = AsyncOpenAI if asynchronous else OpenAI
+        return self._clients.get((api_key, asynchronous),
+                                 lambda: cls(api_key=api_key, base_url=self.base_url, max_retries=0))
+
+    @staticmethod
+    def _measure(response, meter):
+        if getattr(response, "usage", None) is not None:
+            meter.add(response.usage.prompt_tokens, response.usage.completion_tokens)
+
+    def complete(self, messages, model, temperature, api_key, options, meter):
+        response = self._client(api_key, False).chat.completions.create(
+            model=model, messages=messages, temperature=temperature, stream=False)
+        self._measure(response, meter)
+        return response.choices[0].message.content
+
+    async def acomplete(self, messages, model, temperature, api_key, options, meter):
+        response = await self._client(api_key, True).chat.completions.create(
+            model=model, messages=messages, temperature=temperature, stream=False)
+        self._measure(response, meter)
+        return response.choices[0].message.content
+
+    async def astream(self, messages, model, temperature, api_key, options, meter):
+        stream = await self._client(api_key, True).chat.completions.create(
+            model=model, messages=messages, temperature=temperature, stream=True,
+            stream_options={"include_usage": True})
+        async for chunk in stream:
+            # the last chunk carries the usage and no choices
+            self._measure(chunk, meter)
+            text = chunk.choices[0].delta.content if chunk.choices else None
+            if text:
+                yield text
+
+
+class FakeProvider(Provider):
+    """
+    Local provider for tests and keyless runs. Answers with `responses` in turn
+    (strings, or callables taking the messages), or echoes the last message.
+    The first `fail_times` calls raise a 429 ProviderError.
+    """
+
+    needs_key = False
+
+    def __init__(self, name="fake", responses=None, latency=0.0, fail_times=0, **kwargs):
+        super().__init__(name, **kwargs)
+        self.responses = itertools.cycle(responses) if responses else None
+        self.latency = latency
+        self.fail_times = fail_times
+        self.calls = []
+
+    def _answer(self, messages, model):
+        self.calls.append((model, messages))
+        if len(self.calls) <= self.fail_times:
+            raise ProviderError(f"{self.name}: rate limited", status_code=429)
+        if self.responses is None:
+            return messages[-1]["content"] if messages else ""
+        response = next(self.responses)
+        return response(messages) if callable(response) else response
+
+    def complete(self, messages, model, temperature, api_key, options, meter):
+        time.sleep(self.latency)
+        return self._answer(messages, model)
+
+    async def acomplete(self, messages, model, temperature, api_key, options, meter):
+        await asyncio.sleep(self.latency)
+        return self._answer(messages, model)
+
+    async def astream(self, messages, model, temperature, api_key, options, meter):
+        text = await self.acomplete(messages, model, temperature, api_key, options, meter)
+        for start in range(0, len(text), 16):
+            yield text[start:start + 16]
+
+    def embed(self, texts, model, api_key, meter):
+        self._answer([{"role": "user", "content": text} for text in texts], model)
+        # same text, same vector
+        return [[byte / 255 - 0.5 for byte in hashlib.sha256(text.encode("utf-8")).digest()[:16]] for text in texts]
+
+
+class LLMGateway:
+    def __init__(self, providers, routes, max_attempts=LLM_MAX_ATTEMPTS, failover_wait=LLM_FAILOVER_WAIT,
+                 max_wait=LLM_MAX_WAIT):
+        self.providers = providers
+        self.routes = routes
+        self.max_attempts = max_attempts
+        self.failover_wait = failover_wait
+        self.max_wait = max_wait
+        self._stats = Counter()
+        self._stats_lock = threading.Lock()
+        # called with (provider, model, prompt_tokens, completion_tokens, seconds) after every answered call
+        self.listeners = []
+
+    def _count(self, provider, event):
+        with self._stats_lock:
+            self._stats[(provider, event)] += 1
+
+    def stats(self):
+        """{provider: {calls, retries, throttled, failovers, errors: count}} of this process."""
+        with self._stats_lock:
+            stats = {}
+            for (provider, event), count in self._stats.items():
+                stats.setdefault(provider, {})[event] = count
+            return stats
+
+    def model_name(self, route):
+        return self.routes[route][0][1]
+
+    def candidates(self, route, api_keys=None):
+        """[(provider, model, api key)] of a route that can be called."""
+        found = []
+        for provider_name, model in self.routes[route]:
+            provider = self.providers.get(provider_name)
+            if provider is None:
+                continue
+            api_key = provider.key_for(api_keys)
+            if api_key is None and provider.needs_key:
+                continue
+            found.append((provider, model, api_key))
+        if not found:
+            raise LLMUnavailable(f"no provider configured for route {route!r}")
+        return found
+
+    def _max_wait(self, last):
+        return self.max_wait if last else self.failover_wait
+
+    def _acquire(self, provider, model, api_key, last):
+        deadline = time.monotonic() + self._max_wait(last)
+        while True:
+            wait = provider.try_acquire(model, api_key)
+            if wait == 0:
+                return True
+            if time.monotonic() + wait > deadline:
+                self._count(provider.name, "throttled")
+                return False
+            time.sleep(wait)
+
+    async def _aacquire(self, provider, model, api_key, last):
+        deadline = time.monotonic() + self._max_wait(last)
+        while True:
+            wait = provider.try_acquire(model, api_key)
+            if wait == 0:
+                return True
+            if time.monotonic() + wait > deadline:
+                self._count(provider.name, "throttled")
+                return False
+            await asyncio.sleep(wait)
+
+    def _failed(self, provider, model, attempt, error, errors):
+        """Record a failed call, True if the same candidate should be retried."""
+        errors.append(f"{provider.name}/{model}: {error}")
+        self._count(provider.name, "errors")
+        if retryable(error) and attempt + 1 < self.max_attempts:
+            self._count(provider.name, "retries")
+            return True
+        logging.warning("LLM %s/%s failed (%s), trying the next provider", provider.name, model, error)
+        self._count(provider.name, "failovers")
+        return False
+
+    def _answered(self, provider, model, prompt_chars, completion_chars, meter, started, on_answer=None):
+        if on_answer is not None:
+            try:
+                on_answer(provider.name, model)
+            except Exception as e:
+                logging.error("LLM on_answer callback failed: %s", e)
+        seconds = time.perf_counter() - started
+        prompt_tokens = meter.prompt_tokens or estimate_tokens(prompt_chars)
+        completion_tokens = meter.completion_tokens or estimate_tokens(completion_chars)
+        for listener in self.listeners:
+            try:
+                listener(provider.name, model, prompt_tokens, completion_tokens, seconds)
+            except Exception as e:
+                logging.error("LLM usage listener failed: %s", e)
+
+    @staticmethod
+    def _unavailable(route, errors):
+        return LLMUnavailable(f"route {route!r} failed: " + "; ".join(errors[-4:]))
+
+    def _call(self, route, api_keys, call, prompt_chars, on_answer=None):
+        """
+        call(provider, model, api key, meter) -> (result, completion chars) on the
+        route's candidates, with their limits, retries and failover.
+        """
+        errors = []
+        candidates = self.candidates(route, api_keys)
+        for index, (provider, model, api_key) in enumerate(candidates):
+            for attempt in range(self.max_attempts):
+                if not self._acquire(provider, model, api_key, index == len(candidates) - 1):
+                    errors.append(f"{provider.name}/{model}: throttled")
+                    break
+                self._count(provider.name, "calls")
+                meter, started = Meter(), time.perf_counter()
+                try:
+                    result, completion_chars = call(provider, model, api_key, meter)
+                    self._answered(provider, model, prompt_chars, completion_chars, meter, started, on_answer)
+                    return result
+                except Exception as e:
+                    if not self._failed(provider, model, attempt, e, errors):
+                        break
+                finally:
+                    provider.release()
+                time.sleep(backoff(attempt))
+        raise self._unavailable(route, errors)
+
+    def complete(self, messages, route, temperature=0, api_keys=None, on_answer=None, **options):
+        def call(provider, model, api_key, meter):
+            text = provider.complete(messages, model, temperature, api_key, options, meter)
+            return text, len(text or "")
+
+        return self._call(route, api_keys, call, message_chars(messages), on_answer)
+
+    def embed(self, texts, route="embedding", api_keys=None):
+        """One vector per text, from the route's embedding model."""
+        def call(provider, model, api_key, meter):
+            return provider.embed(texts, model, api_key, meter), 0
+
+        return self._call(route, api_keys, call, sum(len(text) for text in texts))
+
+    async def acomplete(self, messages, route, temperature=0, api_keys=None, on_answer=None, **options):
+        errors = []
+        candidates = self.candidates(route, api_keys)
+        for index, (provider, model, api_key) in enumerate(candidates):
+            for attempt in range(self.max_attempts):
+                if not await self._aacquire(provider, model, api_key, index == len(candidates) - 1):
+                    errors.append(f"{provider.name}/{model}: throttled")
+                    break
+                self._count(provider.name, "calls")
+                meter, started = Meter(), time.perf_counter()
+                try:
+                    text = await provider.acomplete(messages, model, temperature, api_key, options, meter)
+                    self._answered(provider, model, message_chars(messages), len(text or ""), meter, started, on_answer)
+                    return text
+                except Exception as e:
+                    if not self._failed(provider, model, attempt, e, errors):
+                        break
+                finally:
+                    provider.release()
+                await asyncio.sleep(backoff(attempt))
+        raise self._unavailable(route, errors)
+
+    async def astream(self, messages, route, temperature=0, api_keys=None, on_answer=None, **options):
+        """Yield the answer in chunks. Only a call that has not produced text yet is retried or failed over."""
+        errors = []
+        candidates = self.candidates(route, api_keys)
+        for index, (provider, model, api_key) in enumerate(candidates):
+            for attempt in range(self.max_attempts):
+                if not await self._aacquire(provider, model, api_key, index == len(candidates) - 1):
+                    errors.append(f"{provider.name}/{model}: throttled")
+                    break
+                self._count(provider.name, "calls")
+                meter, started, streamed = Meter(), time.perf_counter(), 0
+                try:
+                    async for chunk in provider.astream(messages, model, temperature, api_key, options, meter):
+                        streamed += len(chunk)
+                        yield chunk
+                    self._answered(provider, model, message_chars(messages), streamed, meter, started, on_answer)
+                    return
+                except Exception as e:
+                    if streamed:
+                        raise
+                    if not self._failed(provider, model, attempt, e, errors):
+                        break
+                finally:
+                    provider.release()
+                await asyncio.sleep(backoff(attempt))
+        raise self._unavailable(route, errors)
+
+
+def build_gateway():
+    if LLM_FAKE_PROVIDER:
+        fake = FakeProvider()
+        return LLMGateway({"fake": fake}, {route: [("fake", model) for _, model in candidates]
+                                           for route, candidates in ROUTES.items()})
+    providers = {
+        "gemini": GeminiProvider(
+            "gemini", os.getenv("GOOGLE_API_KEY"), rpm=_env("gemini", "RPM", 600),
+            burst=_env("gemini", "BURST", 20), max_concurrency=_env("gemini", "MAX_CONCURRENCY", 16)),
+        "deepseek": OpenAICompatibleProvider(
+            "deepseek", "https://api.deepseek.com", "deepseek", os.getenv("deepseek"),
+            rpm=_env("deepseek", "RPM", 300), burst=_env("deepseek", "BURST", 10),
+            max_concurrency=_env("deepseek", "MAX_CONCURRENCY", 8)),
+    }
+    return LLMGateway(providers, ROUTES)
+
+
+GATEWAY = build_gateway()
@@ -0,0 +1,192 @@
+"""
+JSON out of LLM answers.
+
+The chains answer with json wrapped in all kinds of ways: ```json fences with
+or without a trailing newline, ```python fences, a sentence before or after,
+python literals (True / None / 'single quotes'), a trailing comma, or an
+answer cut off at the token limit. The call sites used to slice a fixed
+number of characters off both ends ([7:-4], [10:-3], ...) and failed on
+anything else.
+
+extract_json(text):
+1. parses the stripped text directly when it already is plain json
+2. otherwise tries the text from the first json object / array after any
+   opening fence to the last closing bracket, then, if prose follows the
+   json, finds the matching close in one pass over the quote and bracket
+   characters (brackets inside strings are skipped)
+3. if that still does not parse, repairs it once: python literals and single
+   quoted strings become json, trailing commas are dropped and a truncated
+   answer gets its open strings and brackets closed
+
+orjson is used for parsing when it is installed.
+"""
+
+import json
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# repair is a single pass but answers above this are not worth guessing at
+MAX_REPAIR_CHARS = 1_000_000
+
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_CLOSING = {"{": "}", "[": "]"}
+_SPECIAL = re.compile(r"[\\\"'{}\[\]]")
+
+
+class LLMJSONError(ValueError):
+    pass
+
+
+def loads(text):
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def _start(text):
+    """Index of the first { or [ of the answer, after an opening ``` fence line."""
+    offset = 0
+    fence = text.find("```")
+    if fence != -1 and not text[:fence].strip():
+        newline = text.find("\n", fence)
+        offset = newline + 1 if newline != -1 else fence + 3
+    starts = [i for i in (text.find("{", offset), text.find("[", offset)) if i != -1]
+    return min(starts) if starts else -1
+
+
+def find_span(text):
+    """(start, end) of the first json value in text, end is None if it never closes."""
+    start = _start(text)
+    if start == -1:
+        return -1, None
+    depth = 0
+    quote = None
+    escaped_at = -1
+    # only the quote, escape and bracket characters are visited
+    for match in _SPECIAL.finditer(text, start):
+        i = match.start()
+        if i == escaped_at:
+            continue
+        char = match.group()
+        if quote:
+            if char == "\\":
+                escaped_at = i + 1
+            elif char == quote:
+                quote = None
+        elif char in "\"'":
+            # outside a string an apostrophe can only open a python string
+            quote = char
+        elif char in "{[":
+            depth += 1
+        elif char in "}]":
+            depth -= 1
+            if depth == 0:
+                return start, i + 1
+    return start, None
+
+
+def repair(text):
+    """Best effort json from python-ish or truncated json, in one pass."""
+    out = []
+    stack = []
+    quote = None
+    escaped = False
+    i = 0
+    n = len(text)
+    while i < n:
+        char = text[i]
+        if quote:
+            if escaped:
+                escaped = False
+                out.append(char)
+            elif char == "\\":
+                escaped = True
+                # \' is valid in python strings only
+                if quote == "'" and i + 1 < n and text[i + 1] == "'":
+                    escaped = False
+                    out.append("'")
+                    i += 2
+                    continue
+                out.append(char)
+            elif char == quote:
+                quote = None
+                out.append('"')
+            elif char == '"':
+                out.append('\\"')
+            elif char == "\n":
+                out.append("\\n")
+            else:
+                out.append(char)
+        elif char in "\"'":
+            quote = char
+            out.append('"')
+        elif char in "{[":
+            stack.append(char)
+            out.append(char)
+        elif char in "}]":
+            # drop a trailing comma before the close
+            while out and out[-1] in " \t\r\n":
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            if stack:
+                stack.pop()
+            out.append(char)
+        elif char.isalpha():
+            j = i
+            while j < n and (text[j].isalnum() or text[j] == "_"):
+                j += 1
+            word = text[i:j]
+            out.append(_PY_LITERALS.get(word, word))
+            i = j
+            continue
+        else:
+            out.append(char)
+        i += 1
+    if quote:
+        if escaped:
+            out.pop()
+        out.append('"')
+    while out and out[-1] in " \t\r\n,:":
+        out.pop()
+    out.extend(_CLOSING[opener] for opener in reversed(stack))
+    return "".join(out)
+
+
+def extract_json(text):
+    """The json value in an LLM answer, raises LLMJSONError if there is none."""
+    if not isinstance(text, str):
+        raise LLMJSONError(f"expected the answer text, got {type(text).__name__}")
+    stripped = text.strip()
+    if stripped[:1] in ("{", "["):
+        try:
+            return loads(stripped)
+        except ValueError:
+            pass
+    start = _start(text)
+    if start == -1:
+        raise LLMJSONError(f"no json in answer: {text[:200]!r}")
+    # usually the answer ends at its last bracket (fences and prose aside)
+    last = max(text.rfind("}"), text.rfind("]")) + 1
+    if last > start:
+        try:
+            return loads(text[start:last])
+        except ValueError:
+            pass
+    start, end = find_span(text)
+    candidate = text[start:end]
+    if end is not None:
+        try:
+            return loads(candidate)
+        except ValueError:
+            pass
+    if len(candidate) > MAX_REPAIR_CHARS:
+        raise LLMJSONError(f"invalid json answer of {len(candidate)} characters")
+    try:
+        return loads(repair(candidate))
+    except ValueError as e:
+        raise LLMJSONError(f"invalid json answer ({e}): {candidate[:200]!r}") from None
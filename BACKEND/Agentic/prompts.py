@@ -1,23 +1,12 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
-from groq import Groq
 from langchain_core.prompts import ChatPromptTemplate
 from langchain.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
 import os
 from dotenv import load_dotenv
+from llm_cache import CachedChain
 load_dotenv()
 
-groq = Groq()
-
-model = ChatGoogleGenerativeAI(
-    model="gemini-1.5-flash",
-    temperature=0,
-    max_tokens=None,
-    timeout=None,
-    max_retries=2,
-    google_api_key=os.getenv("GOOGLE_API_KEY")
-    # other params...
-)
+# every chain answers through llm_gateway.GATEWAY, on the "gemini" route
+# (gemini-1.5-flash at temperature 0, deepseek-chat as failover)
 
 
 # 8. location : start the workflow when a user reaches a specific location. Inputs : location_name
@@ -73,7 +62,7 @@ trigger_flow=ChatPromptTemplate.from_messages(
     ]
 )
 
-trigger_chain= trigger_flow| model | StrOutputParser()
+trigger_chain= CachedChain("trigger_chain", trigger_flow)
 
 
 
@@ -126,7 +115,7 @@ ques_flow=ChatPromptTemplate.from_messages(
     ]
 )
 
-ques_flow_chain= ques_flow| model | StrOutputParser()
+ques_flow_chain= CachedChain("ques_flow_chain", ques_flow)
 
 
 
@@ -203,7 +192,7 @@ major_tools=ChatPromptTemplate.from_messages(
     ]
 )
 
-major_tool_chain= major_tools| model | StrOutputParser()
+major_tool_chain= CachedChain("major_tool_chain", major_tools)
 
 
 
@@ -239,7 +228,7 @@ coder_prompt=ChatPromptTemplate.from_messages(
     ]
 )
 
-coder_chain= coder_prompt| model | StrOutputParser()
+coder_chain= CachedChain("coder_chain", coder_prompt, cache=None)
 
 
 
@@ -271,7 +260,7 @@ gemini_prompt=ChatPromptTemplate.from_messages(
         ),
     ]
 )
-gemini_chain= gemini_prompt| model | StrOutputParser()
+gemini_chain= CachedChain("gemini_chain", gemini_prompt)
 
 
 
@@ -307,7 +296,7 @@ llm_sys=ChatPromptTemplate.from_messages(
     ]
 )
 
-llm_sys_chain= llm_sys| model | StrOutputParser()
+llm_sys_chain= CachedChain("llm_sys_chain", llm_sys)
 
 
 
@@ -331,5 +320,5 @@ No preambles or postambles are required. eaxh string should be in double quotes.
     ]
 )
 
-iterator_chain= iterator| model | StrOutputParser()
+iterator_chain= CachedChain("iterator_chain", iterator)
 
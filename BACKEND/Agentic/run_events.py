@@ -0,0 +1,190 @@
+"""
+Replayable node events of workflow runs, in redis streams.
+
+Every node event of a run is XADDed to `run_events:<run id>` (capped at
+RUN_EVENTS_MAXLEN entries, expiring RUN_EVENTS_TTL seconds after the last
+event) and then published on `workflow_<user id>` for the live /ws sockets,
+with the stream entry id as "event_id". So a socket that (re)connects can
+replay what it missed:
+
+    /ws?token=...&run_id=<run id>&last_id=<last event_id seen>
+
+and GET /runs/<run id>/timeline returns all events of a run. Large data is
+cut to a preview and values can be compressed, see event_payload.py.
+
+Events are written in batches: the ones appended within RUN_EVENTS_BATCH_MS
+go to redis in one pipeline and are published to each user as one
+{"events": [...]} message. The batch timer belongs to the event loop of
+the run that armed it: celery runs every task in its own asyncio.run loop,
+a timer left on a finished loop is dropped and re-armed. Each run also
+has a `run:<run id>` hash (user, workflow, status, start / end) and the
+workflow keeps its last RECENT_RUNS run ids in `runs:<workflow id>`.
+
+Only core stream commands are used, any local redis >= 6.2 will do.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+from datetime import datetime
+
+from event_payload import EVENT_POLICY, decode, payload_key, with_event_id
+
+RUN_EVENTS_MAXLEN = int(os.getenv("RUN_EVENTS_MAXLEN", "2000"))
+RUN_EVENTS_TTL = int(os.getenv("RUN_EVENTS_TTL", str(7 * 24 * 3600)))
+RECENT_RUNS = int(os.getenv("RECENT_RUNS", "20"))
+RUN_EVENTS_BATCH_MS = float(os.getenv("RUN_EVENTS_BATCH_MS", "50"))
+
+
+def stream_key(run_id):
+    return f"run_events:{run_id}"
+
+
+def meta_key(run_id):
+    return f"run:{run_id}"
+
+
+def runs_key(workflow_id):
+    return f"runs:{workflow_id}"
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class RunEventLog:
+    """Writer side, used by the executor with the sync redis client."""
+
+    def __init__(self, redis_client, maxlen=RUN_EVENTS_MAXLEN, ttl=RUN_EVENTS_TTL,
+                 batch_seconds=RUN_EVENTS_BATCH_MS / 1000, policy=EVENT_POLICY):
+        self.redis_client = redis_client
+        self.maxlen = maxlen
+        self.ttl = ttl
+        self.batch_seconds = batch_seconds
+        self.policy = policy
+        self._pending = []          # (run_id, user_id, event json bytes, offloaded data)
+        self._flush_handle = None
+        self._flush_loop = None     # the loop _flush_handle is scheduled on
+        self._lock = threading.Lock()
+
+    def start(self, run_id, workflow_id, user_id):
+        pipe = self.redis_client.pipeline()
+        pipe.hset(meta_key(run_id), mapping={
+            "run_id": run_id,
+            "workflow_id": workflow_id,
+            "user_id": user_id,
+            "status": "running",
+            "started_at": datetime.now().isoformat(),
+        })
+        pipe.expire(meta_key(run_id), self.ttl)
+        pipe.lpush(runs_key(workflow_id), run_id)
+        pipe.ltrim(runs_key(workflow_id), 0, RECENT_RUNS - 1)
+        pipe.expire(runs_key(workflow_id), self.ttl)
+        pipe.execute()
+
+    def append(self, run_id, user_id, event):
+        """
+        Queue a node event. It is written with the other events of its batch
+        window, right away when there is no running event loop.
+        """
+        raw, offloaded = self.policy.dump(run_id, event)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        with self._lock:
+            self._pending.append((run_id, user_id, raw, offloaded))
+            if self._flush_handle is not None:
+                if self._flush_loop is loop and not loop.is_closed():
+                    return
+                # armed by an earlier task's loop, which will never run it
+                self._flush_handle.cancel()
+                self._flush_handle = self._flush_loop = None
+            if loop is not None and self.batch_seconds > 0:
+                self._flush_handle = loop.call_later(self.batch_seconds, self.flush)
+                self._flush_loop = loop
+                return
+        self.flush()
+
+    def flush(self):
+        """Add the queued events to their run streams, then publish them per user."""
+        with self._lock:
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+                self._flush_handle = self._flush_loop = None
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        try:
+            pipe = self.redis_client.pipeline()
+            for run_id, user_id, raw, offloaded in pending:
+                for key, value in offloaded.items():
+                    pipe.set(key, value, ex=self.ttl)
+                pipe.xadd(stream_key(run_id), {"event": self.policy.compressed(raw)}, maxlen=self.maxlen, approximate=True)
+            for run_id in {run_id for run_id, _, _, _ in pending}:
+                pipe.expire(stream_key(run_id), self.ttl)
+                pipe.expire(meta_key(run_id), self.ttl)
+            results = iter(pipe.execute())
+
+            batches = {}
+            for run_id, user_id, raw, offloaded in pending:
+                for _ in offloaded:
+                    next(results)
+                batches.setdefault(user_id, []).append(with_event_id(raw, _text(next(results))))
+            pipe = self.redis_client.pipeline(transaction=False)
+            for user_id, events in batches.items():
+                message = b'{"events": [' + b", ".join(events) + b"]}"
+                pipe.publish(f"workflow_{user_id}", self.policy.compressed(message))
+            pipe.execute()
+        except Exception as e:
+            logging.error("Could not write %d run events: %s", len(pending), e)
+
+    def resume(self, run_id):
+        self.redis_client.hset(meta_key(run_id), mapping={"status": "running", "resumed_at": datetime.now().isoformat()})
+
+    def last_seq(self, run_id):
+        """seq of the last event in the run's stream, 0 when there is none."""
+        entries = self.redis_client.xrevrange(stream_key(run_id), count=1)
+        if not entries:
+            return 0
+        fields = {_text(k): v for k, v in entries[0][1].items()}
+        return decode(fields["event"]).get("seq", 0)
+
+    def finish(self, run_id, status):
+        self.flush()
+        self.redis_client.hset(meta_key(run_id), mapping={"status": status, "finished_at": datetime.now().isoformat()})
+
+
+class RunEventReader:
+    """Reader side, used by the api with a redis.asyncio client (without decode_responses)."""
+
+    def __init__(self, aredis):
+        self.aredis = aredis
+
+    async def meta(self, run_id):
+        return {_text(k): _text(v) for k, v in (await self.aredis.hgetall(meta_key(run_id))).items()}
+
+    async def events(self, run_id, after=None, count=None):
+        """Events of a run in order, only those after the event_id `after` when given."""
+        entries = await self.aredis.xrange(stream_key(run_id), min=f"({after}" if after else "-", count=count)
+        events = []
+        for entry_id, fields in entries:
+            fields = {_text(k): v for k, v in fields.items()}
+            events.append({**decode(fields["event"]), "event_id": _text(entry_id)})
+        return events
+
+    async def payload(self, run_id, seq):
+        """Full data of a truncated event, None once expired."""
+        raw = await self.aredis.get(payload_key(run_id, seq))
+        return None if raw is None else decode(raw)
+
+    async def recent_runs(self, workflow_id):
+        """Metadata of the workflow's last runs, newest first."""
+        run_ids = await self.aredis.lrange(runs_key(workflow_id), 0, RECENT_RUNS - 1)
+        pipe = self.aredis.pipeline()
+        for run_id in run_ids:
+            pipe.hgetall(meta_key(_text(run_id)))
+        runs = [{_text(k): _text(v) for k, v in meta.items()} for meta in await pipe.execute()]
+        # the hash of a run can expire before the list entry
+        return [run for run in runs if run]
@@ -0,0 +1,212 @@
+"""
+Checkpoints of workflow runs, so a run whose worker died can be resumed
+instead of redoing every node (and paying for every LLM call) again.
+
+Redis keys of a run, expiring RUN_STATE_TTL seconds after the last write:
+
+    run_state:<run id>            hash: workflow_id, user_id, workflow, trigger_output
+    run_state:<run id>:notebook   hash: notebook key -> json value
+    run_state:<run id>:done       set of the cursors of finished work
+    run_state:<run id>:elements   hash: iterator cursor -> its element list,
+                                  element cursor -> the element's notebook writes
+    run_state:<run id>:lease      set while a worker runs the run, refreshed
+                                  every RUN_LEASE_SECONDS / 3
+    idem:<run id>:<cursor>        result of a side effecting tool call
+
+A cursor names a piece of work of the run: "<node id>" at the top level,
+"<iterator cursor>#<index>" for an element and "<element cursor>/<node id>"
+inside it. Top level nodes are checkpointed when they succeed (only the
+notebook keys they changed are written), iterator elements when their whole
+body succeeded. Resuming skips that work and reruns the rest.
+
+Tool actions in SIDE_EFFECT_ACTIONS run through once(): the result is
+stored under the call's idempotency key and a resumed run gets it back
+instead of sending the email again. A call that was started but never
+recorded (the worker died during it) is not repeated either, it fails with
+AlreadyAttempted. That pending marker expires after RUN_PENDING_TTL seconds,
+or is dropped at once by retry_attempted() when the user resumes the run
+asking to retry those calls; either way the call may then run a second time.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+
+RUN_STATE_TTL = int(os.getenv("RUN_STATE_TTL", str(7 * 24 * 3600)))
+RUN_LEASE_SECONDS = int(os.getenv("RUN_LEASE_SECONDS", "60"))
+RUN_PENDING_TTL = int(os.getenv("RUN_PENDING_TTL", "900"))
+SIDE_EFFECT_ACTIONS = set(os.getenv(
+    "SIDE_EFFECT_ACTIONS",
+    "GMAIL_SEND_EMAIL,GMAIL_CREATE_EMAIL_DRAFT,GMAIL_REPLY_TO_THREAD,GMAIL_CREATE_LABEL,GMAIL_REMOVE_LABEL,"
+    "NOTION_CREATE_PAGE_IN_PAGE,NOTION_ADD_ONE_CONTENT_BLOCK_IN_PAGE,NOTION_INSERT_ROW_DATABASE,"
+    "GOOGLEDOCS_CREATE_DOCUMENT,GOOGLEDOCS_UPDATE_EXISTING_DOCUMENT,GOOGLECALENDAR_CREATE_EVENT,"
+    "GOOGLEMEET_CREATE_MEET,YOUTUBE_SUBSCRIBE_A_CHANNEL",
+).split(","))
+
+PENDING = b"pending"
+
+
+def state_key(run_id):
+    return f"run_state:{run_id}"
+
+
+def lease_key(run_id):
+    return f"run_state:{run_id}:lease"
+
+
+def idempotency_key(run_id, cursor):
+    return f"idem:{run_id}:{cursor}"
+
+
+def _dumps(value):
+    return json.dumps(value, default=str)
+
+
+def _digest(text):
+    if isinstance(text, str):
+        text = text.encode()
+    return hashlib.sha1(text).digest()
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class AlreadyAttempted(Exception):
+    pass
+
+
+class RunState:
+    """Checkpoints of one run, used by the executor with the sync redis client."""
+
+    def __init__(self, redis_client, run_id, ttl=RUN_STATE_TTL):
+        self.redis_client = redis_client
+        self.run_id = run_id
+        self.ttl = ttl
+        self.meta = {}
+        self.notebook = {}
+        self.done = set()
+        self.elements = {}           # iterator cursor -> elements, element cursor -> writes
+        self.resumed = False
+        self._saved = {}             # notebook key -> digest of the json last written
+
+    def _key(self, part=None):
+        return state_key(self.run_id) + (f":{part}" if part else "")
+
+    def _expire(self, pipe):
+        for part in (None, "notebook", "done", "elements"):
+            pipe.expire(self._key(part), self.ttl)
+
+    def begin(self, workflow_id, user_id, workflow_json, trigger_output):
+        self.meta = {"workflow_id": workflow_id, "user_id": user_id,
+                     "workflow": workflow_json, "trigger_output": trigger_output}
+        pipe = self.redis_client.pipeline()
+        pipe.hset(self._key(), mapping={k: _dumps(v) for k, v in self.meta.items()})
+        pipe.expire(self._key(), self.ttl)
+        pipe.execute()
+
+    @classmethod
+    def load(cls, redis_client, run_id):
+        """State of a run to resume, None when there is no checkpoint (anymore)."""
+        state = cls(redis_client, run_id)
+        pipe = redis_client.pipeline()
+        pipe.hgetall(state._key())
+        pipe.hgetall(state._key("notebook"))
+        pipe.smembers(state._key("done"))
+        pipe.hgetall(state._key("elements"))
+        meta, notebook, done, elements = pipe.execute()
+        if not meta:
+            return None
+        state.meta = {_text(k): json.loads(v) for k, v in meta.items()}
+        state.notebook = {_text(k): json.loads(v) for k, v in notebook.items()}
+        state.done = {_text(cursor) for cursor in done}
+        state.elements = {_text(k): json.loads(v) for k, v in elements.items()}
+        state.resumed = True
+        state._saved = {_text(k): _digest(v) for k, v in notebook.items()}
+        return state
+
+    def node_done(self, cursor, notebook):
+        """Checkpoint a finished top level node with the notebook keys changed since the last one."""
+        # values are compared by content, nodes may change a value in place
+        dumped = {key: _dumps(value) for key, value in notebook.items()}
+        digests = {key: _digest(text) for key, text in dumped.items()}
+        changed = {key: dumped[key] for key, digest in digests.items() if self._saved.get(key) != digest}
+        pipe = self.redis_client.pipeline()
+        if changed:
+            pipe.hset(self._key("notebook"), mapping=changed)
+        pipe.sadd(self._key("done"), cursor)
+        self._expire(pipe)
+        pipe.execute()
+        self._saved.update({key: digests[key] for key in changed})
+        self.done.add(cursor)
+
+    def element_done(self, cursor, writes):
+        pipe = self.redis_client.pipeline()
+        pipe.hset(self._key("elements"), cursor, _dumps(writes))
+        pipe.sadd(self._key("done"), cursor)
+        self._expire(pipe)
+        pipe.execute()
+        self.elements[cursor] = writes
+        self.done.add(cursor)
+
+    def save_elements(self, cursor, elements):
+        """Keep an iterator's element list, a resumed run iterates over the same elements."""
+        self.redis_client.hset(self._key("elements"), cursor, _dumps(elements))
+        self.elements[cursor] = elements
+
+    async def once(self, cursor, call):
+        """await call() at most once per run and cursor, a repeat gets the recorded result."""
+        key = idempotency_key(self.run_id, cursor)
+        if not self.redis_client.set(key, PENDING, nx=True, ex=RUN_PENDING_TTL):
+            recorded = self.redis_client.get(key)
+            if recorded == PENDING:
+                raise AlreadyAttempted(f"{cursor} was started by an earlier attempt of run {self.run_id} and may have "
+                                       f"gone through, resume the run with retry_attempted_calls to run it again")
+            if recorded is not None:
+                return json.loads(recorded)
+            # the pending marker expired in between
+            return await self.once(cursor, call)
+        try:
+            result = await call()
+        except Exception:
+            # nothing recorded: the call failed, a retry may run it
+            self.redis_client.delete(key)
+            raise
+        self.redis_client.set(key, _dumps(result), ex=self.ttl)
+        return result
+
+    def acquire(self):
+        """Take the run's lease, False when a live worker holds it."""
+        return bool(self.redis_client.set(lease_key(self.run_id), "1", nx=True, ex=RUN_LEASE_SECONDS))
+
+    async def hold_lease(self):
+        while True:
+            await asyncio.sleep(RUN_LEASE_SECONDS / 3)
+            self.redis_client.set(lease_key(self.run_id), "1", ex=RUN_LEASE_SECONDS)
+
+    def release(self, finished):
+        """Drop the lease, and the checkpoints too once the run finished."""
+        keys = [lease_key(self.run_id)]
+        if finished:
+            keys += [self._key(part) for part in (None, "notebook", "done", "elements")]
+        self.redis_client.delete(*keys)
+
+
+async def retry_attempted(aredis, run_id):
+    """Drop the pending markers of the run's side effecting calls, the resumed run calls them again."""
+    retried = 0
+    async for key in aredis.scan_iter(match=idempotency_key(run_id, "*")):
+        # a pending marker never turns into a result here, the run is not running
+        if await aredis.get(key) == PENDING:
+            retried += await aredis.delete(key)
+    return retried
+
+
+async def resume_blocker(aredis, run_id):
+    """Why the run cannot be resumed now, None when it can (api side, redis.asyncio)."""
+    if await aredis.exists(lease_key(run_id)):
+        return "Run is still running"
+    if not await aredis.exists(state_key(run_id)):
+        return "No checkpoint for this run"
+    return None
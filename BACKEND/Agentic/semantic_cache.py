@@ -0,0 +1,238 @@
+"""
+Semantic cache of generated workflows.
+
+/create_agents spends three LLM calls (major tools, trigger, the large
+deepseek prompt) on every query, and users keep regenerating nearly the same
+query. SEMANTIC_CACHE keeps an embedding of every query that produced a
+workflow, starting with the ones in the generation log (see
+generation_log.read_entries). A new query whose cosine similarity to a past
+query of the same user reaches SEMANTIC_CACHE_THRESHOLD gets a copy of that
+workflow instead of a new generation (the caller assigns the workflow_id).
+
+Entries belong to the user who generated them: a workflow carries its
+user's config_inputs (email addresses, Notion and Sheet links), so it is
+never handed to somebody else. Log entries without a user_id (prism.json
+and older log lines) are not loaded.
+
+Queries are embedded through llm_gateway.GATEWAY ("embedding" route), so
+the calls share its rate limits and retries and are accounted to the
+usage_context of the request. The last SEMANTIC_CACHE_QUERY_VECTORS query
+embeddings are kept in memory, the add() after a lookup() of the same query
+does not embed it again. Embeddings of past queries are stored in
+SEMANTIC_CACHE_EMBEDDINGS keyed by a hash of the query text, so a restart
+only embeds queries it has not seen.
+New embeddings are written by a background thread at most every
+SEMANTIC_CACHE_SAVE_SECONDS (and at exit), not on the request path.
+"""
+
+import atexit
+import copy
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from dotenv import load_dotenv
+
+from generation_log import read_entries
+from llm_gateway import GATEWAY
+from usage import UNATTRIBUTED, usage_context
+
+load_dotenv()
+
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_QUERY_VECTORS = int(os.getenv("SEMANTIC_CACHE_QUERY_VECTORS", "1024"))
+SEMANTIC_CACHE_EMBEDDINGS = os.getenv("SEMANTIC_CACHE_EMBEDDINGS", "semantic_cache.npz")
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "1") != "0"
+SEMANTIC_CACHE_SAVE_SECONDS = float(os.getenv("SEMANTIC_CACHE_SAVE_SECONDS", "60"))
+EMBED_BATCH = 100
+
+
+def query_digest(query):
+    return hashlib.sha256(query.strip().encode("utf-8")).hexdigest()
+
+
+def embed(texts, api_keys=None):
+    """Unit-length embeddings of texts, one row per text."""
+    rows = []
+    for start in range(0, len(texts), EMBED_BATCH):
+        rows.extend(GATEWAY.embed(texts[start:start + EMBED_BATCH], "embedding", api_keys=api_keys))
+    vectors = np.array(rows, dtype="float32")
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class SemanticCache:
+    def __init__(self, embeddings_path=SEMANTIC_CACHE_EMBEDDINGS, threshold=SEMANTIC_CACHE_THRESHOLD,
+                 save_seconds=SEMANTIC_CACHE_SAVE_SECONDS, query_vectors=SEMANTIC_CACHE_QUERY_VECTORS):
+        self.embeddings_path = embeddings_path
+        self.threshold = threshold
+        self.save_seconds = save_seconds
+        self.query_vectors = query_vectors
+        self._queries = []
+        self._responses = []
+        # one row per entry, with spare rows: grown by doubling, not copied on every add
+        self._matrix = None
+        self._recent = OrderedDict()    # query digest -> vector of the last queries embedded
+        self._by_user = {}              # user id -> indexes of its entries
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._unsaved = 0
+        self._saver = None
+        self._stop = threading.Event()
+        self.hits = 0
+        self.misses = 0
+        self.last_similarity = None
+
+    @property
+    def _vectors(self):
+        return None if self._matrix is None else self._matrix[:len(self._queries)]
+
+    def _query_vector(self, query, api_keys):
+        digest = query_digest(query)
+        with self._lock:
+            vector = self._recent.get(digest)
+            if vector is not None:
+                self._recent.move_to_end(digest)
+                return vector
+        vector = embed([query], api_keys)[0]
+        with self._lock:
+            self._recent[digest] = vector
+            while len(self._recent) > self.query_vectors:
+                self._recent.popitem(last=False)
+        return vector
+
+    def _stored_embeddings(self):
+        if not os.path.exists(self.embeddings_path):
+            return {}
+        with np.load(self.embeddings_path) as stored:
+            return dict(zip(stored["digests"].tolist(), stored["vectors"]))
+
+    def _save_embeddings(self, queries, vectors):
+        digests = np.array([query_digest(q) for q in queries])
+        # np.savez appends .npz to names without it
+        partial = self.embeddings_path + ".partial.npz"
+        np.savez(partial, digests=digests, vectors=vectors)
+        os.replace(partial, self.embeddings_path)
+
+    def _index(self, user_id, query, response, vector):
+        count = len(self._queries)
+        if self._matrix is None or count == len(self._matrix):
+            grown = np.zeros((max(16, 2 * count), len(vector)), dtype="float32")
+            if count:
+                grown[:count] = self._matrix[:count]
+            self._matrix = grown
+        self._matrix[count] = vector
+        self._by_user.setdefault(user_id, []).append(count)
+        self._queries.append(query)
+        self._responses.append(response)
+
+    def _load(self):
+        entries = [e for e in read_entries()
+                   if e.get("query") and e.get("user_id") and isinstance(e.get("response"), dict)]
+        stored = self._stored_embeddings()
+        missing = list({e["query"] for e in entries if query_digest(e["query"]) not in stored})
+        if missing:
+            # backfill of the log, not the work of the request that triggered the load
+            with usage_context(user_id=UNATTRIBUTED):
+                vectors = embed(missing)
+            for digest, vector in zip(map(query_digest, missing), vectors):
+                stored[digest] = vector
+        self._queries = [e["query"] for e in entries]
+        self._responses = [e["response"] for e in entries]
+        self._matrix = np.array([stored[query_digest(q)] for q in self._queries], dtype="float32") \
+            if entries else None
+        self._by_user = {}
+        for i, entry in enumerate(entries):
+            self._by_user.setdefault(entry["user_id"], []).append(i)
+        if missing:
+            self._save_embeddings(self._queries, self._vectors)
+        self._loaded = True
+        logging.info("Semantic cache loaded %s workflows of %s users", len(self._queries), len(self._by_user))
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if not self._loaded:
+                self._load()
+
+    def lookup(self, query, user_id, api_keys=None):
+        """Copy of the user's cached workflow of the most similar past query, or None."""
+        self._ensure_loaded()
+        if not self._by_user.get(user_id):
+            with self._lock:
+                self.misses += 1
+            return None
+        vector = self._query_vector(query, api_keys)
+        with self._lock:
+            indexes = self._by_user[user_id]
+            similarities = self._vectors[indexes] @ vector
+            best = indexes[int(np.argmax(similarities))]
+            self.last_similarity = float(similarities.max())
+            if self.last_similarity < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            response = copy.deepcopy(self._responses[best])
+        logging.info("Semantic cache hit (%.3f) for %r: %r", self.last_similarity, query, self._queries[best])
+        return response
+
+    def add(self, query, user_id, response, api_keys=None):
+        self._ensure_loaded()
+        vector = self._query_vector(query, api_keys)
+        with self._lock:
+            self._index(user_id, query, {k: copy.deepcopy(v) for k, v in response.items() if k != "workflow_id"},
+                        vector)
+            self._unsaved += 1
+        self._ensure_saver()
+
+    def _ensure_saver(self):
+        if self._saver is not None:
+            return
+        with self._lock:
+            if self._saver is None:
+                self._saver = threading.Thread(target=self._run_saver, daemon=True)
+                self._saver.start()
+                atexit.register(self.close)
+
+    def _run_saver(self):
+        while not self._stop.wait(self.save_seconds):
+            self.save()
+
+    def save(self):
+        """Write the embeddings added since the last save, if any."""
+        with self._lock:
+            if not self._unsaved:
+                return
+            # rows are only appended, the saved ones never change
+            queries, vectors, self._unsaved = list(self._queries), self._vectors, 0
+        try:
+            self._save_embeddings(queries, vectors)
+        except Exception as e:
+            logging.error("Semantic cache save failed: %s", e)
+            with self._lock:
+                self._unsaved += 1
+
+    def close(self):
+        self._stop.set()
+        self.save()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "threshold": self.threshold,
+                "entries": len(self._queries),
+                "users": len(self._by_user),
+                "unsaved": self._unsaved,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "last_similarity": self.last_similarity,
+            }
+
+
+SEMANTIC_CACHE = SemanticCache()
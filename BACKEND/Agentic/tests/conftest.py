@@ -0,0 +1,109 @@
+"""
+Shared setup of the backend tests.
+
+The LLM chains (prompts.py) and the tool classes (tools/tool_classes.py,
+Workflow_ec2/oth_tools.py) need provider keys and composio at import time, so
+the tests put stand-ins for those modules in place before anything imports
+them. Redis, DynamoDB and celery are never contacted: executor tests run with
+an in-memory RunState and event log (see executor below).
+"""
+
+import logging
+import os
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# tools/dynamo.py copies these into os.environ at import
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "test")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "test")
+# start_flow logs to a file on the production host, basicConfig is a no-op
+# once the root logger has a handler
+logging.basicConfig(level=logging.INFO)
+
+
+def _stand_in(name, **attrs):
+    if name not in sys.modules:
+        module = types.ModuleType(name)
+        module.__dict__.update(attrs)
+        sys.modules[name] = module
+    return sys.modules[name]
+
+
+_stand_in("prompts", llm_sys_chain=None, iterator_chain=None, gemini_chain=None)
+_stand_in("tools.tool_classes")
+_stand_in("Workflow_ec2.oth_tools")
+
+
+class FakeChain:
+    """LLM chain answering with fixed text and counting its calls."""
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.calls = []
+
+    def invoke(self, inputs, use_cache=True, api_keys=None):
+        self.calls.append(inputs)
+        return self.answer(inputs) if callable(self.answer) else self.answer
+
+
+class MemoryState:
+    """The parts of run_state.RunState the executor uses, without redis."""
+
+    resumed = False
+
+    def __init__(self):
+        self.done = set()
+        self.elements = {}
+        self.notebook = {}
+
+    def node_done(self, cursor, notebook):
+        self.done.add(cursor)
+
+    def element_done(self, cursor, writes):
+        self.elements[cursor] = writes
+        self.done.add(cursor)
+
+    def save_elements(self, cursor, elements):
+        self.elements[cursor] = elements
+
+    async def once(self, cursor, call):
+        return await call()
+
+
+class MemoryEventLog:
+    def __init__(self):
+        self.events = []
+
+    def append(self, run_id, user_id, event):
+        self.events.append(event)
+
+    def statuses(self, node):
+        return [event["status"] for event in self.events if event["node"] == node]
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    """
+    Workflow_ec2.start_flow with users, event log and binding cache kept in
+    memory. executor.run(agents, functions) compiles the agent list against
+    the given standalone tool functions and runs it.
+    """
+    from Workflow_ec2 import start_flow
+    from Workflow_ec2.binding import BindingCache
+    from Workflow_ec2.compiler import WorkflowCompiler
+
+    log = MemoryEventLog()
+    monkeypatch.setattr(start_flow, "RUN_LOG", log)
+    monkeypatch.setattr(start_flow, "BINDINGS", BindingCache())
+    monkeypatch.setattr(start_flow, "get_api_keys", lambda user_id, scope=None: {"composio": "test"})
+
+    async def run(agents, functions, notebook=None):
+        steps = WorkflowCompiler(functions).compile(agents)
+        ctx = start_flow.RunContext("wf", "user", None, state=MemoryState())
+        return await start_flow.run_steps(steps, notebook if notebook is not None else {}, ctx)
+
+    return types.SimpleNamespace(module=start_flow, log=log, run=run)
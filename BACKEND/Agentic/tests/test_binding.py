@@ -0,0 +1,155 @@
+"""Deterministic binding of node data to tool parameters, and when the LLM and the mapping cache are used."""
+
+import asyncio
+import inspect
+
+import pytest
+
+from Workflow_ec2.binding import BindingCache, apply_mapping, bind, bind_arguments, coerce, infer_mapping
+
+
+def params_of(function):
+    return list(inspect.signature(function).parameters.values())
+
+
+def YOUTUBESEARCH(query, max_results=10):
+    pass
+
+
+def SEND_EMAIL(recipient="email address of the receiver", body="text of the mail", is_html=False):
+    pass
+
+
+class FakeFallback:
+    def __init__(self, values):
+        self.values = values
+        self.calls = []
+
+    async def __call__(self, missing, data):
+        self.calls.append(sorted(missing))
+        return dict(self.values)
+
+
+def run_bind(function, data, fallback, cache=None, cache_key="binding:wf:1:shape"):
+    cache = cache if cache is not None else BindingCache()
+    return asyncio.run(bind_arguments(params_of(function), data, cache, cache_key, fallback))
+
+
+@pytest.mark.parametrize("value, target, expected", [
+    ("12", int, 12),
+    (3.0, int, 3),
+    ("yes", bool, True),
+    ("N", bool, False),
+    (0, bool, False),
+    ("2.5", float, 2.5),
+    ({"a": 1}, str, '{"a": 1}'),
+    ('["a", "b"]', list, ["a", "b"]),
+    ("a", list, ["a"]),
+    ('{"a": 1}', dict, {"a": 1}),
+    ("anything", None, "anything"),
+])
+def test_coerce(value, target, expected):
+    assert coerce(value, target) == expected
+
+
+@pytest.mark.parametrize("value, target", [("many", int), ("maybe", bool), (True, float), ("[1]", dict)])
+def test_coerce_rejects_values_of_another_type(value, target):
+    with pytest.raises(ValueError):
+        coerce(value, target)
+
+
+def test_bind_matches_exact_and_suffixed_names():
+    bound, missing, unused = bind(params_of(SEND_EMAIL), {"Recipient_3": "a@b.c", "body": "hi", "extra": 1})
+    assert bound == {"recipient": "a@b.c", "body": "hi"}
+    assert missing == []
+    assert unused == ["extra"]
+
+
+def test_bind_coerces_to_the_type_of_the_default():
+    bound, missing, _ = bind(params_of(YOUTUBESEARCH), {"query": "cats", "max_results_2": "5"})
+    assert bound == {"query": "cats", "max_results": 5}
+    assert missing == []
+
+
+def test_bind_leaves_ambiguous_and_unconvertible_keys_unused():
+    bound, missing, unused = bind(params_of(YOUTUBESEARCH), {"query_1": "a", "query_2": "b", "max_results": "many"})
+    assert bound == {}
+    assert missing == ["query"]
+    assert sorted(unused) == ["max_results", "query_1", "query_2"]
+
+
+def test_infer_mapping_maps_values_to_their_input_key_or_the_default():
+    params = params_of(YOUTUBESEARCH)
+    data = {"search_terms": "cats and dogs", "num_videos": 500}
+    assert infer_mapping({"query": "cats and dogs", "max_results": 500}, data, params) == {
+        "query": "search_terms", "max_results": "num_videos"}
+    assert infer_mapping({"query": "cats and dogs", "max_results": 10}, data, params) == {
+        "query": "search_terms", "max_results": None}
+
+
+@pytest.mark.parametrize("values", [
+    {"query": "cats"},                          # made up by the LLM
+    {"query": "cats and dogs", "max_results": 5},  # trivial, may be a coincidence
+])
+def test_infer_mapping_gives_up_on_values_it_cannot_explain(values):
+    data = {"search_terms": "cats and dogs", "num_videos": 5, "count": 5}
+    assert infer_mapping(values, data, params_of(YOUTUBESEARCH)) is None
+
+
+def test_infer_mapping_gives_up_on_values_found_under_two_keys():
+    data = {"a": "same value", "b": "same value"}
+    assert infer_mapping({"query": "same value"}, data, params_of(YOUTUBESEARCH)) is None
+
+
+def test_apply_mapping_reads_and_coerces_the_mapped_keys():
+    params = params_of(YOUTUBESEARCH)
+    mapping = {"query": "search_terms", "max_results": "num_videos"}
+    assert apply_mapping(mapping, params, {"search_terms": "cats", "num_videos": "7"}) == {
+        "query": "cats", "max_results": 7}
+    assert apply_mapping({"query": "search_terms", "max_results": None}, params, {"search_terms": "cats"}) == {
+        "query": "cats"}
+
+
+def test_apply_mapping_rejects_data_that_no_longer_fits():
+    params = params_of(YOUTUBESEARCH)
+    assert apply_mapping({"query": "search_terms"}, params, {"other": "cats"}) is None
+    assert apply_mapping({"max_results": "num_videos"}, params, {"num_videos": "lots"}) is None
+
+
+def test_bound_parameters_skip_the_llm():
+    fallback = FakeFallback({})
+    assert run_bind(YOUTUBESEARCH, {"query_1": "cats"}, fallback) == {"query": "cats"}
+    assert fallback.calls == []
+
+
+def test_unmatched_key_goes_to_the_llm_for_a_defaulted_parameter():
+    fallback = FakeFallback({"max_results": 5})
+    kwargs = run_bind(YOUTUBESEARCH, {"query": "cats", "num_videos": 5}, fallback)
+    assert kwargs == {"query": "cats", "max_results": 5}
+    assert fallback.calls == [["max_results"]]
+
+
+def test_llm_mapping_is_cached_and_reused():
+    cache = BindingCache()
+    fallback = FakeFallback({"max_results": "250"})
+    assert run_bind(YOUTUBESEARCH, {"query": "cats", "num_videos": 250}, fallback, cache) == {
+        "query": "cats", "max_results": 250}
+    assert cache.get("binding:wf:1:shape") == {"max_results": "num_videos"}
+
+    assert run_bind(YOUTUBESEARCH, {"query": "dogs", "num_videos": 300}, fallback, cache) == {
+        "query": "dogs", "max_results": 300}
+    assert len(fallback.calls) == 1
+
+
+def test_llm_answers_for_bound_or_unknown_parameters_are_dropped():
+    fallback = FakeFallback({"query": "other", "max_results": 500, "made_up": 1})
+    kwargs = run_bind(YOUTUBESEARCH, {"query": "cats", "num_videos": 500}, fallback)
+    assert kwargs == {"query": "cats", "max_results": 500}
+
+
+def test_trivial_llm_values_are_not_cached():
+    cache = BindingCache()
+    fallback = FakeFallback({"is_html": True})
+    kwargs = run_bind(SEND_EMAIL, {"recipient": "a@b.c", "body": "hi", "html": "Y"}, fallback, cache)
+    assert kwargs == {"recipient": "a@b.c", "body": "hi", "is_html": True}
+    assert cache.get("binding:wf:1:shape") is None
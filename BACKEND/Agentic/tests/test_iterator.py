@@ -0,0 +1,163 @@
+"""Iterator semantics of the executor: plan.build_plan + start_flow.run_steps / iterate."""
+
+import asyncio
+import threading
+import time
+
+from conftest import FakeChain
+from Workflow_ec2.plan import build_plan
+
+
+def agent(id, type, name, inputs=(), outputs=(), **extra):
+    return {"id": id, "type": type, "name": name, "to_execute": None, "config_inputs": {},
+            "data_flow_inputs": list(inputs), "data_flow_outputs": list(outputs), **extra}
+
+
+class Calls:
+    """Standalone tool functions recording their arguments."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seen = {}
+
+    def record(self, name, value):
+        with self.lock:
+            self.seen.setdefault(name, []).append(value)
+
+    def __getitem__(self, name):
+        return self.seen.get(name, [])
+
+
+def test_plan_nests_the_body_under_its_iterator():
+    agents = [
+        agent(1, "tool", "read_rows", outputs=["rows_1"]),
+        agent(2, "connector", "iterator", ["rows_1"], ["row_2"]),
+        agent(3, "tool", "handle_row", ["row_2"], ["handled_3"]),
+        agent(4, "connector", "iterator_end"),
+        agent(5, "tool", "report", ["row_2_results"], ["report_5"]),
+    ]
+    plan = build_plan(agents)
+    assert [step.agent["id"] for step in plan] == [1, 2, 5]
+    assert [step.agent["id"] for step in plan[1].body] == [3]
+
+
+def test_body_runs_once_per_element_and_the_node_after_the_end_once(executor):
+    calls = Calls()
+
+    def read_rows():
+        calls.record("read", None)
+        return ["a", "b", "c"]
+
+    def handle_row(row_2):
+        calls.record("handle", row_2)
+        return row_2.upper()
+
+    def report(row_2_results):
+        calls.record("report", row_2_results)
+        return len(row_2_results)
+
+    agents = [
+        agent(1, "tool", "read_rows", outputs=["rows_1"]),
+        agent(2, "connector", "iterator", ["rows_1"], ["row_2"]),
+        agent(3, "tool", "handle_row", ["row_2"], ["handled_3"]),
+        agent(4, "connector", "iterator_end"),
+        agent(5, "tool", "report", ["row_2_results"], ["report_5"]),
+    ]
+    functions = {"READ_ROWS": read_rows, "HANDLE_ROW": handle_row, "REPORT": report}
+    result = asyncio.run(executor.run(agents, functions))
+
+    assert result["status"] == "success"
+    assert len(calls["read"]) == 1
+    assert sorted(calls["handle"]) == ["a", "b", "c"]
+    assert calls["report"] == [[{"handled_3": "A"}, {"handled_3": "B"}, {"handled_3": "C"}]]
+    assert result["data"]["report_5"] == 3
+    assert executor.log.statuses(3) == ["executed successfully"] * 3
+    assert executor.log.statuses(5) == ["executed successfully"]
+
+
+def test_results_keep_element_order_and_element_writes_stay_scoped(executor):
+    def handle_row(row_2):
+        # later elements finish first
+        time.sleep(0.01 * (3 - row_2))
+        return row_2 * 10
+
+    agents = [
+        agent(1, "connector", "iterator", ["rows"], ["row_2"], config_inputs={"max_in_flight": 3}),
+        agent(2, "tool", "handle_row", ["row_2"], ["handled_2"]),
+    ]
+    result = asyncio.run(executor.run(agents, {"HANDLE_ROW": handle_row}, {"rows": [0, 1, 2]}))
+
+    notebook = result["data"]
+    assert notebook["row_2_results"] == [{"handled_2": 0}, {"handled_2": 10}, {"handled_2": 20}]
+    # the writes of an element never reach the shared notebook
+    assert "handled_2" not in notebook and "row_2" not in notebook
+
+
+def test_nested_iterators(executor):
+    calls = Calls()
+
+    def handle_item(item_3):
+        calls.record("item", item_3)
+        return item_3 + 100
+
+    def after():
+        calls.record("after", None)
+        return "done"
+
+    agents = [
+        agent(1, "connector", "iterator", ["groups"], ["group_1"]),
+        agent(2, "tool", "after_group", outputs=["group_done_2"]),
+        agent(3, "connector", "iterator", ["group_1"], ["item_3"]),
+        agent(4, "tool", "handle_item", ["item_3"], ["handled_4"]),
+        agent(5, "connector", "end iterator"),
+        agent(6, "connector", "iterator_end"),
+        agent(7, "tool", "after", outputs=["after_7"]),
+    ]
+    functions = {"HANDLE_ITEM": handle_item, "AFTER_GROUP": lambda: calls.record("group", None), "AFTER": after}
+    plan = build_plan(agents)
+    assert [step.agent["id"] for step in plan] == [1, 7]
+    assert [step.agent["id"] for step in plan[0].body] == [2, 3]
+
+    result = asyncio.run(executor.run(agents, functions, {"groups": [[1, 2], [3]]}))
+
+    assert result["status"] == "success"
+    assert sorted(calls["item"]) == [1, 2, 3]
+    assert len(calls["group"]) == 2
+    assert len(calls["after"]) == 1
+    groups = result["data"]["group_1_results"]
+    assert [group["item_3_results"] for group in groups] == [
+        [{"handled_4": 101}, {"handled_4": 102}],
+        [{"handled_4": 103}],
+    ]
+
+
+def test_llm_node_after_the_iterator_sees_the_results(executor, monkeypatch):
+    chain = FakeChain(lambda inputs: '{"summary_3": "%s rows"}' % len(inputs["data"]["row_1_results"]))
+    monkeypatch.setattr(executor.module, "llm_sys_chain", chain)
+    agents = [
+        agent(1, "connector", "iterator", ["rows"], ["row_1"]),
+        agent(2, "tool", "handle_row", ["row_1"], ["handled_2"]),
+        agent(4, "connector", "iterator_end"),
+        agent(3, "llm", "summary", ["row_1_results"], ["summary_3"], llm_prompt="summarize"),
+    ]
+    result = asyncio.run(executor.run(agents, {"HANDLE_ROW": lambda row_1: row_1}, {"rows": ["x", "y"]}))
+
+    assert len(chain.calls) == 1
+    assert result["data"]["summary_3"] == "2 rows"
+
+
+def test_a_failing_element_does_not_stop_the_others(executor):
+    def handle_row(row_1):
+        if row_1 == "bad":
+            raise ValueError("bad row")
+        return row_1
+
+    agents = [
+        agent(1, "connector", "iterator", ["rows"], ["row_1"]),
+        agent(2, "tool", "handle_row", ["row_1"], ["handled_2"]),
+    ]
+    result = asyncio.run(executor.run(agents, {"HANDLE_ROW": handle_row}, {"rows": ["ok", "bad", "fine"]}))
+
+    assert result["status"] == "partial"
+    assert executor.log.statuses(1) == ["partially failed"]
+    assert result["data"]["row_1_results"] == [{"handled_2": "ok"}, {}, {"handled_2": "fine"}]
@@ -0,0 +1,169 @@
+"""Retries, failover and rate limits of llm_gateway.LLMGateway, against FakeProvider."""
+
+import asyncio
+import itertools
+import threading
+
+import pytest
+
+import llm_gateway
+from llm_gateway import ClientCache, FakeProvider, LLMGateway, LLMUnavailable, ProviderError, TokenBucket
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "backoff", lambda attempt: 0)
+
+
+def gateway(*providers, **kwargs):
+    route = [(provider.name, f"{provider.name}-model") for provider in providers]
+    return LLMGateway({provider.name: provider for provider in providers}, {"test": route}, **kwargs)
+
+
+def test_transient_error_is_retried_on_the_same_provider():
+    primary = FakeProvider("primary", responses=["answer"], fail_times=2)
+    backup = FakeProvider("backup", responses=["backup answer"])
+    llm = gateway(primary, backup, max_attempts=3)
+
+    assert llm.complete(MESSAGES, "test") == "answer"
+    assert len(primary.calls) == 3
+    assert backup.calls == []
+    assert llm.stats()["primary"] == {"calls": 3, "errors": 2, "retries": 2}
+
+
+def test_failover_to_the_next_candidate_after_the_last_attempt():
+    primary = FakeProvider("primary", fail_times=10)
+    backup = FakeProvider("backup", responses=["backup answer"])
+    llm = gateway(primary, backup, max_attempts=2)
+
+    assert asyncio.run(llm.acomplete(MESSAGES, "test")) == "backup answer"
+    assert len(primary.calls) == 2
+    assert backup.calls == [("backup-model", MESSAGES)]
+    assert llm.stats()["primary"]["failovers"] == 1
+
+
+def test_non_retryable_error_fails_over_at_once():
+    def broken(messages):
+        raise ProviderError("bad request", status_code=400)
+
+    primary = FakeProvider("primary", responses=[broken])
+    backup = FakeProvider("backup", responses=["backup answer"])
+    llm = gateway(primary, backup, max_attempts=3)
+
+    assert llm.complete(MESSAGES, "test") == "backup answer"
+    assert len(primary.calls) == 1
+
+
+def test_every_candidate_failing_raises_llm_unavailable():
+    llm = gateway(FakeProvider("a", fail_times=10), FakeProvider("b", fail_times=10), max_attempts=2)
+
+    with pytest.raises(LLMUnavailable):
+        llm.complete(MESSAGES, "test")
+
+
+def test_streamed_answer_after_a_retry():
+    provider = FakeProvider("primary", responses=["x" * 40], fail_times=1)
+    llm = gateway(provider, max_attempts=2)
+
+    async def collect():
+        return [chunk async for chunk in llm.astream(MESSAGES, "test")]
+
+    assert "".join(asyncio.run(collect())) == "x" * 40
+
+
+def test_concurrency_cap_per_provider():
+    in_flight = []
+    provider = FakeProvider("primary", latency=0.02, max_concurrency=2)
+
+    def answer(messages):
+        in_flight.append(provider._active)
+        return "ok"
+
+    provider.responses = itertools.cycle([answer])
+    llm = gateway(provider, max_wait=5)
+
+    async def burst():
+        return await asyncio.gather(*(llm.acomplete(MESSAGES, "test") for _ in range(8)))
+
+    assert asyncio.run(burst()) == ["ok"] * 8
+    assert max(in_flight) == 2
+    assert provider._active == 0
+
+
+def test_concurrency_cap_across_threads():
+    provider = FakeProvider("primary", latency=0.02, max_concurrency=3)
+    seen = []
+
+    def answer(messages):
+        seen.append(provider._active)
+        return "ok"
+
+    provider.responses = itertools.cycle([answer])
+    llm = gateway(provider, max_wait=5)
+
+    threads = [threading.Thread(target=llm.complete, args=(MESSAGES, "test")) for _ in range(9)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(seen) == 9
+    assert max(seen) <= 3
+
+
+def test_token_bucket_refuses_once_the_burst_is_used():
+    bucket = TokenBucket(rate_per_min=60, burst=2)
+
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert 0 < bucket.take() <= 1
+
+
+def test_empty_token_bucket_fails_over_instead_of_waiting():
+    primary = FakeProvider("primary", responses=["primary answer"], rpm=60, burst=2)
+    backup = FakeProvider("backup", responses=["backup answer"])
+    llm = gateway(primary, backup, failover_wait=0.1)
+
+    answers = [llm.complete(MESSAGES, "test") for _ in range(3)]
+
+    assert answers == ["primary answer", "primary answer", "backup answer"]
+    assert llm.stats()["primary"]["throttled"] == 1
+
+
+def test_buckets_are_per_api_key():
+    provider = FakeProvider("primary", rpm=60, burst=1)
+
+    assert provider.try_acquire("model", "key a") == 0
+    assert provider.try_acquire("model", "key b") == 0
+    assert provider.try_acquire("model", "key a") > 0
+
+
+def test_client_cache_is_bounded():
+    cache = ClientCache(max_size=2)
+    created = []
+
+    def client(name):
+        return lambda: created.append(name) or name
+
+    assert cache.get("a", client("a")) == "a"
+    assert cache.get("b", client("b")) == "b"
+    assert cache.get("a", client("a again")) == "a"
+    cache.get("c", client("c"))
+
+    assert len(cache) == 2
+    assert cache.get("b", client("b again")) == "b again"
+    assert created == ["a", "b", "c", "b again"]
+
+
+def test_embeddings_are_retried_and_reported_to_the_listeners():
+    provider = FakeProvider("primary", fail_times=1)
+    llm = LLMGateway({"primary": provider}, {"embedding": [("primary", "embed-model")]}, max_attempts=2)
+    reported = []
+    llm.listeners.append(lambda *call: reported.append(call[:4]))
+
+    first, second = llm.embed(["some query", "other query"], "embedding")
+    assert first == llm.embed(["some query"], "embedding")[0]
+    assert first != second
+    assert reported[0] == ("primary", "embed-model", 6, 0)
+    assert llm.stats()["primary"]["retries"] == 1
@@ -0,0 +1,227 @@
+"""
+Clerk token verification.
+
+JWKS_STORE keeps the Clerk signing keys in process memory so that verifying a
+token on the request path never does network I/O. Keys are refreshed when the
+TTL runs out (in the background, stale keys keep being served meanwhile) or
+when a token carries a kid we have not seen yet (key rotation).
+
+TOKEN_CACHE remembers the claims of tokens that already passed signature
+verification, keyed by a digest of the token, until the token's own exp. The
+frontend sends the same session token on every call, so most requests skip
+the RSA check entirely. Routes get the caller through the current_user_id
+dependency.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from dotenv import load_dotenv
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from jose import JWTError, jwk, jwt
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+clerk_jwks_url = os.getenv("CLERK_JWKS_URL")
+
+JWKS_TTL_SECONDS = int(os.getenv("JWKS_TTL_SECONDS", "3600"))
+# minimum gap between two refreshes caused by an unknown kid, so random kids
+# in forged tokens cannot turn into a fetch per request
+JWKS_MIN_REFRESH_INTERVAL = int(os.getenv("JWKS_MIN_REFRESH_INTERVAL", "30"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "2048"))
+# clock skew tolerated on nbf, same as what jose allows by default (none)
+TOKEN_LEEWAY_SECONDS = int(os.getenv("TOKEN_LEEWAY_SECONDS", "0"))
+
+security = HTTPBearer()
+
+
+class JWKSStore:
+    def __init__(self, jwks_url, ttl=JWKS_TTL_SECONDS, min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL):
+        self.jwks_url = jwks_url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self._keys = {}              # kid -> (jwk object, pem string)
+        self._fetched_at = 0.0
+        self._last_attempt = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def _fetch(self):
+        response = requests.get(self.jwks_url, timeout=5)
+        response.raise_for_status()
+        keys = {}
+        for key in response.json().get("keys", []):
+            public_key = jwk.construct(key)
+            keys[key["kid"]] = (public_key, public_key.to_pem().decode("utf-8"))
+        return keys
+
+    def refresh(self, force=False):
+        """Fetch the JWKS once, no matter how many callers ask at the same time."""
+        attempt_started = time.monotonic()
+        with self._lock:
+            # another caller refreshed while we were waiting for the lock
+            if not force and self._last_attempt >= attempt_started:
+                return
+            self._last_attempt = time.monotonic()
+            try:
+                keys = self._fetch()
+            except Exception as e:
+                logger.error("JWKS refresh failed: %s", e)
+                return
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh(force=True)
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _is_stale(self):
+        return time.monotonic() - self._fetched_at > self.ttl
+
+    def lookup(self, kid):
+        """Return (jwk, pem) from memory or None. Never blocks on the network."""
+        entry = self._keys.get(kid)
+        if entry is not None and self._is_stale():
+            self._refresh_in_background()
+        return entry
+
+    def needs_fetch(self, kid):
+        if kid in self._keys:
+            return False
+        return time.monotonic() - self._last_attempt >= self.min_refresh_interval or not self._keys
+
+    def get_key(self, kid):
+        entry = self.lookup(kid)
+        if entry is None and self.needs_fetch(kid):
+            self.refresh()
+            entry = self._keys.get(kid)
+        if entry is None:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        return entry
+
+    async def aget_key(self, kid):
+        """Same as get_key, but a fetch (cold start / rotation) runs off the event loop."""
+        entry = self.lookup(kid)
+        if entry is None and self.needs_fetch(kid):
+            await asyncio.to_thread(self.refresh)
+            entry = self._keys.get(kid)
+        if entry is None:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        return entry
+
+
+JWKS_STORE = JWKSStore(clerk_jwks_url)
+
+
+class TokenCache:
+    """Bounded LRU of verified claims keyed by sha256(token)."""
+
+    def __init__(self, max_size=TOKEN_CACHE_SIZE, leeway=TOKEN_LEEWAY_SECONDS):
+        self.max_size = max_size
+        self.leeway = leeway
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(token):
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def _usable(self, claims, now):
+        exp = claims.get("exp")
+        nbf = claims.get("nbf")
+        if exp is None or now >= exp + self.leeway:
+            return False
+        if nbf is not None and now < nbf - self.leeway:
+            return False
+        return True
+
+    def get(self, token):
+        key = self.digest(token)
+        with self._lock:
+            claims = self._entries.get(key)
+            if claims is None:
+                return None
+            if not self._usable(claims, time.time()):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return claims
+
+    def put(self, token, claims):
+        # tokens without exp are never cached, they must be re-verified
+        if claims.get("exp") is None:
+            return
+        key = self.digest(token)
+        with self._lock:
+            self._entries[key] = claims
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+TOKEN_CACHE = TokenCache()
+
+
+def _verify(token, pem):
+    unverified_claims = jwt.get_unverified_claims(token)
+    audience = unverified_claims.get('sub')
+    token_issuer = unverified_claims.get('iss')
+    return jwt.decode(token, pem, algorithms=['RS256'], audience=audience, issuer=token_issuer)
+
+
+def _kid(token):
+    try:
+        return jwt.get_unverified_headers(token)['kid']
+    except Exception:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+
+def decode_token(token: str):
+    claims = TOKEN_CACHE.get(token)
+    if claims is not None:
+        return claims
+    _, pem = JWKS_STORE.get_key(_kid(token))
+    claims = _verify(token, pem)
+    TOKEN_CACHE.put(token, claims)
+    return claims
+
+
+async def adecode_token(token: str):
+    claims = TOKEN_CACHE.get(token)
+    if claims is not None:
+        return claims
+    _, pem = await JWKS_STORE.aget_key(_kid(token))
+    claims = _verify(token, pem)
+    TOKEN_CACHE.put(token, claims)
+    return claims
+
+
+async def current_user_id(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
+    """FastAPI dependency returning the Clerk user id of the bearer token."""
+    try:
+        payload = await adecode_token(credentials.credentials)
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    user_id = payload.get('sub')
+    if not user_id:
+        raise HTTPException(status_code=401, detail="User ID not found in token")
+    return user_id
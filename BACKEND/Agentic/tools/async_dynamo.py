@@ -0,0 +1,48 @@
+"""
+Awaitable DynamoDB access for the FastAPI handlers.
+
+boto3 is blocking, so every call runs on a bounded thread pool sized like the
+botocore connection pool (DYNAMO_POOL_SIZE). The event loop keeps serving other
+requests while DynamoDB answers, and a burst of requests cannot spawn more
+in-flight calls than there are pooled connections.
+
+    from tools.async_dynamo import adb, aworkflows, ausers
+    item = await adb.get_item(TableName="users", Key=...)
+    await aworkflows.save_workflow(user_id, workflow_json)
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from . import user_store, workflow_store
+from .dynamo import DYNAMO_POOL_SIZE, db_client
+
+db_executor = ThreadPoolExecutor(max_workers=DYNAMO_POOL_SIZE, thread_name_prefix="dynamo")
+
+
+async def run_db(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, functools.partial(func, *args, **kwargs))
+
+
+class AsyncProxy:
+    """Exposes every callable attribute of `target` as a coroutine function running on db_executor."""
+
+    def __init__(self, target):
+        self._target = target
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            return await run_db(attr, *args, **kwargs)
+
+        return call
+
+
+adb = AsyncProxy(db_client)
+aworkflows = AsyncProxy(workflow_store)
+ausers = AsyncProxy(user_store)
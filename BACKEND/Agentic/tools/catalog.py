@@ -0,0 +1,187 @@
+"""
+In-memory tool catalog.
+
+/create_agents used to open and parse composio.json, custom_tools.json and
+user_made_custom.json on every call, and rebuilt each composio action
+description with globals() + inspect.signature. The executor repeated the
+same reflection for every tool node.
+
+ToolCatalog is an immutable snapshot holding the parsed files, the rendered
+description line of every composio action, the rendered custom tool lines and
+the parameter schema of every tool class method. TOOL_CATALOG.get() returns
+the current snapshot without touching the disk. A daemon thread polls the
+files' mtimes every TOOL_CATALOG_POLL_SECONDS and swaps in a new snapshot when
+one of them changed.
+"""
+
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+from . import tool_classes
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+CATALOG_FILES = ("composio.json", "custom_tools.json", "user_made_custom.json")
+TOOL_CATALOG_POLL_SECONDS = float(os.getenv("TOOL_CATALOG_POLL_SECONDS", "5"))
+
+# inputs: [{parameter: default}] including self, as shown to the LLM prompts.
+# params: inspect.Parameter tuple without self, used for argument binding
+ActionSignature = namedtuple("ActionSignature", ["inputs", "params"])
+
+
+def _tool_classes():
+    return {name: obj for name, obj in vars(tool_classes).items()
+            if isinstance(obj, type) and obj.__module__ == tool_classes.__name__}
+
+
+def _signature(method):
+    params = list(inspect.signature(method).parameters.values())
+    inputs = [{p.name: p.default if p.default is not inspect.Parameter.empty else None} for p in params]
+    return ActionSignature(inputs, tuple(params[1:]))
+
+
+def _reflect():
+    classes = _tool_classes()
+    signatures = {}
+    for class_name, cls in classes.items():
+        for action, method in vars(cls).items():
+            if callable(method) and not action.startswith("_"):
+                try:
+                    signatures[(class_name, action)] = _signature(method)
+                except (TypeError, ValueError):
+                    continue
+    return classes, signatures
+
+
+_reflected = None
+_reflect_lock = threading.Lock()
+
+
+def reflected():
+    """(tool classes, action signatures), computed once per process, the classes never change at runtime."""
+    global _reflected
+    if _reflected is None:
+        with _reflect_lock:
+            if _reflected is None:
+                _reflected = _reflect()
+    return _reflected
+
+
+def _tool_list(data):
+    # user_made_custom.json may be an empty object instead of a list
+    if isinstance(data, dict):
+        data = list(data.values())
+    return [tool for tool in data if isinstance(tool, dict) and "name" in tool]
+
+
+class ToolCatalog:
+    def __init__(self, composio, custom_tools, user_tools):
+        classes, signatures = reflected()
+        self.composio = MappingProxyType(composio)
+        self.custom_tools = tuple(custom_tools) + tuple(user_tools)
+        self.user_tools = tuple(user_tools)
+        self._classes = MappingProxyType({name.lower(): cls for name, cls in classes.items()})
+        self._signatures = MappingProxyType(signatures)
+
+        # major_tool_chain lists the user made tools by name and description
+        self.customs_prompt = "\n".join(f"{t['name']} : {t['description']}" for t in self.user_tools)
+
+        action_lines = {}
+        for tool, actions in composio.items():
+            cls = classes.get(tool.upper())
+            if cls is None:
+                continue
+            for action in actions:
+                name = action["action"]
+                signature = signatures.get((tool.upper(), name))
+                if signature is None:
+                    continue
+                action_lines[(tool.upper(), name.upper())] = \
+                    f"{name} -> input parameters and their explainations: {signature.inputs[1:]} , outputs: {action['output']}\n"
+        self._action_lines = MappingProxyType(action_lines)
+
+        other_lines = {}
+        for t in self.custom_tools:
+            other_lines[t["name"].upper()] = other_lines.get(t["name"].upper(), "") + \
+                f"{t['name']}:{t['description']}, inputs: {t['inputs']}, outputs: {t['outputs']}\n"
+        self._other_lines = MappingProxyType(other_lines)
+
+    def composio_block(self, tool, actions):
+        """'TOOL(Actions):-' followed by the description line of each known action."""
+        tool = tool.upper()
+        lines = [self._action_lines.get((tool, action.upper()), "") for action in actions]
+        return tool + "(Actions):-\n" + "".join(lines)
+
+    def other_block(self, name):
+        return self._other_lines.get(name.upper(), "")
+
+    def is_composio(self, tool):
+        return tool.upper() in self.composio
+
+    def tool_class(self, name):
+        return self._classes.get(name.lower())
+
+    def signature(self, class_name, action):
+        return self._signatures.get((class_name.upper(), action))
+
+
+def _read(directory, name):
+    with open(os.path.join(directory, name)) as f:
+        return json.load(f)
+
+
+def load_catalog(directory=TOOLS_DIR):
+    composio = _read(directory, "composio.json")
+    custom_tools = _tool_list(_read(directory, "custom_tools.json"))
+    user_tools = _tool_list(_read(directory, "user_made_custom.json"))
+    return ToolCatalog(composio, custom_tools, user_tools)
+
+
+class CatalogStore:
+    def __init__(self, directory=TOOLS_DIR, poll_seconds=TOOL_CATALOG_POLL_SECONDS):
+        self.directory = directory
+        self.poll_seconds = poll_seconds
+        self._catalog = None
+        self._mtimes = None
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    def _current_mtimes(self):
+        return tuple(os.stat(os.path.join(self.directory, name)).st_mtime_ns for name in CATALOG_FILES)
+
+    def reload(self, force=False):
+        with self._lock:
+            mtimes = self._current_mtimes()
+            if not force and mtimes == self._mtimes:
+                return False
+            catalog = load_catalog(self.directory)
+            self._catalog, self._mtimes = catalog, mtimes
+        logging.info("Tool catalog loaded from %s", self.directory)
+        return True
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_seconds)
+            try:
+                self.reload()
+            except Exception as e:
+                # a half written file: keep serving the previous snapshot
+                logging.error("Tool catalog reload failed: %s", e)
+
+    def get(self):
+        if self._catalog is None:
+            self.reload(force=True)
+        if self._watcher is None and self.poll_seconds > 0:
+            with self._lock:
+                if self._watcher is None:
+                    self._watcher = threading.Thread(target=self._watch, daemon=True)
+                    self._watcher.start()
+        return self._catalog
+
+
+TOOL_CATALOG = CatalogStore()
@@ -1,14 +1,23 @@
 import boto3
+from botocore.config import Config
 from dotenv import load_dotenv  
 import os
 load_dotenv()
 
+# size of the thread pool in tools.async_dynamo; the HTTP pool must be at least
+# as large or threads queue for a connection inside botocore (default is 10)
+DYNAMO_POOL_SIZE = int(os.getenv("DYNAMO_POOL_SIZE", "32"))
+
 
 os.environ['AWS_ACCESS_KEY_ID'] = os.getenv("AWS_ACCESS_KEY_ID")
 os.environ['AWS_SECRET_ACCESS_KEY'] = os.getenv("AWS_SECRET_ACCESS_KEY")
 
 try:
-    db_client = boto3.client("dynamodb",region_name='us-east-1')
+    db_client = boto3.client(
+        "dynamodb",
+        region_name='us-east-1',
+        config=Config(max_pool_connections=DYNAMO_POOL_SIZE, retries={"max_attempts": 3, "mode": "adaptive"}),
+    )
     print("success dynamo")
 except ConnectionError as e:
     raise ConnectionError(f"Failed to connect to DynamoDB: {str(e)}")
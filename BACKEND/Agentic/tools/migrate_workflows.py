@@ -0,0 +1,129 @@
+"""
+One-off migration of workflows from the `workflows` map of every users item to
+the dedicated workflows table.
+
+    cd Agentic
+    python -m tools.migrate_workflows --dry-run
+    python -m tools.migrate_workflows
+    python -m tools.migrate_workflows --remove-old   # also drop users.workflows
+
+Safe to re-run: every item is put with attribute_not_exists(workflow_id), so
+a workflow that is already in the new table (and may have been edited there
+since) is left alone. users.workflows of a user is only removed when every one
+of the user's workflows was copied or already there; users with skipped
+(invalid json) entries are listed at the end and keep their old map.
+"""
+
+import argparse
+import json
+import time
+
+from .dynamo import db_client
+from .user_store import invalidate_user
+from .workflow_store import WORKFLOWS_TABLE, dump_workflow, ensure_workflows_table, summary_attributes
+
+
+def scan_users():
+    kwargs = {
+        "TableName": "users",
+        "ProjectionExpression": "clerk_id, workflows",
+    }
+    while True:
+        response = db_client.scan(**kwargs)
+        yield from response.get("Items", [])
+        if "LastEvaluatedKey" not in response:
+            return
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def to_item(user_id, workflow_id, entry):
+    entry = entry.get("M", {})
+    try:
+        workflow_json = json.loads(entry.get("json", {}).get("S", "{}"))
+    except json.JSONDecodeError:
+        print(f"  skipping {workflow_id}: invalid json")
+        return None
+    workflow_json.setdefault("workflow_id", workflow_id)
+    item = {
+        "clerk_id": {"S": user_id},
+        "workflow_id": {"S": workflow_id},
+        "json": {"S": dump_workflow(workflow_json)},
+        "prompt": {"S": entry.get("prompt", {}).get("S", "")},
+        **summary_attributes(workflow_json),
+    }
+    if "public" in entry:
+        item["public"] = {"BOOL": entry["public"].get("BOOL", False)}
+    trigger = (workflow_json.get("trigger") or {}).get("name")
+    if workflow_json.get("active", False) and trigger:
+        item["active_trigger"] = {"S": trigger}
+    return item
+
+
+def put_new(item, attempts=8):
+    """Write item unless the workflow is already in the table. True when it was written."""
+    delay = 0.1
+    for attempt in range(attempts):
+        try:
+            db_client.put_item(
+                TableName=WORKFLOWS_TABLE,
+                Item=item,
+                ConditionExpression="attribute_not_exists(workflow_id)",
+            )
+            return True
+        except db_client.exceptions.ConditionalCheckFailedException:
+            return False
+        except db_client.exceptions.ProvisionedThroughputExceededException:
+            # the client's own retries gave up, back off before the next round
+            if attempt == attempts - 1:
+                raise
+            time.sleep(delay)
+            delay = min(delay * 2, 5)
+
+
+def migrate(dry_run=False, remove_old=False):
+    if not dry_run:
+        ensure_workflows_table()
+    users = workflows = existing = 0
+    incomplete = []
+    for user in scan_users():
+        user_id = user["clerk_id"]["S"]
+        entries = user.get("workflows", {}).get("M", {})
+        if not entries:
+            continue
+        users += 1
+        print(f"{user_id}: {len(entries)} workflows")
+        items = [to_item(user_id, wid, entry) for wid, entry in entries.items()]
+        items = [item for item in items if item is not None]
+        skipped = len(entries) - len(items)
+        if skipped:
+            incomplete.append(user_id)
+        if dry_run:
+            workflows += len(items)
+            continue
+        # one conditional put per workflow, batch_write_item has no conditions
+        for item in items:
+            if put_new(item):
+                workflows += 1
+            else:
+                existing += 1
+        if remove_old and skipped:
+            print(f"  keeping users.workflows of {user_id}: {skipped} workflows were skipped")
+        elif remove_old:
+            db_client.update_item(
+                TableName="users",
+                Key={"clerk_id": {"S": user_id}},
+                UpdateExpression="REMOVE workflows",
+            )
+            invalidate_user(user_id)
+    print(f"{'would migrate' if dry_run else 'migrated'} {workflows} workflows of {users} users"
+          + (f", {existing} were already in {WORKFLOWS_TABLE}" if existing else ""))
+    if incomplete:
+        print(f"users with skipped workflows ({len(incomplete)}): {', '.join(incomplete)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move workflows out of the users table")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be copied")
+    parser.add_argument("--remove-old", action="store_true", help="remove users.workflows after copying")
+    args = parser.parse_args()
+    migrate(dry_run=args.dry_run, remove_old=args.remove_old)
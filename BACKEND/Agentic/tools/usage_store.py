@@ -0,0 +1,103 @@
+"""
+Usage table: LLM token and cost counters.
+
+One item per (clerk_id, usage_key), usage_key being one of
+
+    <YYYY-MM>#total
+    <YYYY-MM>#wf#<workflow id>
+    <YYYY-MM>#wf#<workflow id>#node#<node id>
+
+each with the numeric attributes in COUNTERS. Writers only ever ADD to
+them, so the api and every celery worker can flush concurrently without
+overwriting each other. The users item's token_count gets the all time total
+the same way, only if the users item exists.
+"""
+
+from .dynamo import db_client
+from .user_store import USERS_TABLE
+
+USAGE_TABLE = "usage"
+COUNTERS = ("prompt_tokens", "completion_tokens", "calls", "latency_ms", "cost_micro_usd")
+
+
+def ensure_usage_table():
+    existing_tables = db_client.list_tables()['TableNames']
+    if USAGE_TABLE in existing_tables:
+        return
+    db_client.create_table(
+        TableName=USAGE_TABLE,
+        KeySchema=[
+            {'AttributeName': 'clerk_id', 'KeyType': 'HASH'},
+            {'AttributeName': 'usage_key', 'KeyType': 'RANGE'},
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'clerk_id', 'AttributeType': 'S'},
+            {'AttributeName': 'usage_key', 'AttributeType': 'S'},
+        ],
+        BillingMode='PAY_PER_REQUEST',
+    )
+    print(f"Table '{USAGE_TABLE}' is being created...")
+    db_client.get_waiter('table_exists').wait(TableName=USAGE_TABLE)
+    print(f"Table '{USAGE_TABLE}' is now available")
+
+
+def add_usage(user_id, usage_key, counters):
+    """Atomically add counters ({name: int}) to one usage item, creating it if needed."""
+    names = {f"#c{i}": name for i, name in enumerate(counters)}
+    values = {f":c{i}": {"N": str(int(value))} for i, value in enumerate(counters.values())}
+    db_client.update_item(
+        TableName=USAGE_TABLE,
+        Key={"clerk_id": {"S": user_id}, "usage_key": {"S": usage_key}},
+        UpdateExpression="ADD " + ", ".join(f"{name} {value}" for name, value in zip(names, values)),
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values,
+    )
+
+
+def add_token_count(user_id, tokens):
+    """
+    Add to the users item's token_count, returns False if there is no users
+    item: an upsert would leave one without plan or api_key, which /checkuser
+    then takes for an initialized user.
+    """
+    try:
+        db_client.update_item(
+            TableName=USERS_TABLE,
+            Key={"clerk_id": {"S": user_id}},
+            UpdateExpression="ADD token_count :t",
+            ConditionExpression="attribute_exists(clerk_id)",
+            ExpressionAttributeValues={":t": {"N": str(int(tokens))}},
+        )
+    except db_client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+
+def _counters(item):
+    return {name: int(item[name]["N"]) for name in COUNTERS if name in item}
+
+
+def get_total(user_id, period):
+    """Counters of a user's `<period>#total` item, {} when nothing was used."""
+    response = db_client.get_item(
+        TableName=USAGE_TABLE,
+        Key={"clerk_id": {"S": user_id}, "usage_key": {"S": f"{period}#total"}},
+    )
+    return _counters(response.get("Item", {}))
+
+
+def list_usage(user_id, period):
+    """{usage_key: counters} of every usage item of a user in a period."""
+    usage = {}
+    kwargs = dict(
+        TableName=USAGE_TABLE,
+        KeyConditionExpression="clerk_id = :u AND begins_with(usage_key, :p)",
+        ExpressionAttributeValues={":u": {"S": user_id}, ":p": {"S": f"{period}#"}},
+    )
+    while True:
+        response = db_client.query(**kwargs)
+        for item in response.get("Items", []):
+            usage[item["usage_key"]["S"]] = _counters(item)
+        if "LastEvaluatedKey" not in response:
+            return usage
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
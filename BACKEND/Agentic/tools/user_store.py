@@ -0,0 +1,122 @@
+"""
+Read access to the `users` table.
+
+Two cache tiers sit in front of DynamoDB:
+- UserScope: lives for one request / one workflow run, so a handler or the
+  executor reads a user's record at most once no matter how many nodes need it.
+- a short-TTL process cache shared by all requests of this process. Writes to
+  the users table must call invalidate_user(). Other processes (celery workers,
+  other uvicorn workers) only see a change once their own TTL runs out.
+
+Only the attributes asked for are read (ProjectionExpression).
+"""
+
+import os
+import threading
+import time
+
+from .dynamo import db_client
+
+USERS_TABLE = "users"
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))
+
+_process_cache = {}          # user_id -> (expires_at, item, loaded attribute names)
+_process_lock = threading.Lock()
+
+
+def _fetch(user_id, attributes):
+    names = {f"#a{i}": attr for i, attr in enumerate(sorted(attributes))}
+    response = db_client.get_item(
+        TableName=USERS_TABLE,
+        Key={"clerk_id": {"S": user_id}},
+        ProjectionExpression=", ".join(names.keys()),
+        ExpressionAttributeNames=names,
+    )
+    return response.get("Item")
+
+
+def _from_process_cache(user_id, attributes):
+    with _process_lock:
+        entry = _process_cache.get(user_id)
+        if entry is None:
+            return None
+        expires_at, item, loaded = entry
+        if time.monotonic() >= expires_at:
+            del _process_cache[user_id]
+            return None
+        if not attributes <= loaded:
+            return None
+        return item
+
+
+def _store_process_cache(user_id, item, attributes):
+    with _process_lock:
+        entry = _process_cache.get(user_id)
+        now = time.monotonic()
+        if entry is not None and now < entry[0]:
+            merged = {**entry[1], **item}
+            loaded = entry[2] | attributes
+        else:
+            merged, loaded = dict(item), set(attributes)
+        _process_cache[user_id] = (now + USER_CACHE_TTL, merged, loaded)
+
+
+def invalidate_user(user_id):
+    with _process_lock:
+        _process_cache.pop(user_id, None)
+
+
+class UserScope:
+    """Request / run scoped cache of user records."""
+
+    def __init__(self):
+        self._items = {}     # user_id -> (item, loaded attribute names)
+
+    def get(self, user_id, attributes):
+        entry = self._items.get(user_id)
+        if entry is not None and attributes <= entry[1]:
+            return entry[0]
+        return None
+
+    def put(self, user_id, item, attributes):
+        entry = self._items.get(user_id)
+        if entry is not None:
+            self._items[user_id] = ({**entry[0], **item}, entry[1] | attributes)
+        else:
+            self._items[user_id] = (dict(item), set(attributes))
+
+    def invalidate(self, user_id):
+        self._items.pop(user_id, None)
+
+
+def get_user(user_id, attributes, scope=None):
+    """
+    Return the raw DynamoDB item of a user restricted to `attributes`, or None
+    if the user does not exist. Missing attributes are simply absent.
+    """
+    attributes = set(attributes)
+    if scope is not None:
+        item = scope.get(user_id, attributes)
+        if item is not None:
+            return item
+    item = _from_process_cache(user_id, attributes)
+    if item is None:
+        item = _fetch(user_id, attributes)
+        if item is None:
+            return None
+        _store_process_cache(user_id, item, attributes)
+    if scope is not None:
+        scope.put(user_id, item, attributes)
+    return item
+
+
+def get_plan_and_api_keys(user_id, scope=None):
+    """(plan, {provider: key}) for a user, ("", {}) when the user is unknown."""
+    item = get_user(user_id, ["plan", "api_key"], scope) or {}
+    plan = item.get("plan", {}).get("S", "")
+    api_keys = {k: v["S"] for k, v in item.get("api_key", {}).get("M", {}).items()}
+    return plan, api_keys
+
+
+def get_api_keys(user_id, scope=None):
+    return get_plan_and_api_keys(user_id, scope)[1]
@@ -0,0 +1,208 @@
+"""
+Workflows table.
+
+Every workflow is its own item keyed by (clerk_id, workflow_id) instead of an
+entry of the `workflows` map inside the user's item, so reading or writing one
+workflow never touches the others and a user is no longer capped by the 400 KB
+item limit.
+
+`active_trigger` is only present while a workflow is active and holds the
+trigger name (e.g. TRIGGER_NEW_GMAIL_MESSAGE). The sparse GSI on
+(clerk_id, active_trigger) lets trigger webhooks find exactly the workflows
+they have to start.
+
+workflow_name, active and trigger are copied out of the json at write time so
+listings can read them with a projection instead of parsing every workflow.
+"""
+
+import base64
+import json
+
+from .dynamo import db_client
+
+WORKFLOWS_TABLE = "workflows"
+ACTIVE_TRIGGER_INDEX = "active_trigger-index"
+SUMMARY_ATTRIBUTES = ["workflow_id", "workflow_name", "active", "public", "trigger", "prompt"]
+
+
+def dump_workflow(workflow_json):
+    return json.dumps(workflow_json, separators=(",", ":"))
+
+
+def ensure_workflows_table():
+    existing_tables = db_client.list_tables()['TableNames']
+    if WORKFLOWS_TABLE in existing_tables:
+        return
+    db_client.create_table(
+        TableName=WORKFLOWS_TABLE,
+        KeySchema=[
+            {'AttributeName': 'clerk_id', 'KeyType': 'HASH'},
+            {'AttributeName': 'workflow_id', 'KeyType': 'RANGE'},
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'clerk_id', 'AttributeType': 'S'},
+            {'AttributeName': 'workflow_id', 'AttributeType': 'S'},
+            {'AttributeName': 'active_trigger', 'AttributeType': 'S'},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                'IndexName': ACTIVE_TRIGGER_INDEX,
+                'KeySchema': [
+                    {'AttributeName': 'clerk_id', 'KeyType': 'HASH'},
+                    {'AttributeName': 'active_trigger', 'KeyType': 'RANGE'},
+                ],
+                'Projection': {'ProjectionType': 'ALL'},
+            }
+        ],
+        BillingMode='PAY_PER_REQUEST',
+    )
+    print(f"Table '{WORKFLOWS_TABLE}' is being created...")
+    db_client.get_waiter('table_exists').wait(TableName=WORKFLOWS_TABLE)
+    print(f"Table '{WORKFLOWS_TABLE}' is now available")
+
+
+def _active_trigger(workflow_json):
+    if not workflow_json.get("active", False):
+        return None
+    return (workflow_json.get("trigger") or {}).get("name")
+
+
+def summary_attributes(workflow_json):
+    """Top-level attributes derived from the workflow json."""
+    return {
+        'workflow_name': {'S': workflow_json.get("workflow_name", "")},
+        'active': {'BOOL': bool(workflow_json.get("active", False))},
+        'trigger': {'S': (workflow_json.get("trigger") or {}).get("name", "")},
+    }
+
+
+def _json_update(workflow_json):
+    """UpdateExpression parts writing the workflow json and the attributes derived from it."""
+    sets = ["#json = :json"]
+    removes = []
+    values = {':json': {'S': dump_workflow(workflow_json)}}
+    for name, value in summary_attributes(workflow_json).items():
+        sets.append(f"#{name} = :{name}")
+        values[f':{name}'] = value
+    trigger = _active_trigger(workflow_json)
+    if trigger:
+        sets.append("active_trigger = :trigger")
+        values[':trigger'] = {'S': trigger}
+    else:
+        removes.append("active_trigger")
+    return sets, removes, values
+
+
+def save_workflow(user_id, workflow_json, prompt=None):
+    """Create or update a workflow. The stored prompt is kept when prompt is None."""
+    sets, removes, values = _json_update(workflow_json)
+    if prompt is not None:
+        sets.append("prompt = :prompt")
+        values[':prompt'] = {'S': prompt}
+    expression = "SET " + ", ".join(sets)
+    if removes:
+        expression += " REMOVE " + ", ".join(removes)
+    return db_client.update_item(
+        TableName=WORKFLOWS_TABLE,
+        Key={'clerk_id': {'S': user_id}, 'workflow_id': {'S': workflow_json["workflow_id"]}},
+        UpdateExpression=expression,
+        ExpressionAttributeNames={'#json': 'json', **{f"#{name}": name for name in ("workflow_name", "active", "trigger")}},
+        ExpressionAttributeValues=values,
+    )
+
+
+def set_public(user_id, workflow_id, public=True):
+    return db_client.update_item(
+        TableName=WORKFLOWS_TABLE,
+        Key={'clerk_id': {'S': user_id}, 'workflow_id': {'S': workflow_id}},
+        UpdateExpression="SET #pub = :is_public",
+        ExpressionAttributeNames={'#pub': 'public'},
+        ExpressionAttributeValues={':is_public': {'BOOL': public}},
+    )
+
+
+def delete_workflow(user_id, workflow_id):
+    """Delete a workflow, returns False if it did not exist."""
+    try:
+        db_client.delete_item(
+            TableName=WORKFLOWS_TABLE,
+            Key={'clerk_id': {'S': user_id}, 'workflow_id': {'S': workflow_id}},
+            ConditionExpression="attribute_exists(workflow_id)",
+        )
+    except db_client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+
+def _query_all(**kwargs):
+    while True:
+        response = db_client.query(**kwargs)
+        yield from response.get("Items", [])
+        if "LastEvaluatedKey" not in response:
+            return
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def list_workflows(user_id):
+    """All raw workflow items of a user."""
+    return list(_query_all(
+        TableName=WORKFLOWS_TABLE,
+        KeyConditionExpression="clerk_id = :uid",
+        ExpressionAttributeValues={':uid': {'S': user_id}},
+    ))
+
+
+def encode_cursor(last_evaluated_key):
+    if not last_evaluated_key:
+        return None
+    raw = json.dumps(last_evaluated_key, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+
+
+def list_workflow_summaries(user_id, limit=50, cursor=None):
+    """
+    One page of a user's workflows without their json.
+    Returns (items, next_cursor); next_cursor is None on the last page.
+    """
+    names = {f"#{name}": name for name in SUMMARY_ATTRIBUTES}
+    kwargs = {
+        "TableName": WORKFLOWS_TABLE,
+        "KeyConditionExpression": "clerk_id = :uid",
+        "ExpressionAttributeValues": {':uid': {'S': user_id}},
+        "ProjectionExpression": ", ".join(names.keys()),
+        "ExpressionAttributeNames": names,
+        "Limit": limit,
+    }
+    start_key = decode_cursor(cursor)
+    if start_key:
+        if not isinstance(start_key, dict) or start_key.get("clerk_id", {}).get("S") != user_id:
+            raise ValueError("cursor does not belong to this user")
+        kwargs["ExclusiveStartKey"] = start_key
+    response = db_client.query(**kwargs)
+    return response.get("Items", []), encode_cursor(response.get("LastEvaluatedKey"))
+
+
+def get_workflow(user_id, workflow_id):
+    """Raw workflow item or None."""
+    response = db_client.get_item(
+        TableName=WORKFLOWS_TABLE,
+        Key={'clerk_id': {'S': user_id}, 'workflow_id': {'S': workflow_id}},
+    )
+    return response.get("Item")
+
+
+def active_workflows(user_id, trigger_name):
+    """[(workflow_id, workflow json dict)] of the user's active workflows for a trigger."""
+    items = _query_all(
+        TableName=WORKFLOWS_TABLE,
+        IndexName=ACTIVE_TRIGGER_INDEX,
+        KeyConditionExpression="clerk_id = :uid AND active_trigger = :trigger",
+        ExpressionAttributeValues={':uid': {'S': user_id}, ':trigger': {'S': trigger_name}},
+    )
+    return [(item["workflow_id"]["S"], json.loads(item["json"]["S"])) for item in items]
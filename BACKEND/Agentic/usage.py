@@ -0,0 +1,211 @@
+"""
+LLM token and cost accounting per user, workflow and node.
+
+Every call answered by llm_gateway.GATEWAY is reported to USAGE.record with
+its token counts and latency. Who the call belongs to comes from
+usage_context(), which the api handlers and the executor set around their
+work:
+
+    with usage_context(user_id=user_id, workflow_id=wid):
+        with usage_context(node=agent_id):
+            ...   # LLM calls in here, also from threads started by asyncio.to_thread
+
+Counters are summed in memory and flushed every USAGE_FLUSH_SECONDS (and at
+exit) as one ADD per (user, usage key) to the usage table, see
+tools/usage_store.py, and one ADD per user to its token_count. The two
+writes are pending separately: a failed one is merged back and retried on
+the next flush without repeating the one that succeeded.
+
+Plans can have a monthly token quota (USAGE_TOKEN_QUOTAS, json
+{plan: tokens}, plans not listed are unlimited, a user without a plan
+counts as "free"). check_quota() is called
+before a workflow run starts.
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from llm_gateway import GATEWAY
+from tools import usage_store
+
+USAGE_FLUSH_SECONDS = float(os.getenv("USAGE_FLUSH_SECONDS", "10"))
+USAGE_TOKEN_QUOTAS = json.loads(os.getenv("USAGE_TOKEN_QUOTAS", '{"free": 1000000}'))
+
+# USD per million (prompt, completion) tokens
+MODEL_PRICES = {
+    "gemini-1.5-flash": (0.075, 0.30),
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gemini-2.0-flash-lite": (0.075, 0.30),
+    "deepseek-chat": (0.27, 1.10),
+}
+
+# calls made outside of any user's request or run
+UNATTRIBUTED = "_unattributed"
+GENERATION = "generation"
+
+_usage_context = contextvars.ContextVar("llm_usage_context", default={})
+
+
+@contextmanager
+def usage_context(**fields):
+    """Attribute the LLM calls made inside the block to user_id / workflow_id / node."""
+    token = _usage_context.set({**_usage_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _usage_context.reset(token)
+
+
+def period(timestamp=None):
+    return time.strftime("%Y-%m", time.gmtime(timestamp))
+
+
+def cost_micro_usd(model, prompt_tokens, completion_tokens):
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0, 0))
+    return round(prompt_tokens * prompt_price + completion_tokens * completion_price)
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+class UsageRecorder:
+    def __init__(self, flush_seconds=USAGE_FLUSH_SECONDS):
+        self.flush_seconds = flush_seconds
+        self._pending = {}           # (user_id, usage_key) -> Counter
+        self._pending_tokens = Counter()    # user_id -> tokens not added to token_count yet
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def record(self, provider, model, prompt_tokens, completion_tokens, seconds):
+        """GATEWAY listener."""
+        context = _usage_context.get()
+        user_id = context.get("user_id") or UNATTRIBUTED
+        current = period()
+        keys = [f"{current}#total"]
+        workflow_id = context.get("workflow_id")
+        if workflow_id:
+            keys.append(f"{current}#wf#{workflow_id}")
+            if context.get("node") is not None:
+                keys.append(f"{current}#wf#{workflow_id}#node#{context['node']}")
+        counters = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "calls": 1,
+            "latency_ms": int(seconds * 1000),
+            "cost_micro_usd": cost_micro_usd(model, prompt_tokens, completion_tokens),
+        }
+        with self._lock:
+            for key in keys:
+                self._pending.setdefault((user_id, key), Counter()).update(counters)
+            if user_id != UNATTRIBUTED:
+                self._pending_tokens[user_id] += prompt_tokens + completion_tokens
+        self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        if self._flusher is not None or self.flush_seconds <= 0:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run, daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            pending_tokens, self._pending_tokens = self._pending_tokens, Counter()
+        failed = {}
+        for (user_id, key), counters in pending.items():
+            try:
+                usage_store.add_usage(user_id, key, counters)
+            except Exception as e:
+                logging.error("Usage flush failed for %s %s: %s", user_id, key, e)
+                failed[(user_id, key)] = counters
+        failed_tokens = Counter()
+        for user_id, tokens in pending_tokens.items():
+            if not tokens:
+                continue
+            try:
+                if not usage_store.add_token_count(user_id, tokens):
+                    # not retried, the usage items above still count these tokens
+                    logging.warning("No users item for %s, %s tokens not added to token_count", user_id, tokens)
+            except Exception as e:
+                logging.error("Token count flush failed for %s: %s", user_id, e)
+                failed_tokens[user_id] = tokens
+        if failed or failed_tokens:
+            with self._lock:
+                for key, counters in failed.items():
+                    self._pending.setdefault(key, Counter()).update(counters)
+                self._pending_tokens.update(failed_tokens)
+
+    def pending(self, user_id):
+        """{usage_key: counters} recorded by this process and not flushed yet."""
+        with self._lock:
+            return {key: dict(counters) for (user, key), counters in self._pending.items() if user == user_id}
+
+
+USAGE = UsageRecorder()
+GATEWAY.listeners.append(USAGE.record)
+
+
+def _merged(stored, pending):
+    merged = {key: Counter(counters) for key, counters in stored.items()}
+    for key, counters in pending.items():
+        merged.setdefault(key, Counter()).update(counters)
+    return {key: dict(counters) for key, counters in merged.items()}
+
+
+def _tokens(counters):
+    return counters.get("prompt_tokens", 0) + counters.get("completion_tokens", 0)
+
+
+def quota_status(user_id, plan, current=None):
+    """{period, used, quota, remaining} of the user's monthly token quota, quota None when unlimited."""
+    current = current or period()
+    key = f"{current}#total"
+    total = _merged({key: usage_store.get_total(user_id, current)}, USAGE.pending(user_id)).get(key, {})
+    used = _tokens(total)
+    quota = USAGE_TOKEN_QUOTAS.get(plan or "free")
+    return {"period": current, "used": used, "quota": quota,
+            "remaining": None if quota is None else max(0, quota - used)}
+
+
+def check_quota(user_id, plan):
+    """Raise QuotaExceeded when the user's plan quota for this month is used up."""
+    status = quota_status(user_id, plan)
+    if status["quota"] is not None and status["remaining"] <= 0:
+        raise QuotaExceeded(f"The {plan or 'free'} plan's {status['quota']} LLM tokens for {status['period']} are used up.")
+    return status
+
+
+def usage_report(user_id, plan, current=None):
+    """Usage of a month: total, per workflow and per node, plus the quota."""
+    current = current or period()
+    usage = _merged(usage_store.list_usage(user_id, current),
+                    {k: v for k, v in USAGE.pending(user_id).items() if k.startswith(f"{current}#")})
+    report = {"period": current, "total": {}, "workflows": {}}
+    for key, counters in usage.items():
+        parts = key.split("#")[1:]
+        if parts == ["total"]:
+            report["total"] = counters
+        elif len(parts) == 2 and parts[0] == "wf":
+            report["workflows"].setdefault(parts[1], {"nodes": {}}).update(counters)
+        elif len(parts) == 4 and parts[0] == "wf" and parts[2] == "node":
+            report["workflows"].setdefault(parts[1], {"nodes": {}})["nodes"][parts[3]] = counters
+    quota = USAGE_TOKEN_QUOTAS.get(plan or "free")
+    used = _tokens(report["total"])
+    report["quota"] = {"quota": quota, "used": used, "remaining": None if quota is None else max(0, quota - used)}
+    return report
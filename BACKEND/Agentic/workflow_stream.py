@@ -0,0 +1,89 @@
+"""
+Helpers for the streaming generation endpoints (/create_agents/stream,
+/refine_query/stream).
+
+The endpoints answer with server-sent events:
+
+    event: stage   {"stage": "tools_selected" | "trigger_chosen" | ..., ...}
+    event: token   {"text": "<partial model output>"}
+    event: node    one agent of the workflow, as soon as its json is complete
+    event: done    {"response": ...} the same body as the non streaming endpoint
+    event: error   {"detail": "..."}
+
+NodeStreamParser is fed the model output chunk by chunk and returns every
+object of the top level "workflow" array once its closing brace arrived, so
+the frontend can draw the first nodes while the rest is still generated.
+"""
+
+import json
+
+
+def sse(event, data):
+    """One server-sent event, data is sent as a single json line."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+class NodeStreamParser:
+    """
+    Incremental scanner over a json document (code fences around it are
+    ignored). Each character is looked at once, feed() is O(len(chunk)).
+    """
+
+    def __init__(self, array_key="workflow"):
+        self.array_key = array_key
+        self.text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._string_start = None
+        self._last_string = None
+        self._array_depth = None     # depth inside the workflow array
+        self._node_start = None
+        self._doc_start = None
+        self._doc_end = None
+
+    def feed(self, chunk):
+        """Add chunk, return the workflow nodes completed by it."""
+        self.text += chunk
+        nodes = []
+        text = self.text
+        while self._pos < len(text) and self._doc_end is None:
+            i = self._pos
+            char = text[i]
+            self._pos += 1
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_string = text[self._string_start:i]
+                continue
+            if self._doc_start is None:
+                # preamble / ```json fence before the document
+                if char == "{":
+                    self._doc_start = i
+                    self._depth = 1
+                continue
+            if char == '"':
+                self._in_string = True
+                self._string_start = i + 1
+            elif char in "{[":
+                if char == "[" and self._depth == 1 and self._last_string == self.array_key:
+                    self._array_depth = 2
+                elif char == "{" and self._array_depth is not None and self._depth == self._array_depth:
+                    self._node_start = i
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if char == "}" and self._node_start is not None and self._depth == self._array_depth:
+                    nodes.append(json.loads(text[self._node_start:i + 1]))
+                    self._node_start = None
+                elif char == "]" and self._array_depth is not None and self._depth == self._array_depth - 1:
+                    self._array_depth = None
+                elif self._depth == 0:
+                    self._doc_end = i + 1
+        return nodes
@@ -0,0 +1,175 @@
+"""
+One redis subscriber per api process for the /ws endpoint.
+
+The executor publishes node events on `workflow_<user id>`. Instead of a
+redis connection and subscription per websocket, WS_HUB pattern-subscribes
+once to `workflow_*` and hands every message to the sockets of that user:
+
+    async with WS_HUB.subscribe(user_id) as subscription:
+        while True:
+            await websocket.send_json(await subscription.get())
+
+Every socket has its own bounded buffer (WS_QUEUE_SIZE) so a slow client
+cannot hold up the others or grow memory without limit:
+
+- coalesce: an unsent event of the same workflow node is replaced by the
+  newer one (an iterator node publishes once per element, a slow client
+  gets the latest)
+- drop: when the buffer is still full, the oldest event is dropped
+
+Leaving the `async with` (disconnect, error, cancellation) removes the
+socket from the hub. The subscriber starts with the first socket and
+reconnects to redis with a backoff when the connection is lost.
+"""
+
+import asyncio
+import itertools
+import logging
+import os
+from collections import OrderedDict, defaultdict
+from contextlib import asynccontextmanager
+
+from redis.asyncio import Redis
+
+from event_payload import decode
+
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "256"))
+WS_CHANNEL_PREFIX = "workflow_"
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """Bounded, coalescing buffer of the events for one socket."""
+
+    def __init__(self, user_id, maxsize=WS_QUEUE_SIZE):
+        self.user_id = user_id
+        self.maxsize = maxsize
+        self.dropped = 0
+        self.coalesced = 0
+        self._events = OrderedDict()     # coalesce key -> event
+        self._ready = asyncio.Event()
+        self._unique = itertools.count()
+
+    def _key(self, event):
+        if isinstance(event, dict) and event.get("node") is not None:
+            return (event.get("workflow_id"), event["node"])
+        return next(self._unique)
+
+    def put(self, event):
+        key = self._key(event)
+        if key in self._events:
+            # keep the order of arrival: the newer event goes to the end
+            del self._events[key]
+            self.coalesced += 1
+        elif len(self._events) >= self.maxsize:
+            self._events.popitem(last=False)
+            self.dropped += 1
+        self._events[key] = event
+        self._ready.set()
+
+    async def get(self):
+        while not self._events:
+            self._ready.clear()
+            await self._ready.wait()
+        return self._events.popitem(last=False)[1]
+
+    def __len__(self):
+        return len(self._events)
+
+
+class WorkflowHub:
+    def __init__(self, pattern=WS_CHANNEL_PREFIX + "*", queue_size=WS_QUEUE_SIZE, redis_factory=None):
+        self.pattern = pattern
+        self.queue_size = queue_size
+        self._redis_factory = redis_factory or (lambda: Redis(host="localhost", port=6379, db=0))
+        self._subscriptions = defaultdict(set)     # user id -> {Subscription}
+        self._listener = None
+        self._stats = {"received": 0, "delivered": 0, "dropped": 0, "coalesced": 0, "reconnects": 0}
+
+    def _start(self):
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        backoff = 0.5
+        while True:
+            redis = self._redis_factory()
+            pubsub = redis.pubsub()
+            try:
+                await pubsub.psubscribe(self.pattern)
+                backoff = 0.5
+                async for message in pubsub.listen():
+                    if message["type"] == "pmessage":
+                        self.dispatch(message["channel"], message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("ws hub lost redis, reconnecting in %.1fs: %s", backoff, e)
+                self._stats["reconnects"] += 1
+            finally:
+                try:
+                    await pubsub.aclose()
+                    await redis.aclose()
+                except Exception:
+                    pass
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+    def dispatch(self, channel, data):
+        """Hand one published message (an event or an {"events": [...]} batch) to the sockets of its user."""
+        self._stats["received"] += 1
+        if isinstance(channel, bytes):
+            channel = channel.decode()
+        subscriptions = self._subscriptions.get(channel[len(WS_CHANNEL_PREFIX):])
+        if not subscriptions:
+            return
+        try:
+            message = decode(data)
+        except ValueError:
+            logger.error("ws hub: invalid message on %s", channel)
+            return
+        events = message["events"] if isinstance(message, dict) and "events" in message else [message]
+        for subscription in subscriptions:
+            for event in events:
+                subscription.put(event)
+                self._stats["delivered"] += 1
+
+    @asynccontextmanager
+    async def subscribe(self, user_id):
+        subscription = Subscription(user_id, self.queue_size)
+        self._subscriptions[user_id].add(subscription)
+        self._start()
+        try:
+            yield subscription
+        finally:
+            self._stats["dropped"] += subscription.dropped
+            self._stats["coalesced"] += subscription.coalesced
+            sockets = self._subscriptions.get(user_id)
+            if sockets is not None:
+                sockets.discard(subscription)
+                if not sockets:
+                    del self._subscriptions[user_id]
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    def stats(self):
+        live = [s for sockets in self._subscriptions.values() for s in sockets]
+        return {
+            **self._stats,
+            "dropped": self._stats["dropped"] + sum(s.dropped for s in live),
+            "coalesced": self._stats["coalesced"] + sum(s.coalesced for s in live),
+            "users": len(self._subscriptions),
+            "sockets": len(live),
+            "buffered": sum(len(s) for s in live),
+        }
+
+
+WS_HUB = WorkflowHub()
@@ -8,6 +8,7 @@ import QueryRefiner from "./QueryRefiner";
 import VanishingMessageInput from "./VanishingMessageInput";
 import { useWorkflowLogs, LogMessage } from "./FetchLogs";
 import PublicDialogue from "./PublicDialogue"; // Import the new component
+import { useWorkflowList } from "./WorkflowList";
 import "./ChatStyles.css";
 import "./WorkflowLoadingAnimation.css";
 
@@ -25,16 +26,6 @@ type ChatMessage = {
   timestamp?: string;
 };
 
-interface Workflow {
-  id: string;
-  name: string;
-  json: string;
-  prompt: string;
-  active?: boolean;
-  public?: boolean; // Added public field
-  unavailable: string;
-}
-
 type QandA = {
   question: string;
   answer: string;
@@ -54,8 +45,18 @@ export default function MainLayout() {
   const [workflowJson, setWorkflowJson] = useState(null);
   const [showWorkflow, setShowWorkflow] = useState(false);
   const [loading, setLoading] = useState(false);
-  const [workflows, setWorkflows] = useState<Workflow[]>([]);
+  const {
+    workflows,
+    setWorkflows,
+    hasMore: hasMoreWorkflows,
+    loadingMore: loadingMoreWorkflows,
+    reload: fetchWorkflows,
+    loadMore: loadMoreWorkflows,
+  } = useWorkflowList();
   const [currentWorkflow, setCurrentWorkflow] = useState<string | null>(null);
+  // workflow_id of the workflow /create_agents just generated (not updated)
+  const [newWorkflowId, setNewWorkflowId] = useState<string | null>(null);
+  const clearNewWorkflow = useCallback(() => setNewWorkflowId(null), []);
   const [loadingStep, setLoadingStep] = useState<string>("");
   const [loadingProgress, setLoadingProgress] = useState<number>(0);
   const [bootPhase, setBootPhase] = useState(0);
@@ -391,26 +392,6 @@ export default function MainLayout() {
     }
   };
 
-  const fetchWorkflows = async () => {
-    try {
-      const token = await getToken();
-      const response = await fetch(
-        "https://backend.sigmoyd.in/sidebar_workflows",
-        {
-          headers: { Authorization: `Bearer ${token}` },
-        }
-      );
-
-      if (!response.ok)
-        throw new Error(`HTTP error! Status: ${response.status}`);
-
-      const data = await response.json();
-      setWorkflows(data);
-    } catch (error) {
-      console.error("Error fetching workflows:", error);
-    }
-  };
-
   const handleGenerateWorkflow = async (type: boolean) => {
     try {
       const token = await getToken();
@@ -463,6 +444,7 @@ export default function MainLayout() {
 
       const data = await response.json();
       setWorkflowJson(data.response); // This now includes nodes_requiring_input
+      setNewWorkflowId(type ? null : data.response.workflow_id);
       fetchWorkflows();
       setCurrentWorkflow(data.response.workflow_id);
       setShowWorkflow(true);
@@ -483,6 +465,7 @@ export default function MainLayout() {
     setQanda({});
     setRefinedQuery(null);
     setWorkflowJson(null);
+    setNewWorkflowId(null);
     setShowWorkflow(false);
     setCurrentWorkflow(null);
 
@@ -788,6 +771,9 @@ export default function MainLayout() {
         setShowWorkflow={setShowWorkflow}
         workflows={workflows}
         setWorkflows={setWorkflows}
+        hasMoreWorkflows={hasMoreWorkflows}
+        loadingMoreWorkflows={loadingMoreWorkflows}
+        onLoadMoreWorkflows={loadMoreWorkflows}
         currentWorkflow={currentWorkflow}
         setCurrentWorkflow={setCurrentWorkflow}
       />
@@ -894,8 +880,9 @@ export default function MainLayout() {
             <WorkflowGraph
               key={JSON.stringify(workflowJson)}
               workflowJson={workflowJson}
-              workflows={workflows}
-              setWorkflows={setWorkflows}
+              isNew={workflowJson.workflow_id === newWorkflowId}
+              onInputsProcessed={clearNewWorkflow}
+              onWorkflowsChanged={fetchWorkflows}
               setCurrentWorkflow={setCurrentWorkflow}
               currentWorkflow={currentWorkflow}
             />
@@ -1,4 +1,5 @@
 import { useEffect, useState, useRef } from "react";
+import { Workflow } from "./WorkflowList";
 import {
   X,
   Trash2,
@@ -21,19 +22,13 @@ interface SidebarProps {
   setShowWorkflow: (show: boolean) => void;
   workflows: Workflow[];
   setWorkflows: React.Dispatch<React.SetStateAction<Workflow[]>>;
+  hasMoreWorkflows: boolean; // more pages of /sidebar_workflows to fetch
+  loadingMoreWorkflows: boolean;
+  onLoadMoreWorkflows: () => void;
   currentWorkflow: string | null;
   setCurrentWorkflow: React.Dispatch<React.SetStateAction<string | null>>;
 }
 
-interface Workflow {
-  id: string;
-  name: string;
-  json: string;
-  prompt: string;
-  active?: boolean;
-  public?: boolean;  // Added this field
-}
-
 export default function Sidebar({
   show,
   onClose,
@@ -43,6 +38,9 @@ export default function Sidebar({
   setShowWorkflow,
   workflows,
   setWorkflows,
+  hasMoreWorkflows,
+  loadingMoreWorkflows,
+  onLoadMoreWorkflows,
   currentWorkflow,
   setCurrentWorkflow,
 }: SidebarProps) {
@@ -51,50 +49,41 @@ export default function Sidebar({
   const [isDeleting, setIsDeleting] = useState(false);
   const sidebarRef = useRef<HTMLDivElement>(null);
 
-  useEffect(() => {
-    let mounted = true;
-
-    const fetchWorkflows = async () => {
-      try {
-        const token = await getToken();
-        if (!mounted) return;
-
-        const response = await fetch("https://backend.sigmoyd.in/sidebar_workflows", {
-          headers: { Authorization: `Bearer ${token}` },
-        });
-
-        if (!mounted) return;
-
-        if (!response.ok)
-          throw new Error(`HTTP error! Status: ${response.status}`);
-
-        const data = await response.json();
-        if (mounted) {
-          setWorkflows(data);
-        }
-      } catch (error) {
-        if (mounted) {
-          console.error("Error fetching workflows:", error);
-        }
-      }
-    };
-
-    fetchWorkflows();
-    return () => {
-      mounted = false;
-    };
-  }, []); // Remove getToken from dependencies
+  // the list itself is loaded by MainLayout, the next page is fetched once
+  // the list is scrolled close to its end
+  const handleListScroll = (event: React.UIEvent<HTMLDivElement>) => {
+    const list = event.currentTarget;
+    if (
+      hasMoreWorkflows &&
+      list.scrollTop + list.clientHeight >= list.scrollHeight - 100
+    ) {
+      onLoadMoreWorkflows();
+    }
+  };
 
   // Handle workflow selection
-  const handleWorkflowClick = (workflowId: string) => {
+  const handleWorkflowClick = async (workflowId: string) => {
     const selectedWorkflow = workflows.find((w) => w.id === workflowId);
     if (!selectedWorkflow) return;
 
-    setCurrentWorkflow(workflowId);
-    setWorkflowJson(JSON.parse(selectedWorkflow.json));
-    console.log(JSON.parse(selectedWorkflow.json));
-    setRefinedQuery(selectedWorkflow.prompt);
-    setShowWorkflow(true);
+    // the sidebar list has no json, load the selected workflow on demand
+    try {
+      const token = await getToken();
+      const response = await fetch(
+        `https://backend.sigmoyd.in/workflow/${workflowId}`,
+        { headers: { Authorization: `Bearer ${token}` } }
+      );
+      if (!response.ok)
+        throw new Error(`HTTP error! Status: ${response.status}`);
+      const data = await response.json();
+
+      setCurrentWorkflow(workflowId);
+      setWorkflowJson(JSON.parse(data.json));
+      setRefinedQuery(data.prompt);
+      setShowWorkflow(true);
+    } catch (error) {
+      console.error("Error fetching workflow:", error);
+    }
   };
 
   // Handle workflow deletion
@@ -200,7 +189,7 @@ export default function Sidebar({
         </div>
 
         {/* Scrollable Workflow Section */}
-        <div className="overflow-y-auto flex-grow">
+        <div className="overflow-y-auto flex-grow" onScroll={handleListScroll}>
           {/* New Chat Button */}
           <div
             onClick={() => {
@@ -261,6 +250,16 @@ export default function Sidebar({
               </div>
             ))}
           </div>
+
+          {hasMoreWorkflows && (
+            <button
+              onClick={onLoadMoreWorkflows}
+              disabled={loadingMoreWorkflows}
+              className="w-full py-2 text-sm opacity-70 hover:opacity-100 transition-opacity"
+            >
+              {loadingMoreWorkflows ? "Loading..." : "Load more"}
+            </button>
+          )}
         </div>
 
         {/* Profile and Logout Section */}
@@ -58,19 +58,12 @@ interface WorkflowJson {
   }>;
 }
 
-interface Workflow {
-  id: string;
-  name: string;
-  json: string;
-  prompt: string;
-  active?: boolean;
-  public?: boolean; // Added public field
-}
-
 interface WorkflowGraphProps {
   workflowJson: WorkflowJson;
-  workflows: Workflow[];
-  setWorkflows: React.Dispatch<React.SetStateAction<Workflow[]>>;
+  // generated by /create_agents just now, its config inputs are asked for
+  isNew: boolean;
+  onInputsProcessed: () => void;
+  onWorkflowsChanged: () => void; // reloads the shared workflow list
 }
 
 // Enhanced node arrangement function for better visualization
@@ -335,8 +328,9 @@ const edgeTypes = {
 
 const WorkflowGraph: React.FC<WorkflowGraphProps> = ({
   workflowJson,
-  workflows,
-  setWorkflows,
+  isNew,
+  onInputsProcessed,
+  onWorkflowsChanged,
 }) => {
   const { getToken } = useAuth();
   const [loading, setLoading] = useState(false);
@@ -381,13 +375,18 @@ const WorkflowGraph: React.FC<WorkflowGraphProps> = ({
   useEffect(() => {
     setWorkflowData(workflowJson);
     
-    // Check if this is a new workflow based on whether it appears in the workflows list
-    const isNew = !workflows.some(w => w.id === workflowJson?.workflow_id);
+    // The sidebar list is paginated, an older workflow may not be loaded yet:
+    // "new" comes from the generation, not from the list
     setIsNewWorkflow(isNew);
     setProcessingComplete(false);
     
     console.log("changed flow");
-  }, [workflowJson, workflows]);
+  }, [workflowJson, isNew]);
+
+  // Inputs asked for once, reopening the workflow later doesn't ask again
+  useEffect(() => {
+    if (isNewWorkflow && processingComplete) onInputsProcessed();
+  }, [isNewWorkflow, processingComplete, onInputsProcessed]);
 
   useEffect(() => {
     const { nodes: newNodes, edges: newEdges } = generateNodesAndEdges(
@@ -580,7 +579,7 @@ const WorkflowGraph: React.FC<WorkflowGraphProps> = ({
 
       const responseData = await response.json();
       // setWorkflowData(responseData.json);
-      fetchWorkflows();
+      onWorkflowsChanged();
       console.log("Workflow with inputs saved successfully", responseData);
     } catch (error) {
       console.error("Error saving workflow with inputs:", error);
@@ -606,7 +605,7 @@ const WorkflowGraph: React.FC<WorkflowGraphProps> = ({
 
       const responseData = await response.json();
       // setWorkflowData(responseData.json);
-      fetchWorkflows();
+      onWorkflowsChanged();
       console.log("Workflow saved successfully:", responseData);
       alert("Workflow saved successfully!");
       setShowSaveButton(false);
@@ -615,23 +614,6 @@ const WorkflowGraph: React.FC<WorkflowGraphProps> = ({
     }
   };
 
-  const fetchWorkflows = async () => {
-    try {
-      const token = await getToken();
-      const response = await fetch("https://backend.sigmoyd.in/sidebar_workflows", {
-        headers: { Authorization: `Bearer ${token}` },
-      });
-
-      if (!response.ok)
-        throw new Error(`HTTP error! Status: ${response.status}`);
-
-      const data = await response.json();
-      setWorkflows(data);
-    } catch (error) {
-      console.error("Error fetching workflows:", error);
-    }
-  };
-
   const { nodes: initialNodes, edges: initialEdges } = generateNodesAndEdges(
     workflowJson,
     handleValueChange
@@ -691,7 +673,7 @@ const WorkflowGraph: React.FC<WorkflowGraphProps> = ({
       setLoadingStep("");
       setLoadingProgress(0);
       setBootComplete(true);
-      fetchWorkflows();
+      onWorkflowsChanged();
       if (!response.ok) {
         const responseData = await response.json();
         console.error(
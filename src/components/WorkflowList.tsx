@@ -0,0 +1,88 @@
+import { useCallback, useRef, useState } from "react";
+import { useAuth } from "@clerk/clerk-react";
+
+// Sidebar summary of a workflow, the full json comes from /workflow/{id}
+export interface Workflow {
+  id: string;
+  name: string;
+  prompt: string;
+  active?: boolean;
+  public?: boolean;
+  trigger?: string;
+}
+
+const SIDEBAR_WORKFLOWS_URL = "https://backend.sigmoyd.in/sidebar_workflows";
+
+// One paginated list of the user's workflows, shared by every component.
+// /sidebar_workflows returns a page and the next page's cursor in
+// X-Next-Cursor: reload() starts over with the first page (after a workflow
+// was generated or saved), loadMore() appends the next one when the sidebar
+// is scrolled to its end or "Load more" is clicked.
+export const useWorkflowList = () => {
+  const { getToken } = useAuth();
+  const [workflows, setWorkflows] = useState<Workflow[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const inFlight = useRef(false);
+  // bumped by reload, a page fetched for an older list is dropped
+  const generation = useRef(0);
+
+  const fetchPage = useCallback(
+    async (cursor: string | null) => {
+      const token = await getToken();
+      const url = cursor
+        ? `${SIDEBAR_WORKFLOWS_URL}?cursor=${encodeURIComponent(cursor)}`
+        : SIDEBAR_WORKFLOWS_URL;
+      const response = await fetch(url, {
+        headers: { Authorization: `Bearer ${token}` },
+      });
+      if (!response.ok)
+        throw new Error(`HTTP error! Status: ${response.status}`);
+      const page: Workflow[] = await response.json();
+      return { page, cursor: response.headers.get("X-Next-Cursor") };
+    },
+    [getToken]
+  );
+
+  const reload = useCallback(async () => {
+    const current = ++generation.current;
+    try {
+      const { page, cursor } = await fetchPage(null);
+      if (current !== generation.current) return;
+      setWorkflows(page);
+      setNextCursor(cursor);
+    } catch (error) {
+      console.error("Error fetching workflows:", error);
+    }
+  }, [fetchPage]);
+
+  const loadMore = useCallback(async () => {
+    if (!nextCursor || inFlight.current) return;
+    const current = generation.current;
+    inFlight.current = true;
+    setLoadingMore(true);
+    try {
+      const { page, cursor } = await fetchPage(nextCursor);
+      if (current !== generation.current) return;
+      setWorkflows((loaded) => {
+        const seen = new Set(loaded.map((w) => w.id));
+        return loaded.concat(page.filter((w) => !seen.has(w.id)));
+      });
+      setNextCursor(cursor);
+    } catch (error) {
+      console.error("Error fetching more workflows:", error);
+    } finally {
+      inFlight.current = false;
+      setLoadingMore(false);
+    }
+  }, [fetchPage, nextCursor]);
+
+  return {
+    workflows,
+    setWorkflows,
+    hasMore: nextCursor !== null,
+    loadingMore,
+    reload,
+    loadMore,
+  };
+};